@@ -34,6 +34,9 @@ from time import sleep
 import json
 import csv
 
+from pcr_measurements import MeasurementPool
+from pcr_settling import SettlingDetector
+
        
 
 # from awgClient import AWGClient
@@ -593,6 +596,12 @@ class CoincidenceExample(QMainWindow):
         # making array for plotting 
         I_b = numpy.asarray(I_det,dtype = 'float')
 
+        # One Countrate over both gates for the whole sweep, re-armed per bias point
+        pool = MeasurementPool(self.tagger)
+        cr_gated = pool.countrate([self.filtered_on.getChannel(), self.filtered_off.getChannel()])
+        # Start integrating once the detector rate is stationary; the old 1 s wait is the cap
+        settler = SettlingDetector(pool, [self.active_channels[2]])
+
         for i in range(len(I_b)):
         # for bias in range(offset):
             source.setVoltage(offset[i])
@@ -602,27 +611,19 @@ class CoincidenceExample(QMainWindow):
             #wf.filter_channel(10,f[i])
             # wf.gating_channel(offset[i])
             # wf.phase_sync()
-            time.sleep(1)
+            bias_set_at = time.monotonic()
+            settler.wait(bias_set_at, bias_set_at + 1)
             # cr = Countrate(self.tagger, [self.filtered.getChannel()])
 
-            cr_on = Countrate(self.tagger, [self.filtered_on.getChannel()])
-            cr_off = Countrate(self.tagger, [self.filtered_off.getChannel()])
-
             #cr = Countrate(self.tagger, [-5])
             #cr = Countrate(self.tagger, [9])
-            cr_on.startFor(int(int_time),clear = True) #in picoseconds
-            cr_off.startFor(int(int_time),clear = True) #in picoseconds
-            cr_on.waitUntilFinished()
-            cr_off.waitUntilFinished()
-
-            clicks_on = cr_on.getCountsTotal()
-            clicks_off = cr_off.getCountsTotal()
+            clicks_on, clicks_off = pool.acquire(cr_gated, int(int_time)).getCountsTotal() #in picoseconds
 
 
-            Counts.append(clicks_on[0] - clicks_off[0])
+            Counts.append(clicks_on - clicks_off)
             x_vals.append(I_b[i])
             y_vals.append(Counts[i])
-            darkcounts.append(clicks_off[0])
+            darkcounts.append(clicks_off)
             plt.scatter(x_vals,y_vals, color="darkred", s=10)
             plt.scatter(x_vals, darkcounts, color="black", s=10)
             plt.plot(x_vals,y_vals, color="darkred")
@@ -631,13 +632,14 @@ class CoincidenceExample(QMainWindow):
             plt.xlabel("Bias Current (uA)")
             plt.ylabel("Counts")
             plt.draw()
-            plt.pause(1)
+            plt.pause(0.05)  # only needs to let the figure redraw
 
             if i < (len(I_b)-1):
                 # don't clear at the end so the figure is visible and 
                 # you can interact with it
                 fig.clear()
     
+        pool.clear()
         plt.show() 
 
         print('Finished PCR Curve')
@@ -5,12 +5,16 @@ from PySide2.QtWidgets import QMainWindow, QApplication, QFileDialog, QDialog, Q
 from PySide2.QtCore import QTimer
 from PySide2.QtGui import QPalette, QColor
 
-from snspd_measure.inst.sim900 import sim928
-
 # Import client instruments
 from client_keysight33622A import ClientKeysight33622A
 from client_keysightE36312A import ClientKeysightE36312A
 
+from sim928_connection import SIM928Connection
+from pcr_journal import SweepJournal
+from pcr_measurements import MeasurementPool
+from pcr_settling import SettlingDetector
+from pcr_runner import GatingGraph, PCRSweepRunner, parse_sweep_params, shutdown_instruments
+
 # matplotlib for the plots, including its Qt backend
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg, NavigationToolbar2QT
 from matplotlib.figure import Figure
@@ -32,15 +36,13 @@ from matplotlib.colors import LogNorm
 import yaml
 
 # all required TimeTagger dependencies
-from TimeTagger import Coincidences, Histogram2D, Counter, Correlation, createTimeTagger, freeTimeTagger, Histogram, FileWriter, FileReader, TT_CHANNEL_FALLING_EDGES, Resolution, DelayedChannel, GatedChannel, Countrate, CHANNEL_UNUSED
+from TimeTagger import Coincidences, Histogram2D, Counter, Correlation, createTimeTagger, freeTimeTagger, Histogram, FileWriter, FileReader, TT_CHANNEL_FALLING_EDGES, Resolution, CHANNEL_UNUSED
 from time import sleep
 
 import json
 import csv
 import os.path
 
-import serial # Import serial for exception handling
-import termios # Import termios for catching specific OS error
 
 # from awgClient import AWGClient
 
@@ -230,6 +232,10 @@ class CoincidenceExample(QMainWindow):
         self.ui.triggerScanButton.clicked.connect(self.open_sim928_control)
         self.ui.clearButton.clicked.connect(self.open_keysight33622A_control)
         self.ui.saveButton.clicked.connect(self.saveHistogram)
+        # Not in the designer file; added here next to the PCR button
+        self.resumePCRButton = QPushButton("Resume PCR", self)
+        self.resumePCRButton.clicked.connect(self.resumePCR)
+        self.ui.horizontalLayout_2.insertWidget(1, self.resumePCRButton)
         # self.ui.saveTagsButton.clicked.connect(self.saveTagsSimple)
         # self.ui.TraceGen.clicked.connect(self.saveTrace)
 
@@ -271,6 +277,7 @@ class CoincidenceExample(QMainWindow):
         self.fig = Figure()
         self.counterAxis = self.fig.add_subplot(211)
         self.correlationAxis = self.fig.add_subplot(212)
+        self.sweepAxis = None  # PCR/DCR sweep curves, added below the other two by the first sweep
         self.canvas = FigureCanvasQTAgg(self.fig)
         self.toolbar = NavigationToolbar2QT(self.canvas, self)
         self.ui.plotLayout.addWidget(self.toolbar)
@@ -278,36 +285,10 @@ class CoincidenceExample(QMainWindow):
 
         self.masked_hist_bins = 2
 
-        # --- Added for robust connection ---
-        self.source_port = '/dev/ttyUSB0' # Initial port
-        self.possible_ports = ['/dev/ttyUSB0', '/dev/ttyUSB1', '/dev/ttyUSB2'] # Ports to try
-        self.source_gpib_addr = 2 # Assuming fixed GPIB address
-        self.source_slot = 1      # Assuming fixed slot
-        # --- End Added ---
-
-        # Initialize source
-        try:
-            self.source = sim928(self.source_port, self.source_gpib_addr, self.source_slot)
-            self.source.connect()
-            self.source.turnOn()
-        except serial.SerialException as e:
-            print(f"Initial connection to SIM928 failed on {self.source_port}: {e}")
-            # Optionally try the other port immediately
-            current_index = self.possible_ports.index(self.source_port)
-            next_index = (current_index + 1) % len(self.possible_ports)
-            self.source_port = self.possible_ports[next_index]
-            print(f"Trying alternative port: {self.source_port}")
-            try:
-                self.source = sim928(self.source_port, self.source_gpib_addr, self.source_slot)
-                self.source.connect()
-                self.source.turnOn()
-                print(f"Successfully connected to {self.source_port}")
-            except serial.SerialException as e2:
-                 print(f"Connection failed on alternative port {self.source_port}: {e2}")
-                 # Handle failure - maybe disable PCR button or show error message
-                 self.source = None # Indicate source is not available
-                 # You might want to disable the PCR button here
-                 # self.ui.PCRButton.setEnabled(False)
+        # SIM928 bias source; cycles through the USB-serial ports on failure
+        self.sim928 = SIM928Connection(port='/dev/ttyUSB0', possible_ports=['/dev/ttyUSB0', '/dev/ttyUSB1', '/dev/ttyUSB2'],
+                                       gpib_addr=2, slot=1)
+        self.sim928.connect()
 
         # Initialize Keysight instruments
         try:
@@ -331,6 +312,7 @@ class CoincidenceExample(QMainWindow):
         self.running = True
         self.measurements_dirty = False
         self.tagger = tagger
+        self.measurement_pool = MeasurementPool(tagger)
         self.IntType = "Rolling"
         self.last_channels = [9, -5, -14, 18]
         self.active_channels = []
@@ -534,31 +516,16 @@ class CoincidenceExample(QMainWindow):
         print(self.active_channels)
 
 
-        on_start = 30
-        on_stop = 270
-        off_start = 450
-        off_stop = 950
+        # Pooled sweep measurements refer to the virtual channels recreated below
+        self.measurement_pool.clear()
 
         # for us right now (oct 9 2024), self.active_channels[2] (3rd row) is 5, which is the snspd
-        self.filtered = GatedChannel(self.tagger, self.active_channels[2], self.active_channels[0], -self.active_channels[0])
-        self.delay_1_start = DelayedChannel(self.tagger, self.active_channels[0], int(on_start*1e9))
-        self.delay_1_stop = DelayedChannel(self.tagger, self.active_channels[0], int(on_stop*1e9))
-
-        self.delay_2_start = DelayedChannel(self.tagger, self.active_channels[0], int(off_start*1e9))
-
-        self.delay_2_stop = DelayedChannel(self.tagger, self.active_channels[0], int(off_stop*1e9))
-        # self.delay_2_stop = DelayedChannel(self.tagger, self.active_channels[0], int(800e9))
-
-
-        self.ratio_on = (on_stop - on_start) / 1000
-        self.ratio_off = (off_stop - off_start) / 1000
-
-
-        # thermal source on
-        self.filtered_on = GatedChannel(self.tagger, self.active_channels[2], self.delay_1_start.getChannel(), self.delay_1_stop.getChannel())
-
-        # thermal source off
-        self.filtered_off = GatedChannel(self.tagger, self.active_channels[2], self.delay_2_start.getChannel(), self.delay_2_stop.getChannel())
+        self.gating = GatingGraph(self.tagger, self.active_channels[0], self.active_channels[2])
+        self.filtered = self.gating.filtered
+        self.ratio_on = self.gating.ratio_on
+        self.ratio_off = self.gating.ratio_off
+        self.filtered_on = self.gating.filtered_on  # thermal source on
+        self.filtered_off = self.gating.filtered_off  # thermal source off
 
 
         # Measure the correlation between A and B
@@ -856,114 +823,35 @@ class CoincidenceExample(QMainWindow):
 
     def _set_source_voltage_robustly(self, voltage):
         """Attempts to set the voltage on the SIM928 source, handling disconnections."""
-        max_retries = 1 # Try original port, then the other port once
-        retries = 0
-        set_voltage_success = False
-        while retries <= max_retries and not set_voltage_success:
-            try:
-                if not self.source: # Check if source was initialized
-                     print("Error: SIM928 source not available.")
-                     return False # Cannot set voltage if source is not available
-
-                print(f"Attempting to set voltage {voltage:.3f} V on {self.source_port}...")
-                self.source.setVoltage(voltage)
-                set_voltage_success = True
-                print(f"Successfully set Voltage: {voltage:.3f} V")
-                return True # Voltage set successfully
-
-            except (serial.SerialException, termios.error) as e: # Catch both SerialException and termios.error
-                print(f"Serial/OS error setting voltage on {self.source_port}: {e}")
-                retries += 1
-                if retries > max_retries:
-                    print("Max retries reached for setting voltage.")
-                    break # Exit the while loop
-
-                print("Attempting to reconnect to alternative port...")
-                try:
-                    self.source.disconnect()
-                except Exception as disconnect_e:
-                    print(f"Note: Error during disconnect (may already be closed): {disconnect_e}")
-
-                # Cycle port
-                current_index = self.possible_ports.index(self.source_port)
-                next_index = (current_index + 1) % len(self.possible_ports)
-                self.source_port = self.possible_ports[next_index]
-                print(f"Trying port: {self.source_port}")
-
-                try:
-                    # Recreate and connect
-                    self.source = sim928(self.source_port, self.source_gpib_addr, self.source_slot)
-                    self.source.connect()
-                    self.source.turnOn()
-                    print(f"Successfully reconnected to {self.source_port}.")
-                    # Retry setting voltage in the next loop iteration
-                except (serial.SerialException, termios.error) as e2: # Also catch termios error on reconnect
-                    print(f"Reconnect failed on {self.source_port}: {e2}")
-                    # If reconnect fails, break the retry loop for this bias point
-                    break
-                except Exception as general_e:
-                    print(f"Unexpected error during reconnect: {general_e}")
-                    break
-
-            except Exception as general_e:
-                 print(f"Unexpected error setting voltage: {general_e}")
-                 # Decide how to handle unexpected errors, e.g., skip point
-                 break # Exit retry loop
-
-        # If loop finishes without success
-        return False
+        return self.sim928.set_voltage_robustly(voltage)
 
+    @property
+    def source(self):
+        """The sim928 instrument, or None if it is not connected"""
+        return self.sim928.source
 
     def _shutdown_instruments(self, params):
         """
         Shutdown instruments based on YAML configuration
         """
-        try:
-            shutdown_config = params.get('turn_off_after_pcr', {})
-            print("Shutting down instruments...")
-            
-            # Turn off SIM928
-            if shutdown_config.get('sim928', False):
-                try:
-                    if self.source is not None:
-                        self.source.turnOff()
-                        print("SIM928 turned off successfully")
-                    else:
-                        print("SIM928 not available for shutdown")
-                except Exception as e:
-                    print(f"Error turning off SIM928: {e}")
-            
-            # Turn off cryo_amp (channel 3 of power supply)
-            if shutdown_config.get('cryo_amp', False):
-                try:
-                    if self.power_supply is not None:
-                        self.power_supply.output_off(3)
-                        print("Cryo amp (channel 3) turned off successfully")
-                    else:
-                        print("Power supply not available for cryo amp shutdown")
-                except Exception as e:
-                    print(f"Error turning off cryo amp: {e}")
-            
-            # Turn off thermal_source (channel 2 of function generator)
-            if shutdown_config.get('thermal_source', False):
-                try:
-                    if self.function_gen is not None:
-                        self.function_gen.set_output(2, 0)
-                        print("Thermal source (channel 2) turned off successfully")
-                    else:
-                        print("Function generator not available for thermal source shutdown")
-                except Exception as e:
-                    print(f"Error turning off thermal source: {e}")
-                    
-        except Exception as e:
-            print(f"Error in instrument shutdown: {e}")
+        shutdown_instruments(params, self.source, self.power_supply, self.function_gen)
+
+    def _sweep_axis(self):
+        """Sweep curve axis, added as a third row by the first sweep so the live plots keep full height until then"""
+        if self.sweepAxis is None:
+            grid = self.fig.add_gridspec(3, 1)
+            self.counterAxis.set_subplotspec(grid[0])
+            self.correlationAxis.set_subplotspec(grid[1])
+            self.sweepAxis = self.fig.add_subplot(grid[2])
+            self.fig.tight_layout()
+        return self.sweepAxis
+
+    def _flush_sweep_plot(self):
+        """Schedule a redraw of the main window canvas and let Qt process it without blocking"""
+        self.canvas.draw_idle()
+        QApplication.processEvents()
 
     def PCR(self):
-        import yaml
-        import os.path
-
-        
-
         params_file = "./PCR_multi_trigger_params.yml"
         
         # Always load parameters from YAML file
@@ -975,58 +863,16 @@ class CoincidenceExample(QMainWindow):
             with open(params_file, 'r') as file:
                 params = yaml.safe_load(file)
             print("Parameters loaded from file.")
-
-            fudge_factor = params['fudge_factor']
-
-            self.ratio_on_fudged = self.ratio_on * fudge_factor
-            self.ratio_off_fudged = self.ratio_off / fudge_factor
-
-            # Extract common parameters
-            Start = params['voltage']['start']
-            Stop = params['voltage']['stop']
-            Step = params['voltage']['step']
-            int_time_sec = params['integration_time']
-            measurement_type = params.get('measurement_type', 'filtered_pcr').lower()
-            
-            print(f"Measurement type: {measurement_type}")
-            
-            # Extract measurement-specific parameters
-            if measurement_type == 'filtered_pcr':
-                trigger_levels = params['filtered_PCR']['trigger_levels']
-                if not isinstance(trigger_levels, list) or not trigger_levels:
-                    print("Error: 'trigger_levels' in filtered_PCR YAML must be a non-empty list.")
-                    return
-                num_trigger_levels = len(trigger_levels)
-                print(f"Using {num_trigger_levels} trigger levels: {trigger_levels}")
-            elif measurement_type == 'dcr':
-                # Support both old single trigger_level and new trigger_levels list
-                if 'trigger_levels' in params['DCR']:
-                    trigger_levels = params['DCR']['trigger_levels']
-                    if not isinstance(trigger_levels, list) or not trigger_levels:
-                        print("Error: 'trigger_levels' in DCR YAML must be a non-empty list.")
-                        return
-                elif 'trigger_level' in params['DCR']:
-                    # Backward compatibility with single trigger level
-                    trigger_level = params['DCR']['trigger_level']
-                    trigger_levels = [str(trigger_level)]
-                    print("Using single DCR trigger level (backward compatibility mode)")
-                else:
-                    print("Error: DCR section must contain either 'trigger_levels' (list) or 'trigger_level' (single value).")
-                    return
-                
-                num_trigger_levels = len(trigger_levels)
-                print(f"Using {num_trigger_levels} DCR trigger levels: {trigger_levels}")
-            else:
-                print(f"Error: Unknown measurement type '{measurement_type}'. Must be 'filtered_pcr' or 'dcr'.")
-                return
-
-        except (yaml.YAMLError, KeyError, TypeError) as e:
+        except yaml.YAMLError as e:
             print(f"Error loading or parsing parameters from '{params_file}': {e}")
             return # Exit on error
         except Exception as e:
              print(f"An unexpected error occurred while loading parameters: {e}")
              return
 
+        if parse_sweep_params(params) is None:
+            return
+
         # Get save location first using file dialog
         filename, _ = QFileDialog().getSaveFileName(
             parent=self,
@@ -1044,263 +890,50 @@ class CoincidenceExample(QMainWindow):
         # Ensure we have a .csv extension for the CSV file
         if not filename.lower().endswith('.csv'):
             filename += '.csv'
-        
-        # Create the base filename for the PNG (remove .csv and we'll add .png later)
-        png_filename = filename[:-4] if filename.lower().endswith('.csv') else filename
-        png_filename += '.png'
-        
-        # V_pp = 0.090  # in V # This seems unused, consider removing if not needed elsewhere
-        offset = numpy.arange(Start, Stop + Step, Step) # Corrected range to include Stop properly
-        # Ensure Stop is included if the step doesn't divide the range perfectly
-        if not numpy.isclose(offset[-1], Stop):
-             offset = numpy.append(offset, Stop)
-
-        I_det = []
-        int_time = int(float(int_time_sec)*1e12)
-        print("Integration time (ps): ", int_time)
-        
-        # For DCR measurements, calculate number of bins (0.1 second each)
-        bin_duration = 0.1  # 0.1 second per bin (used for all measurements)
-        if measurement_type == 'dcr':
-            num_bins = int(int_time_sec / bin_duration)  # Total number of bins
-            bin_time_ps = int(bin_duration * 1e12)  # 0.1 second in picoseconds
-            print(f"DCR measurement: {num_bins} bins of {bin_duration} seconds each")
-        else:
-            num_bins = 1
-            bin_time_ps = int_time
-        
-        Counts = [[] for _ in range(num_trigger_levels)]  # Store counts for each trigger level
-        Counts_off = [[] for _ in range(num_trigger_levels)] if measurement_type == 'filtered_pcr' else None # Store dark counts for filtered PCR
-        
-        # Use matplotlib's default color cycle
-        prop_cycle = plt.rcParams['axes.prop_cycle']
-        colors = prop_cycle.by_key()['color']
 
-        fig, ax = plt.subplots() # Use ax for plotting
-        x_vals = []
-        print(f"Estimated completion time (minutes): {round((int_time_sec * num_trigger_levels + 0.2 * num_trigger_levels)/60 * len(offset), 2)}") # Adjusted estimate
-        
-        # Determining Bias at the Detector
-        for v_offset in offset:
-            # Assuming 1.02 MOhm series resistance for current calculation
-            # Verify this calculation is correct for your setup
-            I_det.append(((v_offset / 1.02e6) * 1e6).round(4))  # in uA
-    
-        I_b = numpy.asarray(I_det, dtype='float')
-    
-        for i in range(len(I_b)): # Iterate through bias currents/voltages
-            # --- Set Voltage Robustly ---
-            set_voltage_success = self._set_source_voltage_robustly(offset[i])
-            # --- End Set Voltage Robustly ---
-
-            # If setting voltage failed after retries, skip the rest of the loop for this bias
-            if not set_voltage_success:
-                print(f"Skipping measurements for bias voltage index {i} (Voltage: {offset[i]:.3f} V) due to connection issues.")
-                # Ensure lists have consistent lengths if skipping, e.g., append NaN or skip appending later
-                # For simplicity here, we just continue to the next bias voltage.
-                # Depending on plotting logic, you might need placeholder values.
-
-                # Append NaN or placeholder to keep plot arrays aligned
-                x_vals.append(I_b[i]) # Keep x-axis value
-                for j in range(num_trigger_levels):
-                    if measurement_type == 'filtered_pcr':
-                        Counts[j].append(numpy.nan) # Use NaN for missing data
-                        if Counts_off is not None:
-                            Counts_off[j].append(numpy.nan)
-                    else:  # dcr measurement
-                        # For DCR, append an array of NaN values to match the expected structure
-                        Counts[j].append(numpy.full(num_bins, numpy.nan))
-
-                continue # Skip to the next value of i in the outer loop
-
-            current_bias_ua = I_b[i]
-            x_vals.append(current_bias_ua) # Append current bias value for plotting
-            # print(f"\nBias: {current_bias_ua} uA") # Simplified print
-
-            # Set up measurement channels based on measurement type
-            if measurement_type == 'filtered_pcr':
-                cr_on = Counter(self.tagger, [self.filtered_on.getChannel()], binwidth=int_time, n_values=1)
-                cr_off = Counter(self.tagger, [self.filtered_off.getChannel()], binwidth=int_time, n_values=1)
-                cr_dcr = None
-            else:  # dcr measurement
-                cr_dcr = Counter(self.tagger, [self.active_channels[2]], binwidth=bin_time_ps, n_values=num_bins)
-                cr_on = None
-                cr_off = None
-
-            for j, trigger_level in enumerate(trigger_levels): # Iterate through trigger levels
-                trigger_level_float = float(trigger_level) # Ensure it's float
-                self.tagger.setTriggerLevel(self.ui.channelC.value(), trigger_level_float)
-                # Optional: Add a small delay after setting trigger level if needed
-                # time.sleep(0.05)
-                # Verify trigger level was set (optional)
-                # actual_trigger = self.tagger.getTriggerLevel(self.ui.channelC.value())
-                # print(f"  Trigger Level {j+1}/{num_trigger_levels}: Set={trigger_level_float:.3f} V")#, Actual={actual_trigger:.3f} V")
-                print(f"  Measuring Trigger Level: {trigger_level_float:.3f} V")
-
-                time.sleep(0.2) # Delay before measurement
-    
-                if measurement_type == 'filtered_pcr' and cr_on is not None and cr_off is not None:
-                    # Filtered PCR measurement
-                    # Start measurements
-                    cr_on.startFor(int_time, clear=True)
-                    cr_off.startFor(int_time, clear=True)
-                    
-                    # Wait for measurements to complete
-                    cr_on.waitUntilFinished()
-                    cr_off.waitUntilFinished()
-        
-                    clicks_on = cr_on.getData() 
-                    clicks_off = cr_off.getData() 
-
-                    count = (clicks_on[0][0]/ (self.ratio_on_fudged*int_time_sec)) - (clicks_off[0][0]/ (self.ratio_off_fudged*int_time_sec)) # Calculate counts for this trigger level
-                    dark_count = (clicks_off[0][0]/ (self.ratio_off_fudged*int_time_sec))
-
-                    Counts[j].append(count)
-                    if Counts_off is not None:
-                        Counts_off[j].append(dark_count) # Store dark counts for this trigger level
-                    print(f"    Signal Counts: {count}, Dark Counts: {dark_count}")
-                    
-                elif measurement_type == 'dcr' and cr_dcr is not None:
-                    # DCR measurement - direct count on active_channels[2] with multiple bins
-                    cr_dcr.startFor(int_time, clear=True)
-                    cr_dcr.waitUntilFinished()
-                    
-                    clicks_data = cr_dcr.getData()  # This returns a 2D array: [channels][bins]
-                    bin_counts = clicks_data[0]  # Get data for first (and only) channel
-                    
-                    # Convert to counts per second for each bin
-                    bin_counts_per_sec = bin_counts / bin_duration
-                    
-                    # Store the entire array of bin counts
-                    Counts[j].append(bin_counts_per_sec)
-                    
-                    # Calculate average for printing
-                    avg_count = numpy.mean(bin_counts_per_sec)
-                    print(f"    DCR Counts (avg): {avg_count:.2f} Hz, {num_bins} bins")
-
-            # --- Plotting Update ---
-            ax.clear() # Clear previous plot data for redraw
-            for j in range(num_trigger_levels):
-                color = colors[j % len(colors)] # Cycle through colors
-                
-                if measurement_type == 'filtered_pcr':
-                    trigger_label = f'TL {j+1}: {trigger_levels[j]}'
-                    dark_label = f'Dark TL {j+1}'
-                    
-                    # Filter out NaN values for plotting lines/scatter
-                    valid_indices = ~numpy.isnan(Counts[j])
-                    valid_x = numpy.array(x_vals)[valid_indices]
-                    valid_counts = numpy.array(Counts[j])[valid_indices]
-                    if Counts_off is not None:
-                        valid_counts_off = numpy.array(Counts_off[j])[valid_indices]
-                    else:
-                        valid_counts_off = numpy.array([])
-
-                    # Plot signal counts (scatter and line) - only plot valid points
-                    ax.scatter(valid_x, valid_counts, color=color, s=10, label=trigger_label if i == len(I_b) - 1 else None) # Label only on last iteration
-                    ax.plot(valid_x, valid_counts, color=color)
-
-                    # Plot dark counts (line, dashed) - only plot valid points
-                    if len(valid_counts_off) > 0:
-                        ax.plot(valid_x, valid_counts_off, color=color, linestyle='--', label=dark_label if i == len(I_b) - 1 else None) # Label only on last iteration
-                    
-                    ax.set_title("Gated PCR Curve")
-                    
-                else:  # dcr measurement
-                    dcr_label = f'DCR TL: {trigger_levels[j]}'
-                    
-                    # For DCR, Counts[j] contains arrays, so we need to calculate averages for plotting
-                    avg_counts = []
-                    for count_array in Counts[j]:
-                        if isinstance(count_array, numpy.ndarray):
-                            avg_counts.append(numpy.mean(count_array))
-                        else:
-                            avg_counts.append(count_array if not numpy.isnan(count_array) else numpy.nan)
-                    
-                    # Filter out NaN values for plotting
-                    valid_indices = ~numpy.isnan(avg_counts)
-                    valid_x = numpy.array(x_vals)[valid_indices]
-                    valid_avg_counts = numpy.array(avg_counts)[valid_indices]
-
-                    # Plot DCR counts (using averages)
-                    ax.scatter(valid_x, valid_avg_counts, color=color, s=10, label=dcr_label if i == len(I_b) - 1 else None)
-                    ax.plot(valid_x, valid_avg_counts, color=color)
-
-                    ax.set_title("DCR Curve")
-            
-            ax.set_xlabel("Bias Current (uA)")
-            ax.set_ylabel("Counts")
-            ax.grid(True) # Add grid
-            plt.draw()
-            plt.pause(0.1) # Shorter pause
+        self._run_pcr_sweep(params, filename)
 
-        ax.legend(loc='best')
+    def resumePCR(self):
+        """Resume an interrupted PCR/DCR sweep from its journal file"""
+        journal_path, _ = QFileDialog().getOpenFileName(
+            parent=self,
+            caption='Resume PCR Sweep From Journal',
+            filter='Sweep Journals (*.journal.jsonl);;All Files (*)',
+            options=QFileDialog.DontUseNativeDialog
+        )
+        if not journal_path:
+            print("Resume cancelled.")
+            return
 
-        # Save the final plot figure as PNG
         try:
-            plt.savefig(png_filename, dpi=300, bbox_inches='tight')
-            print(f"Plot saved as: {png_filename}")
+            header, points = SweepJournal.load(journal_path)
         except Exception as e:
-            print(f"Error saving plot: {e}")
+            print(f"Error reading journal '{journal_path}': {e}")
+            return
 
-        # Show the final plot (optional, can be blocking)
-        # plt.show()
-    
-        print(f'Finished {measurement_type.upper()} Curve Measurement.')
-    
-        # --- CSV Writing Update ---
+        # The sweep runs with the parameter snapshot taken when it started, not the current YAML
+        params = header['params']
+        if parse_sweep_params(params) is None:
+            return
+        print(f"Resuming sweep started {header['started']}: {len(points)} completed points in journal")
+        self._run_pcr_sweep(params, header['filename'], resume_points=points, journal_path=journal_path)
+
+    def _run_pcr_sweep(self, params, filename, resume_points=None, journal_path=None):
+        """
+        Run a filtered PCR or DCR sweep into the main window's sweep axis, then shut instruments down.
+        Points found in resume_points (from SweepJournal.load) are replayed instead of measured.
+        """
+        runner = PCRSweepRunner(self.tagger, self.gating, self.ui.channelC.value(), self._set_source_voltage_robustly,
+                                self.measurement_pool, plot_axis=self._sweep_axis(), flush_plot=self._flush_sweep_plot,
+                                power_supply=self.power_supply)
+
+        # The live counter/histogram redraw would compete with the sweep plot for frame time
+        self.timer.stop()
         try:
-            with open(filename, 'w', newline='') as csvfile:
-                csvwriter = csv.writer(csvfile)
-                # Dynamically generate header based on measurement type
-                header = ['Bias_Current']
-                if measurement_type == 'filtered_pcr':
-                    for j, tl in enumerate(trigger_levels):
-                        header.append(f'Counts_TL{j+1}({tl})')
-                    for j, tl in enumerate(trigger_levels):
-                        header.append(f'DCounts_TL{j+1}({tl})')
-                else:  # dcr - create columns for each bin
-                    for j, tl in enumerate(trigger_levels):
-                        for bin_idx in range(num_bins):
-                            header.append(f'DCR_TL{j+1}({tl})_Bin{bin_idx+1}')
-                        
-                csvwriter.writerow(header)
-
-                # Write data rows
-                for row_idx in range(len(I_b)):
-                    row = [I_b[row_idx]]
-                    
-                    if measurement_type == 'filtered_pcr':
-                        # Append signal counts for this bias
-                        for tl_idx in range(num_trigger_levels):
-                            # Handle potential NaN values when writing to CSV (replace with empty string or specific value)
-                            count_val = Counts[tl_idx][row_idx]
-                            row.append(count_val if not numpy.isnan(count_val) else '')
-                        
-                        # Append dark counts only for filtered PCR
-                        if Counts_off is not None:
-                            for tl_idx in range(num_trigger_levels):
-                                dcount_val = Counts_off[tl_idx][row_idx]
-                                row.append(dcount_val if not numpy.isnan(dcount_val) else '')
-                    
-                    else:  # dcr - write all bins for each trigger level
-                        for tl_idx in range(num_trigger_levels):
-                            count_data = Counts[tl_idx][row_idx]
-                            if isinstance(count_data, numpy.ndarray):
-                                # Write each bin value
-                                for bin_val in count_data:
-                                    row.append(bin_val if not numpy.isnan(bin_val) else '')
-                            else:
-                                # Handle case where it's a single value (e.g., NaN for failed measurements)
-                                for bin_idx in range(num_bins):
-                                    row.append(count_data if not numpy.isnan(count_data) else '')
-                    
-                    csvwriter.writerow(row)
-
-            print(f"CSV data saved as: {filename}")
-        except Exception as e:
-            print(f"Error writing CSV file: {e}")
-        
+            runner.run(params, filename, resume_points=resume_points, journal_path=journal_path)
+        finally:
+            self.timer.start(200)
+
         time.sleep(0.5) 
         # Shutdown instruments based on YAML configuration
         self._shutdown_instruments(params)
@@ -1358,12 +991,18 @@ class CoincidenceExample(QMainWindow):
 
         self.correlation.stop()
         self.correlation.clear()
-        sleep(1)
+
+        # Each row starts once the scanned input's rate is stationary; the old fixed sleeps are the caps
+        settle_pool = MeasurementPool(self.tagger)
+        settler = SettlingDetector(settle_pool, [channels[ch]])
+        changed_at = time.monotonic()
+        settler.wait(changed_at, changed_at + 1)
         for i in range(len(self.scopeBlock)):
             self.tagger.setTriggerLevel(channels[ch], trigger_levels[i])
             print("Voltage: ", round(self.tagger.getTriggerLevel(channels[ch]),4))
             self.tagger.sync()
-            sleep(.1)
+            changed_at = time.monotonic()
+            settler.wait(changed_at, changed_at + 0.1)
             #self.correlation.clear()
             self.correlation.start()
             sleep(0.1)
@@ -1374,6 +1013,7 @@ class CoincidenceExample(QMainWindow):
             #print(numpy.sum(self.buffer - self.buffer_old))
             # buffer is used in next loop for subtraction
             self.buffer_old = self.buffer
+        settle_pool.clear()
 
 
         fig = plt.figure(figsize=(20, 5))
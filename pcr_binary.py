@@ -0,0 +1,123 @@
+"""
+Columnar binary output for PCR/DCR sweeps
+Results are stored as native float arrays in an .npz archive instead of one formatted CSV cell per value,
+which matters most for DCR sweeps with dozens of bins per trigger level.
+
+The archive is written incrementally: each bias row is appended as its own set of members and the
+archive is closed again, so an interrupted sweep leaves a readable file. finish() consolidates the
+rows into one array per quantity, sorted by bias. load_sweep() reads either form.
+"""
+
+import json
+import os
+import time
+import zipfile
+
+import numpy
+import yaml
+from numpy.lib import format as npy_format
+
+from pcr_results import SweepResults, bias_current_uA
+
+
+_ROW_SEPARATOR = '__row'
+
+
+def _write_array(archive, name, array):
+    with archive.open(name + '.npy', 'w', force_zip64=True) as member:
+        npy_format.write_array(member, numpy.asanyarray(array), allow_pickle=False)
+
+
+class SweepArrayWriter:
+    """
+    Incremental .npz writer for a SweepResults.
+    Metadata (parameter snapshot, gate calibration, axes and units) is written when the file is created.
+    """
+
+    def __init__(self, filename: str, results, params=None, gate_calibration=None):
+        """
+        :param filename: Output .npz path
+        :param results: SweepResults the sweep writes into
+        :param params: Parameter dictionary, embedded as YAML text
+        :param gate_calibration: Dictionary describing the on/off gates and ratios, embedded as JSON text
+        """
+        self.filename = filename
+        self.results = results
+        self._rows_written = 0
+
+        metadata = {
+            'measurement_type': numpy.array(results.measurement_type),
+            'axes': numpy.array(results.axes),
+            'trigger_levels': results.trigger_levels,
+            'trigger_level_labels': numpy.array(results.trigger_level_labels),
+            'units': numpy.array(json.dumps({name: SweepResults.units.get(name) for name in
+                                             ('bias_voltage', 'bias_current') + results.quantities})),
+            'created': numpy.array(time.strftime('%Y-%m-%dT%H:%M:%S')),
+            'params_yaml': numpy.array(yaml.safe_dump(params) if params is not None else ''),
+            'gate_calibration': numpy.array(json.dumps(gate_calibration or {})),
+        }
+        if results.has_bins:
+            metadata['bin_times'] = results.bin_times
+            metadata['adev_taus'] = results.adev_taus
+        with zipfile.ZipFile(filename, 'w', compression=zipfile.ZIP_STORED) as archive:
+            for name, array in metadata.items():
+                _write_array(archive, name, array)
+
+    def append_row(self, row: int):
+        """Append one bias row of the results"""
+        with zipfile.ZipFile(self.filename, 'a', compression=zipfile.ZIP_STORED) as archive:
+            suffix = f'{_ROW_SEPARATOR}{self._rows_written:06d}'
+            _write_array(archive, 'bias_voltage' + suffix, self.results.bias_voltage[row:row + 1])
+            for name in self.results.quantities:
+                _write_array(archive, name + suffix, self.results[name][row:row + 1])
+        self._rows_written += 1
+
+    def finish(self):
+        """Rewrite the archive with one consolidated array per quantity, rows sorted by bias"""
+        order = self.results.bias_order()
+        arrays = load_sweep(self.filename, raw=True)
+        arrays['bias_voltage'] = self.results.bias_voltage[order]
+        arrays['bias_current'] = self.results.bias_current[order]
+        for name in self.results.quantities:
+            arrays[name] = self.results[name][order]
+        tmp_filename = self.filename + '.tmp'
+        with zipfile.ZipFile(tmp_filename, 'w', compression=zipfile.ZIP_STORED) as archive:
+            for name, array in arrays.items():
+                _write_array(archive, name, array)
+        os.replace(tmp_filename, self.filename)
+
+
+def load_sweep(filename: str, raw: bool = False):
+    """
+    Load a sweep archive written by SweepArrayWriter
+
+    :param filename: .npz path
+    :param raw: Return only the metadata members, without per-row members or derived entries
+    :return: Dictionary of arrays. Row-chunked archives (from interrupted sweeps) are stacked in
+             measurement order. 'params' and 'gate_calibration' are decoded to dictionaries.
+    """
+    rows = {}
+    arrays = {}
+    with numpy.load(filename, allow_pickle=False) as archive:
+        for key in archive.files:
+            if _ROW_SEPARATOR in key:
+                if raw:
+                    continue
+                name, index = key.split(_ROW_SEPARATOR)
+                rows.setdefault(name, []).append((int(index), archive[key]))
+            else:
+                arrays[key] = archive[key]
+    if raw:
+        return arrays
+
+    for name, chunks in rows.items():
+        chunks.sort(key=lambda chunk: chunk[0])
+        arrays[name] = numpy.concatenate([chunk for _, chunk in chunks])
+    if 'bias_current' not in arrays and 'bias_voltage' in arrays:
+        arrays['bias_current'] = bias_current_uA(arrays['bias_voltage'])
+
+    arrays['params'] = yaml.safe_load(str(arrays['params_yaml'])) if str(arrays.get('params_yaml', '')) else None
+    arrays['gate_calibration'] = json.loads(str(arrays['gate_calibration'])) if 'gate_calibration' in arrays else {}
+    if 'units' in arrays:
+        arrays['units'] = json.loads(str(arrays['units']))
+    return arrays
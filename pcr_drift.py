@@ -0,0 +1,156 @@
+"""
+Drift correction from interleaved reference points
+Every few bias points the sweep returns to one fixed (bias, trigger level) reference point. The reference
+readings trace how the thermal source output, amplifier gain or cryostat temperature wandered over the
+sweep; the gated signal of each curve point is divided by the reference trend interpolated to the time it was
+measured, normalised to the first reference, so the whole curve reads as if it had been taken at the sweep start.
+Times are wall-clock, so readings and points journaled before a resume line up with those taken after it.
+"""
+
+import time
+
+import numpy
+
+from pcr_measurements import MeasurementPool
+from pcr_sweep import uniform_bias_grid
+
+
+class DriftReference:
+    """
+    Measures the reference point and turns the readings into per-point correction factors.
+    The reference quantity is the dark-subtracted gated rate when the sweep has gates, else the raw detector rate.
+    """
+
+    def __init__(self, tagger, measurement_pool, gating, trigger_channel: int, voltage: float, trigger_level: float,
+                 integration_time: float = 1.0, every: int = 5, settle_time: float = 0.2, gated: bool = True):
+        """
+        :param tagger: TimeTagger instance
+        :param measurement_pool: MeasurementPool to take the Counter from
+        :param gating: GatingGraph of the detector
+        :param trigger_channel: Physical input whose trigger level is swept
+        :param voltage: Reference bias voltage in V
+        :param trigger_level: Reference trigger level in V
+        :param integration_time: Integration time of one reference reading in s
+        :param every: Curve bias points between reference readings
+        :param settle_time: Wait after setting the reference bias and trigger level, in s
+        :param gated: Use the on/off gates (filtered_pcr, combined) rather than the raw detector rate
+        """
+        self.tagger = tagger
+        self.gating = gating
+        self.trigger_channel = trigger_channel
+        self.voltage = voltage
+        self.trigger_level = trigger_level
+        self.integration_time = integration_time
+        self.every = max(1, every)
+        self.settle_time = settle_time
+        self.gated = gated
+        self.times = []
+        self.values = []
+        channels = ([gating.filtered_on.getChannel(), gating.filtered_off.getChannel()] if gated
+                    else [gating.detector_channel])
+        self.counter = measurement_pool.counter(channels, binwidth=int(integration_time * 1e12), n_values=1)
+
+    @classmethod
+    def from_params(cls, params, tagger, measurement_pool, gating, trigger_channel, measurement_type, trigger_levels):
+        """
+        Build the reference from the 'drift_reference' YAML section, or return None if disabled.
+        A null voltage or trigger level takes a point of the sweep itself: the middle of the voltage grid
+        and the first trigger level, so the reference never biases the detector beyond the curve.
+        A pure dcr sweep has no source-driven quantity to correct, so the reference is skipped there.
+        """
+        config = params.get('drift_reference', {}) or {}
+        if not config.get('enabled', False):
+            return None
+        if measurement_type == 'dcr':
+            print("Drift reference skipped: dcr sweeps have no source signal to correct")
+            return None
+        voltage = config.get('voltage')
+        if voltage is None:
+            grid = uniform_bias_grid(params['voltage']['start'], params['voltage']['stop'], params['voltage']['step'])
+            voltage = grid[len(grid) // 2]
+        trigger_level = config.get('trigger_level')
+        if trigger_level is None:
+            trigger_level = trigger_levels[0]
+        return cls(tagger, measurement_pool, gating, trigger_channel,
+                   voltage=float(voltage),
+                   trigger_level=float(trigger_level),
+                   integration_time=float(config.get('integration_time', 1.0)),
+                   every=int(config.get('every', 5)),
+                   settle_time=float(config.get('settle_time', params.get('settle_time', 0.2))),
+                   gated=measurement_type in ('filtered_pcr', 'combined'))
+
+    def due(self, points_measured: int):
+        """True if a reference reading is due after this many measured curve points"""
+        return points_measured > 0 and points_measured % self.every == 0
+
+    def measure(self, set_bias, fudge_factor: float):
+        """
+        Take one reference reading. The caller restores the curve's bias and trigger level afterwards.
+
+        :param set_bias: Callable taking a voltage and returning True if it was applied
+        :return: The reference value in Hz, or None if the bias could not be set
+        """
+        if not set_bias(self.voltage):
+            print("  Reference bias not applied, skipping reference reading")
+            return None
+        self.tagger.setTriggerLevel(self.trigger_channel, self.trigger_level)
+        time.sleep(self.settle_time)
+        clicks = MeasurementPool.acquire(self.counter, int(self.integration_time * 1e12)).getData()
+        if self.gated:
+            ratio_on = self.gating.ratio_on * fudge_factor
+            ratio_off = self.gating.ratio_off / fudge_factor
+            value = (clicks[0][0]/ (ratio_on*self.integration_time)) - (clicks[1][0]/ (ratio_off*self.integration_time))
+        else:
+            value = clicks[0][0] / self.integration_time
+        self.times.append(time.time())
+        self.values.append(float(value))
+        print(f"  Reference {self.voltage:.3f} V / {self.trigger_level:.3f} V: {value:.1f} Hz")
+        return value
+
+    def restore(self, readings):
+        """Add the (time, value) reference readings of an earlier, interrupted run of the same sweep"""
+        for measured_at, value in readings:
+            self.times.append(float(measured_at))
+            self.values.append(float(value))
+        order = numpy.argsort(self.times, kind='stable')
+        self.times = [self.times[k] for k in order]
+        self.values = [self.values[k] for k in order]
+
+    def factors(self, times):
+        """
+        Reference trend relative to the first reading, interpolated to the given wall-clock times
+
+        :return: Array shaped like times; 1 where no usable reference exists
+        """
+        times = numpy.asarray(times, dtype=float)
+        reference_times = numpy.array(self.times)
+        values = numpy.array(self.values)
+        usable = values > 0
+        if not numpy.any(usable):
+            print("No usable reference readings, drift correction skipped")
+            return numpy.ones_like(times)
+        reference_times, values = reference_times[usable], values[usable]
+        factors = numpy.interp(times, reference_times, values) / values[0]
+        return numpy.where(numpy.isnan(times), 1.0, factors)
+
+    # Quantities divided by the drift factor: only the source-driven, dark-subtracted ones. The DCR fields are
+    # dominated by dark counts that do not follow the source, so they, the gated dark counts, integration times
+    # and the Fano factor / burst flag (properties of the raw counting statistics) are left as measured
+    _CORRECTED = {'counts': 1, 'sigma': 1, 'quadrature': 1}
+
+    def apply(self, results, point_times):
+        """
+        Divide the sweep's rates by the interpolated reference trend and store the factors.
+        Only the source-driven gated quantities are corrected; the DCR fields keep their measured values.
+
+        :param results: SweepResults with a drift_factor quantity
+        :param point_times: (bias x trigger level) wall-clock times the points were measured, NaN if not measured
+        """
+        factors = self.factors(point_times)
+        results['drift_factor'][:] = factors
+        for name, power in self._CORRECTED.items():
+            if name in results.quantities:
+                values = results[name]
+                values /= (factors ** power).reshape(factors.shape + (1,) * (values.ndim - factors.ndim))
+        spread = numpy.ptp(self.values) / numpy.mean(self.values) if len(self.values) > 1 and numpy.mean(self.values) else 0.0
+        print(f"Drift correction from {len(self.values)} reference readings (peak-to-peak {spread:.1%})")
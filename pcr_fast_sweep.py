@@ -0,0 +1,245 @@
+"""
+Hardware-timed fast bias sweep
+The 33622A drives the detector bias with a repeating ramp instead of stepping the SIM928 point by point.
+Its Sync output, wired to a spare tagger input, marks the start of every ramp period. Each trigger level
+is recorded as one continuous tag stream; afterwards every tag is placed in the bias window of its ramp
+period from the timestamps alone, so a whole curve takes seconds of acquisition plus numpy bookkeeping.
+Configured by a 'fast_sweep' section in the params YAML:
+
+    fast_sweep:
+      bias_channel: 1
+      sync_channel: 7
+      frequency: 9.7
+
+    python pcr_fast_sweep.py PCR_multi_trigger_params.yml fast_sweep.csv
+
+The ramp spans voltage start..stop and is cut into (stop - start) / step bias windows, each labelled with
+its centre voltage. The ramp frequency should not be a multiple of the 1 Hz thermal source modulation,
+so every bias window sees the on and off gates in proportion to their duty cycle.
+"""
+
+import argparse
+import sys
+import time
+
+import numpy
+
+from pcr_measurements import record_tag_stream
+from pcr_multi_detector import write_sweep_outputs
+from pcr_results import SweepResults
+from pcr_runner import PCRSweepRunner
+from pcr_sweep import parse_sweep_params
+
+
+def segment_by_sync(timestamps, tag_channels, sync_channel: int, count_channels, num_steps: int, block_periods: int = 0):
+    """
+    Count tags per bias window of a periodic sweep marked by sync tags
+
+    Only tags inside complete sync periods are counted. Each period is cut into num_steps equal windows
+    using its own measured length, so frequency drift of the generator does not shift the windows.
+
+    :param timestamps: Tag times in ps, in time order
+    :param tag_channels: Channel of each tag
+    :param sync_channel: Channel carrying one tag per sweep period
+    :param count_channels: Channels to count; row order of the result
+    :param num_steps: Bias windows per period
+    :param block_periods: If > 0, also split the counts into blocks of this many periods (for DCR bins)
+    :return: counts (channels, steps[, blocks]) and dwell time in s per step [and block]
+    """
+    sync = timestamps[tag_channels == sync_channel]
+    if len(sync) < 2:
+        raise ValueError(f"Fewer than two sync tags on channel {sync_channel}; is the 33622A Sync output connected?")
+    period_lengths = numpy.diff(sync)
+    num_blocks = len(period_lengths) // block_periods if block_periods > 0 else 0
+
+    counts = []
+    for channel in count_channels:
+        t = timestamps[tag_channels == channel]
+        period = numpy.searchsorted(sync, t, side='right') - 1
+        inside = (period >= 0) & (period < len(period_lengths))
+        t, period = t[inside], period[inside]
+        fraction = (t - sync[period]) / period_lengths[period]
+        step = numpy.minimum((fraction * num_steps).astype(numpy.int64), num_steps - 1)
+        if num_blocks:
+            block = period // block_periods
+            keep = block < num_blocks
+            flat = step[keep] * num_blocks + block[keep]
+            counts.append(numpy.bincount(flat, minlength=num_steps * num_blocks).reshape(num_steps, num_blocks))
+        else:
+            counts.append(numpy.bincount(step, minlength=num_steps))
+
+    if num_blocks:
+        block_lengths = period_lengths[:num_blocks * block_periods].reshape(num_blocks, block_periods).sum(axis=1)
+        dwell = numpy.broadcast_to(block_lengths * 1e-12 / num_steps, (num_steps, num_blocks))
+    else:
+        dwell = numpy.full(num_steps, period_lengths.sum() * 1e-12 / num_steps)
+    return numpy.array(counts, dtype=float), dwell
+
+
+class FastBiasSweep:
+    """
+    Bias ramp on the 33622A, one tag stream per trigger level, and the segmentation into a SweepResults
+    """
+
+    def __init__(self, tagger, gating, trigger_channel: int, function_gen, bias_channel: int = 1,
+                 sync_channel: int = 7, frequency: float = 9.7, acquisition_time: float = 10.0,
+                 block_periods: int = 10, sync_trigger_level: float = 0.5):
+        """
+        :param tagger: TimeTagger instance
+        :param gating: GatingGraph of the detector
+        :param trigger_channel: Physical input whose trigger level is swept
+        :param function_gen: ClientKeysight33622A driving the bias
+        :param bias_channel: 33622A channel wired to the bias resistor (channel 2 drives the thermal source)
+        :param sync_channel: Tagger input receiving the 33622A Sync output
+        :param frequency: Ramp frequency in Hz
+        :param acquisition_time: Recording time per trigger level in s
+        :param block_periods: Ramp periods per DCR bin (dcr and combined)
+        :param sync_trigger_level: Trigger level of the sync input in V
+        """
+        self.tagger = tagger
+        self.gating = gating
+        self.trigger_channel = trigger_channel
+        self.function_gen = function_gen
+        self.bias_channel = bias_channel
+        self.sync_channel = sync_channel
+        self.frequency = frequency
+        self.acquisition_time = acquisition_time
+        self.block_periods = block_periods
+        self.sync_trigger_level = sync_trigger_level
+        self.results = None
+
+    @classmethod
+    def from_params(cls, params, tagger, gating, trigger_channel, function_gen):
+        """Build the sweep from the 'fast_sweep' YAML section"""
+        config = params.get('fast_sweep', {}) or {}
+        return cls(tagger, gating, trigger_channel, function_gen,
+                   bias_channel=int(config.get('bias_channel', 1)),
+                   sync_channel=int(config.get('sync_channel', 7)),
+                   frequency=float(config.get('frequency', 9.7)),
+                   acquisition_time=float(config.get('acquisition_time', 10.0)),
+                   block_periods=int(config.get('block_periods', 10)),
+                   sync_trigger_level=float(config.get('sync_trigger_level', 0.5)))
+
+    def _start_ramp(self, start, stop):
+        channel = self.bias_channel
+        self.function_gen.set_function(channel, 'RAMP')
+        self.function_gen.set_frequency(channel, self.frequency)
+        self.function_gen.set_amplitude(channel, stop - start)
+        self.function_gen.set_offset(channel, (start + stop) / 2)
+        self.function_gen.set_output(channel, 1)
+
+    def run(self, params, filename):
+        measurement_type, trigger_levels = parse_sweep_params(params)
+        start = float(params['voltage']['start'])
+        stop = float(params['voltage']['stop'])
+        num_steps = max(1, int(round((stop - start) / float(params['voltage']['step']))))
+        voltages = start + (numpy.arange(num_steps) + 0.5) * (stop - start) / num_steps
+        trigger_settle_time = float(params.get('trigger_settle_time', 0.2))
+        fudge_factor = params['fudge_factor']
+
+        # DCR bins are blocks of whole ramp periods; two periods are kept spare for the partial ones at either end
+        block_periods = self.block_periods if measurement_type in ('dcr', 'combined') else 0
+        num_bins = 1
+        bin_duration = 0.1
+        if block_periods:
+            num_bins = max(1, (int(self.acquisition_time * self.frequency) - 2) // block_periods)
+            bin_duration = block_periods / self.frequency / num_steps
+
+        results = SweepResults(measurement_type, trigger_levels, num_bins=num_bins, bin_duration=bin_duration,
+                               capacity=num_steps)
+        for voltage in voltages:
+            results.add_bias(voltage)
+        self.results = results
+
+        count_channels = []
+        if measurement_type in ('filtered_pcr', 'combined'):
+            count_channels += [self.gating.filtered_on.getChannel(), self.gating.filtered_off.getChannel()]
+        if measurement_type in ('dcr', 'combined'):
+            count_channels.append(self.gating.detector_channel)
+
+        self.tagger.setTriggerLevel(self.sync_channel, self.sync_trigger_level)
+        print(f"Fast sweep: {start:.3f}..{stop:.3f} V ramp at {self.frequency:g} Hz, {num_steps} bias windows, "
+              f"{self.acquisition_time:g} s per trigger level")
+        self._start_ramp(start, stop)
+        try:
+            for j, trigger_level in enumerate(trigger_levels):
+                self.tagger.setTriggerLevel(self.trigger_channel, float(trigger_level))
+                time.sleep(trigger_settle_time)
+                acquire_start = time.monotonic()
+                timestamps, tag_channels = record_tag_stream(self.tagger, count_channels + [self.sync_channel],
+                                                             self.acquisition_time)
+                recorded = time.monotonic() - acquire_start
+                self._store_trigger_level(params, results, j, timestamps, tag_channels, count_channels,
+                                          num_steps, block_periods, fudge_factor)
+                print(f"  Trigger Level {float(trigger_level):.3f} V: {len(timestamps)} tags in {recorded:.1f} s")
+        finally:
+            try:
+                self.function_gen.set_output(self.bias_channel, 0)
+            except Exception as e:
+                print(f"Error turning off the bias ramp: {e}")
+
+        base = filename[:-4] if filename.lower().endswith('.csv') else filename
+        write_sweep_outputs(results, base, 'fast sweep')
+        print(f'Finished {measurement_type.upper()} fast sweep.')
+        return results
+
+    def _store_trigger_level(self, params, results, j, timestamps, tag_channels, count_channels,
+                             num_steps, block_periods, fudge_factor):
+        counts, dwell = segment_by_sync(timestamps, tag_channels, self.sync_channel, count_channels,
+                                        num_steps, block_periods)
+        if results.has_gates:
+            on, off = counts[0], counts[1]
+            if block_periods:  # gated counts use the blocked periods only, like the DCR bins
+                on, off = on.sum(axis=1), off.sum(axis=1)
+            t_sec = dwell.sum(axis=1) if block_periods else dwell
+            ratio_on = self.gating.ratio_on * fudge_factor
+            ratio_off = self.gating.ratio_off / fudge_factor
+            count = (on/ (ratio_on*t_sec)) - (off/ (ratio_off*t_sec))
+            dark_count = (off/ (ratio_off*t_sec))
+            for row in range(num_steps):
+                results.set_point(row, j, counts=count[row], dark_counts=dark_count[row])
+        if results.has_bins:
+            bin_rates = (counts[-1] / dwell)[:, :results.num_bins]
+            if bin_rates.shape[1] < results.num_bins:
+                print(f"    Only {bin_rates.shape[1]} of {results.num_bins} DCR bins recorded, check the ramp frequency")
+                return
+            for row in range(num_steps):
+                PCRSweepRunner._store_dcr_bins(params, results, row, j, bin_rates[row])
+
+
+def main(argv=None):
+    from pcr_headless import HeadlessSession, load_yaml
+
+    parser = argparse.ArgumentParser(description="Record a whole bias sweep from a 33622A ramp in one tag stream per trigger level")
+    parser.add_argument("params", help="Parameters YAML with a fast_sweep section")
+    parser.add_argument("output", help="CSV output path")
+    parser.add_argument("--channels", default="channel_params.yaml", help="Tagger input settings as saved by the GUI")
+    args = parser.parse_args(argv)
+
+    try:
+        params = load_yaml(args.params)
+        channel_params = load_yaml(args.channels)
+    except Exception as e:
+        print(f"Error loading parameters: {e}")
+        return 1
+    if parse_sweep_params(params) is None:
+        return 1
+
+    session = HeadlessSession(channel_params)
+    try:
+        if not session.open():
+            return 1
+        if session.function_gen is None:
+            print("Error: the fast sweep needs the 33622A, aborting.")
+            return 1
+        sweep = FastBiasSweep.from_params(params, session.tagger, session.gating,
+                                          int(channel_params['Channels']['ChC']['channel']), session.function_gen)
+        sweep.run(params, args.output)
+        session.shutdown(params)
+    finally:
+        session.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
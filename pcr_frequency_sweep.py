@@ -0,0 +1,230 @@
+"""
+Modulation-frequency response sweep
+Steps the thermal source modulation through a list of frequencies with the 33622A's filter_channel(phase, freq),
+and at each one records the detector and ChA reference tags at a fixed bias and trigger level. The on/off
+gates are re-derived from the measured reference period (same fractions of the period as the 1 Hz
+defaults), and the same tags are lock-in demodulated, so the amplitude and phase lag of the
+detector/source response come out of one run. Configured by a 'frequency_sweep' section in the params YAML:
+
+    python pcr_frequency_sweep.py PCR_multi_trigger_params.yml frequency_response.npz
+
+Writes the .npz, a CSV with one row per frequency and a PNG of the response.
+"""
+
+import argparse
+import csv
+import sys
+import time
+
+import numpy
+import yaml
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from pcr_lockin import LockInDemodulator
+from pcr_measurements import record_tag_stream
+from pcr_recording import gate_counts
+from pcr_runner import ON_GATE_MS, OFF_GATE_MS, MODULATION_PERIOD_MS
+
+
+# Quantities recorded per frequency, with units
+QUANTITIES = {
+    'period_ms': 'ms',  # measured reference period
+    'on_gate_start_ms': 'ms',
+    'on_gate_stop_ms': 'ms',
+    'off_gate_start_ms': 'ms',
+    'off_gate_stop_ms': 'ms',
+    'counts': 'Hz',  # box gates, on minus off
+    'dark_counts': 'Hz',
+    'lockin_counts': 'Hz',
+    'lockin_sigma': 'Hz',
+    'lockin_quadrature': 'Hz',
+    'lockin_phase_deg': 'deg',  # lag of the response's fundamental (sincos weighting)
+    'int_time': 's',
+}
+
+
+class FrequencyResponseSweep:
+    """
+    One tag stream per modulation frequency, analysed with frequency-scaled box gates and a lock-in
+    """
+
+    def __init__(self, tagger, gating, function_gen, frequencies, phase: float = -45.0, min_periods: int = 20,
+                 integration_time: float = 10.0, settle_periods: float = 3.0, fudge_factor: float = 1.0,
+                 on_gate_fraction=None, off_gate_fraction=None, weighting: str = 'sincos'):
+        """
+        :param tagger: TimeTagger instance
+        :param gating: GatingGraph of the detector (its reference and detector channels are recorded)
+        :param function_gen: ClientKeysight33622A driving the thermal source
+        :param frequencies: Modulation frequencies in Hz
+        :param phase: Phase passed to filter_channel in degrees
+        :param min_periods: Integrate at least this many modulation periods per frequency
+        :param integration_time: Integrate at least this long per frequency, in s
+        :param settle_periods: Modulation periods to wait after each frequency change
+        :param fudge_factor: Gate ratio correction, as for the bias sweeps
+        :param on_gate_fraction: (start, stop) of the on gate as a fraction of the period
+        :param off_gate_fraction: (start, stop) of the off gate as a fraction of the period
+        :param weighting: Lock-in weighting, 'sincos' or 'matched'
+        """
+        self.tagger = tagger
+        self.gating = gating
+        self.function_gen = function_gen
+        self.frequencies = numpy.asarray(frequencies, dtype=float)
+        self.phase = phase
+        self.min_periods = min_periods
+        self.integration_time = integration_time
+        self.settle_periods = settle_periods
+        self.fudge_factor = fudge_factor
+        self.on_gate_fraction = tuple(on_gate_fraction or (ON_GATE_MS[0] / MODULATION_PERIOD_MS, ON_GATE_MS[1] / MODULATION_PERIOD_MS))
+        self.off_gate_fraction = tuple(off_gate_fraction or (OFF_GATE_MS[0] / MODULATION_PERIOD_MS, OFF_GATE_MS[1] / MODULATION_PERIOD_MS))
+        self.lockin = LockInDemodulator(weighting)
+        self.channels = [gating.detector_channel, gating.reference_channel, -gating.reference_channel]
+        self.results = {name: numpy.full(len(self.frequencies), numpy.nan) for name in QUANTITIES}
+
+    @classmethod
+    def from_params(cls, params, tagger, gating, function_gen):
+        """Build the sweep from the 'frequency_sweep' YAML section"""
+        config = params['frequency_sweep']
+        return cls(tagger, gating, function_gen, [float(f) for f in config['frequencies']],
+                   phase=float(config.get('phase', -45.0)),
+                   min_periods=int(config.get('min_periods', 20)),
+                   integration_time=float(config.get('integration_time', params['integration_time'])),
+                   settle_periods=float(config.get('settle_periods', 3.0)),
+                   fudge_factor=float(params.get('fudge_factor', 1.0)),
+                   on_gate_fraction=config.get('on_gate_fraction'),
+                   off_gate_fraction=config.get('off_gate_fraction'),
+                   weighting=str(config.get('weighting', 'sincos')).lower())
+
+    def analyse(self, k, timestamps, tag_channels, window=None):
+        """Box-gate and lock-in estimates of frequency index k from its recorded tags, recorded over window (ps)"""
+        detector = timestamps[tag_channels == self.channels[0]]
+        rising = timestamps[tag_channels == self.channels[1]]
+        falling = timestamps[tag_channels == self.channels[2]]
+        if len(rising) < 2:
+            raise ValueError("Fewer than two reference edges; is the modulation reference connected?")
+        period_ms = float(numpy.median(numpy.diff(rising))) * 1e-9
+        on_gate_ms = (self.on_gate_fraction[0] * period_ms, self.on_gate_fraction[1] * period_ms)
+        off_gate_ms = (self.off_gate_fraction[0] * period_ms, self.off_gate_fraction[1] * period_ms)
+
+        demodulated = self.lockin.demodulate(detector, rising, falling, window)
+        # The box gates only count complete periods; the lock-in also uses the partial ones at either end
+        t_sec = (rising[-1] - rising[0]) * 1e-12
+        detector = detector[(detector >= rising[0]) & (detector < rising[-1])]
+        clicks_on = gate_counts(detector, rising, on_gate_ms)
+        clicks_off = gate_counts(detector, rising, off_gate_ms)
+        ratio_on = (self.on_gate_fraction[1] - self.on_gate_fraction[0]) * self.fudge_factor
+        ratio_off = (self.off_gate_fraction[1] - self.off_gate_fraction[0]) / self.fudge_factor
+
+        values = {
+            'period_ms': period_ms,
+            'on_gate_start_ms': on_gate_ms[0], 'on_gate_stop_ms': on_gate_ms[1],
+            'off_gate_start_ms': off_gate_ms[0], 'off_gate_stop_ms': off_gate_ms[1],
+            'counts': (clicks_on/ (ratio_on*t_sec)) - (clicks_off/ (ratio_off*t_sec)),
+            'dark_counts': (clicks_off/ (ratio_off*t_sec)),
+            'lockin_counts': demodulated['counts'],
+            'lockin_sigma': demodulated['sigma'],
+            'lockin_quadrature': demodulated['quadrature'],
+            'lockin_phase_deg': numpy.degrees(numpy.arctan2(demodulated['quadrature'], demodulated['counts'])),
+            'int_time': demodulated['t_sec'],
+        }
+        for name, value in values.items():
+            self.results[name][k] = value
+        return values
+
+    def run(self):
+        print(f"Frequency response: {len(self.frequencies)} modulation frequencies "
+              f"{self.frequencies.min():g}..{self.frequencies.max():g} Hz")
+        for k, frequency in enumerate(self.frequencies):
+            try:
+                self.function_gen.filter_channel(self.phase, float(frequency))
+                self.function_gen.phase_sync()
+            except Exception as e:
+                print(f"  {frequency:g} Hz: error setting the modulation, skipped: {e}")
+                continue
+            time.sleep(self.settle_periods / frequency)
+            duration = max(self.integration_time, (self.min_periods + 1) / frequency)
+            timestamps, tag_channels, window = record_tag_stream(self.tagger, self.channels, duration, with_window=True)
+            try:
+                values = self.analyse(k, timestamps, tag_channels, window)
+            except ValueError as e:
+                print(f"  {frequency:g} Hz: {e}")
+                continue
+            print(f"  {frequency:g} Hz (period {values['period_ms']:.2f} ms): box {values['counts']:.1f} Hz, "
+                  f"lock-in {values['lockin_counts']:.1f} +/- {values['lockin_sigma']:.2g} Hz, "
+                  f"phase {values['lockin_phase_deg']:.1f} deg")
+        return self.results
+
+    def save(self, filename: str, params=None):
+        """Write the .npz plus a CSV and PNG next to it"""
+        base = filename[:-4] if filename.lower().endswith('.npz') else filename
+        arrays = {'frequency': self.frequencies, 'units': numpy.array([f"{name}:{unit}" for name, unit in QUANTITIES.items()])}
+        arrays.update(self.results)
+        if params is not None:
+            arrays['params_yaml'] = numpy.array(yaml.safe_dump(params))
+        numpy.savez(base + '.npz', **arrays)
+
+        with open(base + '.csv', 'w', newline='') as csvfile:
+            csvwriter = csv.writer(csvfile)
+            csvwriter.writerow(['Frequency_Hz'] + list(QUANTITIES))
+            for k, frequency in enumerate(self.frequencies):
+                csvwriter.writerow([frequency] + ['' if numpy.isnan(self.results[name][k]) else self.results[name][k]
+                                                  for name in QUANTITIES])
+
+        figure = Figure(figsize=(8, 6))
+        FigureCanvasAgg(figure)
+        ax = figure.add_subplot(111)
+        ax.errorbar(self.frequencies, self.results['lockin_counts'], yerr=self.results['lockin_sigma'],
+                    fmt='o-', label='Lock-in')
+        ax.plot(self.frequencies, self.results['counts'], 's--', label='Box gates')
+        ax.set_xscale('log')
+        ax.set_xlabel('Modulation frequency (Hz)')
+        ax.set_ylabel('Signal counts (Hz)')
+        ax.set_title('Detector / source modulation response')
+        ax.grid(True)
+        ax.legend(loc='best')
+        figure.savefig(base + '.png', dpi=300)
+        print(f"Frequency response saved as: {base}.npz / .csv / .png")
+
+
+def main(argv=None):
+    from pcr_headless import HeadlessSession, load_yaml
+
+    parser = argparse.ArgumentParser(description="Sweep the thermal source modulation frequency and record the detector response")
+    parser.add_argument("params", help="Parameters YAML with a frequency_sweep section")
+    parser.add_argument("output", help="Output .npz path (CSV and PNG are written next to it)")
+    parser.add_argument("--channels", default="channel_params.yaml", help="Tagger input settings as saved by the GUI")
+    args = parser.parse_args(argv)
+
+    try:
+        params = load_yaml(args.params)
+        config = params['frequency_sweep']
+        channel_params = load_yaml(args.channels)
+    except Exception as e:
+        print(f"Error loading parameters: {e}")
+        return 1
+
+    session = HeadlessSession(channel_params)
+    try:
+        if not session.open():
+            return 1
+        if session.function_gen is None:
+            print("Error: the frequency sweep needs the 33622A, aborting.")
+            return 1
+        if config.get('bias_voltage') is not None and not session.sim928.set_voltage_robustly(float(config['bias_voltage'])):
+            print("Error: bias voltage not applied, aborting.")
+            return 1
+        if config.get('trigger_level') is not None:
+            session.tagger.setTriggerLevel(int(channel_params['Channels']['ChC']['channel']), float(config['trigger_level']))
+        time.sleep(float(params.get('settle_time', 0.2)))
+
+        sweep = FrequencyResponseSweep.from_params(params, session.tagger, session.gating, session.function_gen)
+        sweep.run()
+        sweep.save(args.output, params)
+        session.shutdown(params)
+    finally:
+        session.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,188 @@
+"""
+Gating-phase scan
+Steps the 33622A gating channel (channel 2) through a list of offsets with gating_channel(x) + phase_sync()
+and integrates the correlation histogram of the gated detector clicks at each step. One pooled Correlation
+is re-armed for every step, and all histograms are stacked into a single .npz with the offsets, the
+detector bias current they correspond to and the histogram bin times. Configured by a 'gating_scan'
+section in the params YAML:
+
+    python pcr_gating_scan.py PCR_multi_trigger_params.yml gating_scan.npz
+
+The next offset is sent from a worker thread as soon as a step's integration ends, so the 33622A round
+trip and settle time overlap the readback and storage of the histogram just taken.
+"""
+
+import argparse
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+import yaml
+
+
+def scan_offsets(config):
+    """Offsets in V from an explicit 'offsets' list or start/stop/step, plus optional extra_offsets"""
+    if config.get('offsets') is not None:
+        offsets = [float(x) for x in config['offsets']]
+    else:
+        start, stop, step = float(config['start']), float(config['stop']), float(config['step'])
+        offsets = list(numpy.round(numpy.arange(start, stop + step / 2, step), 9))
+    offsets += [float(x) for x in config.get('extra_offsets', []) or []]
+    return numpy.array(offsets)
+
+
+def bias_current_ua(offsets, v_pp: float, divider: float = 100.0, load_resistance: float = 50.0):
+    """Detector bias current in uA of each gating offset: (V_pp / 2 + offset) / divider across load_resistance"""
+    return (v_pp / 2 + numpy.asarray(offsets)) / divider / load_resistance * 1e6
+
+
+class GatingPhaseScan:
+    """
+    Steps the gating channel and records one correlation histogram per offset
+    """
+
+    def __init__(self, tagger, measurement_pool, function_gen, click_channel: int, offsets, integration_time=1.0,
+                 settle_time: float = 1.0, binwidth: int = 1000, n_bins: int = 1000, filter_phase=None,
+                 filter_frequency=None):
+        """
+        :param tagger: TimeTagger instance
+        :param measurement_pool: MeasurementPool to take the Correlation from
+        :param function_gen: ClientKeysight33622A (channel 1 filter, channel 2 gating)
+        :param click_channel: Channel histogrammed (e.g. the source-on gated detector channel)
+        :param offsets: Gating channel offsets in V
+        :param integration_time: Integration time per step in s; a scalar or one value per offset
+        :param settle_time: Wait after each gating_channel/phase_sync before integrating, in s
+        :param binwidth: Histogram bin width in ps
+        :param n_bins: Number of histogram bins
+        :param filter_phase: If given with filter_frequency, filter_channel(phase, freq) is set once before the scan
+        :param filter_frequency: Filter channel frequency in Hz
+        """
+        self.tagger = tagger
+        self.function_gen = function_gen
+        self.offsets = numpy.asarray(offsets, dtype=float)
+        self.integration_time = numpy.broadcast_to(numpy.asarray(integration_time, dtype=float), self.offsets.shape).copy()
+        self.settle_time = settle_time
+        self.filter_phase = filter_phase
+        self.filter_frequency = filter_frequency
+        self.correlation = measurement_pool.correlation(click_channel, binwidth=binwidth, n_bins=n_bins)
+        self.index = numpy.array(self.correlation.getIndex())
+        self.histograms = numpy.zeros((len(self.offsets), len(self.index)), dtype=numpy.int64)
+        self.measured_time = numpy.full(len(self.offsets), numpy.nan)
+        self.step_time = numpy.full(len(self.offsets), numpy.nan)
+
+    @classmethod
+    def from_params(cls, params, tagger, measurement_pool, function_gen, gating):
+        """Build the scan from the 'gating_scan' YAML section"""
+        config = params['gating_scan']
+        offsets = scan_offsets(config)
+        integration_time = float(config.get('integration_time', params['integration_time']))
+        int_times = numpy.full(len(offsets), integration_time)
+        # The legacy hand-run scans integrated the extra (last) offsets longer
+        num_extra = len(config.get('extra_offsets', []) or [])
+        if num_extra:
+            int_times[-num_extra:] *= float(config.get('extra_integration_factor', 1.0))
+        channel = config.get('channel', 'filtered_on')
+        click_channel = gating.filtered_on.getChannel() if channel == 'filtered_on' else gating.detector_channel
+        return cls(tagger, measurement_pool, function_gen, click_channel, offsets, int_times,
+                   settle_time=float(config.get('settle_time', 1.0)),
+                   binwidth=int(config.get('binwidth', 1000)),
+                   n_bins=int(config.get('n_bins', 1000)),
+                   filter_phase=config.get('filter_phase'),
+                   filter_frequency=config.get('filter_frequency'))
+
+    def _apply(self, offset):
+        """Send one offset; returns the monotonic time the gating is in place"""
+        self.function_gen.gating_channel(float(offset))
+        self.function_gen.phase_sync()
+        return time.monotonic()
+
+    def run(self):
+        if self.filter_phase is not None and self.filter_frequency is not None:
+            self.function_gen.channels_on()
+            self.function_gen.phase_zero()
+            self.function_gen.phase_sync()
+            self.function_gen.filter_channel(float(self.filter_phase), float(self.filter_frequency))
+
+        print(f"Gating scan: {len(self.offsets)} offsets {self.offsets.min():.3f}..{self.offsets.max():.3f} V, "
+              f"{self.integration_time.sum():.0f} s of integration")
+        scan_start = time.monotonic()
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            pending = executor.submit(self._apply, self.offsets[0])
+            for i, offset in enumerate(self.offsets):
+                applied = pending.result()
+                time.sleep(max(0.0, self.settle_time - (time.monotonic() - applied)))
+                step_start = time.monotonic()
+                self.correlation.startFor(int(self.integration_time[i] * 1e12), clear=True)
+                self.correlation.waitUntilFinished()
+                # Next offset goes out while this histogram is read back and stored
+                if i + 1 < len(self.offsets):
+                    pending = executor.submit(self._apply, self.offsets[i + 1])
+                self.histograms[i] = self.correlation.getData()
+                self.measured_time[i] = self.correlation.getCaptureDuration() * 1e-12
+                self.step_time[i] = time.monotonic() - step_start
+                print(f"  Offset {offset:.3f} V: {self.histograms[i].sum()} counts in {self.measured_time[i]:.1f} s")
+        finally:
+            executor.shutdown(wait=True)
+        print(f"Gating scan finished in {time.monotonic() - scan_start:.1f} s")
+        return self.histograms
+
+    def save(self, filename: str, params=None, bias_current=None):
+        """Write every step to one .npz"""
+        arrays = {
+            'offsets': self.offsets,
+            'index_ps': self.index,
+            'histograms': self.histograms,
+            'integration_time': self.integration_time,
+            'measured_time': self.measured_time,
+        }
+        if bias_current is not None:
+            arrays['bias_current_ua'] = numpy.asarray(bias_current)
+        if params is not None:
+            arrays['params_yaml'] = numpy.array(yaml.safe_dump(params))
+        numpy.savez(filename, **arrays)
+        print(f"Gating scan saved as: {filename}")
+
+
+def main(argv=None):
+    from pcr_headless import HeadlessSession, load_yaml
+
+    parser = argparse.ArgumentParser(description="Step the 33622A gating channel and record a correlation histogram per offset")
+    parser.add_argument("params", help="Parameters YAML with a gating_scan section")
+    parser.add_argument("output", help="Output .npz path")
+    parser.add_argument("--channels", default="channel_params.yaml", help="Tagger input settings as saved by the GUI")
+    args = parser.parse_args(argv)
+
+    try:
+        params = load_yaml(args.params)
+        config = params['gating_scan']
+        channel_params = load_yaml(args.channels)
+    except Exception as e:
+        print(f"Error loading parameters: {e}")
+        return 1
+
+    session = HeadlessSession(channel_params)
+    try:
+        if not session.open():
+            return 1
+        if session.function_gen is None:
+            print("Error: the gating scan needs the 33622A, aborting.")
+            return 1
+        scan = GatingPhaseScan.from_params(params, session.tagger, session.measurement_pool,
+                                           session.function_gen, session.gating)
+        session.tagger.sync()
+        scan.run()
+        bias_current = None
+        if config.get('v_pp') is not None:
+            bias_current = bias_current_ua(scan.offsets, float(config['v_pp']),
+                                           float(config.get('divider', 100.0)), float(config.get('load_resistance', 50.0)))
+        scan.save(args.output if args.output.lower().endswith('.npz') else args.output + '.npz', params, bias_current)
+        session.shutdown(params)
+    finally:
+        session.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""
+Headless PCR/DCR sweep
+Runs the same sweep as the PCR button of Gated_Histogram_PCR_multi_trigger.py without Qt,
+so it can be started from ssh, cron or batch scripts:
+
+    python pcr_headless.py PCR_multi_trigger_params.yml sweep.csv
+    python pcr_headless.py --resume sweep.journal.jsonl [sweep.csv]
+
+A resumed sweep takes its parameters from the journal header, so the params file is not needed.
+"""
+
+import argparse
+import sys
+
+import matplotlib
+matplotlib.use('Agg')  # never open a window
+
+from TimeTagger import createTimeTagger, freeTimeTagger, Resolution
+
+from client_keysight33622A import ClientKeysight33622A
+from client_keysightE36312A import ClientKeysightE36312A
+from sim928_connection import SIM928Connection
+from pcr_journal import SweepJournal
+from pcr_measurements import MeasurementPool
+from pcr_runner import GatingGraph, PCRSweepRunner, apply_channel_params, parse_sweep_params, shutdown_instruments
+from pcr_sweep import load_yaml
+
+
+CLOCK_DIVIDER = 2000  # divider 156.25MHz down to 78.125 KHz
+
+
+def connect_keysight(client_class, name):
+    """Connect a Keysight proxy client, returning None if it is not reachable"""
+    try:
+        client = client_class()
+        client.connect()
+        print(f"{name} connected successfully")
+        return client
+    except Exception as e:
+        print(f"Failed to connect to {name}: {e}")
+        return None
+
+
+class HeadlessSession:
+    """
+    Tagger, gating graph and instruments for running sweeps without the GUI.
+    Instruments stay on between sweeps; shutdown() applies a turn_off_after_pcr policy once at the end.
+    """
+
+    def __init__(self, channel_params):
+        """
+        :param channel_params: Tagger input settings as loaded from channel_params.yaml
+        """
+        self.channel_params = channel_params
+        self.tagger = None
+        self.sim928 = None
+        self.function_gen = None
+        self.power_supply = None
+        self.gating = None
+        self.measurement_pool = None
+        self.runner = None
+
+    def open(self):
+        """Create the tagger and connect the instruments. Returns False if no sweep can run."""
+        self.tagger = createTimeTagger(resolution = Resolution.HighResC)
+        active_channels = apply_channel_params(self.tagger, self.channel_params)
+        self.tagger.setEventDivider(18, CLOCK_DIVIDER)
+
+        # for us right now (oct 9 2024), active_channels[2] (3rd row) is 5, which is the snspd
+        self.gating = GatingGraph(self.tagger, active_channels[0], active_channels[2])
+        self.measurement_pool = MeasurementPool(self.tagger)
+
+        self.sim928 = SIM928Connection(port='/dev/ttyUSB0', possible_ports=['/dev/ttyUSB0', '/dev/ttyUSB1', '/dev/ttyUSB2'],
+                                       gpib_addr=2, slot=1)
+        if not self.sim928.connect():
+            print("Error: SIM928 source not available, aborting sweep.")
+            return False
+        self.function_gen = connect_keysight(ClientKeysight33622A, "Function generator (33622A)")
+        self.power_supply = connect_keysight(ClientKeysightE36312A, "Power supply (E36312A)")
+
+        self.runner = PCRSweepRunner(self.tagger, self.gating, int(self.channel_params['Channels']['ChC']['channel']),
+                                     self.sim928.set_voltage_robustly, self.measurement_pool,
+                                     power_supply=self.power_supply)
+        return True
+
+    def run_sweep(self, params, filename, resume_points=None, journal_path=None):
+        self.runner.run(params, filename, resume_points=resume_points, journal_path=journal_path)
+
+    def shutdown(self, params):
+        """Apply the turn_off_after_pcr section of params"""
+        shutdown_instruments(params, self.sim928.source if self.sim928 is not None else None,
+                             self.power_supply, self.function_gen)
+
+    def close(self):
+        if self.tagger is not None:
+            freeTimeTagger(self.tagger)
+            self.tagger = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a filtered PCR or DCR sweep without the GUI")
+    parser.add_argument("params", nargs='?', help="Sweep parameters, e.g. PCR_multi_trigger_params.yml "
+                                                  "(taken from the journal when resuming)")
+    parser.add_argument("output", nargs='?', help="CSV output path (taken from the journal when resuming)")
+    parser.add_argument("--channels", default="channel_params.yaml", help="Tagger input settings as saved by the GUI")
+    parser.add_argument("--resume", metavar="JOURNAL", help="Resume the sweep recorded in this journal")
+    args = parser.parse_args(argv)
+
+    resume_points = None
+    if args.resume:
+        # With --resume a lone positional is the output path, unless it is a params file
+        if args.output is None and args.params is not None and not args.params.lower().endswith(('.yml', '.yaml')):
+            args.params, args.output = None, args.params
+        if args.params is not None:
+            print(f"Resuming: {args.params} is ignored, the journal's parameter snapshot is used")
+        try:
+            header, resume_points = SweepJournal.load(args.resume)
+        except Exception as e:
+            print(f"Error reading sweep journal: {e}")
+            return 1
+        # The journal's parameter snapshot wins, so the resumed sweep has the same bias points
+        params = header['params']
+        filename = args.output or header['filename']
+        print(f"Resuming sweep: {len(resume_points)} (bias, trigger level) points already measured")
+    else:
+        if args.params is None or args.output is None:
+            parser.error("a params file and an output CSV path are required unless --resume is given")
+        try:
+            params = load_yaml(args.params)
+        except Exception as e:
+            print(f"Error loading parameters: {e}")
+            return 1
+        filename = args.output
+
+    if parse_sweep_params(params) is None:
+        return 1
+
+    try:
+        channel_params = load_yaml(args.channels)
+    except Exception as e:
+        print(f"Error loading channel parameters: {e}")
+        return 1
+
+    session = HeadlessSession(channel_params)
+    try:
+        if not session.open():
+            return 1
+        session.run_sweep(params, filename, resume_points=resume_points,
+                          journal_path=args.resume if args.resume else None)
+        session.shutdown(params)
+    finally:
+        session.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
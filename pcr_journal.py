@@ -0,0 +1,142 @@
+"""
+Crash-safe journal for long PCR/DCR sweeps
+Every completed (bias, trigger level) result is appended as one JSON line and flushed to disk,
+so a sweep interrupted by a serial glitch, exception or closed window can be resumed
+"""
+
+import json
+import math
+import os
+import time
+
+
+def _encode(value):
+    """JSON has no NaN; store missing values as null"""
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def _decode(value):
+    return float('nan') if value is None else value
+
+
+class SweepJournal:
+    """
+    Append-only JSON-lines journal of a sweep.
+    The first line is a header holding the full parameter snapshot, every further line one measured point.
+    """
+
+    def __init__(self, path: str, file):
+        self.path = path
+        self._file = file
+
+    @staticmethod
+    def path_for(csv_filename: str):
+        """Journal file that belongs to a sweep's CSV output"""
+        base = csv_filename[:-4] if csv_filename.lower().endswith('.csv') else csv_filename
+        return base + '.journal.jsonl'
+
+    @classmethod
+    def create(cls, path: str, params: dict, filename: str):
+        """Start a new journal, overwriting any previous one at path"""
+        journal = cls(path, open(path, 'w'))
+        journal._write({
+            'type': 'header',
+            'filename': filename,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'params': params,
+        })
+        return journal
+
+    @classmethod
+    def reopen(cls, path: str):
+        """Continue appending to an existing journal"""
+        return cls(path, open(path, 'a'))
+
+    def append_point(self, bias_index: int, voltage: float, tl_index: int, trigger_level, values: dict,
+                     measured_at: float = None):
+        """
+        Record one completed (bias, trigger level) measurement
+
+        :param bias_index: Position of the bias point in the sweep order
+        :param voltage: SIM928 voltage of the bias point
+        :param tl_index: Index into the trigger level list
+        :param trigger_level: Trigger level as given in the parameters
+        :param values: Measured quantities; floats or lists of floats
+        :param measured_at: Wall-clock time the point was measured (used by the drift correction)
+        """
+        encoded = {}
+        for key, value in values.items():
+            if isinstance(value, (list, tuple)):
+                encoded[key] = [_encode(float(v)) for v in value]
+            else:
+                encoded[key] = _encode(float(value))
+        record = {
+            'type': 'point',
+            'bias_index': bias_index,
+            'voltage': float(voltage),
+            'tl_index': tl_index,
+            'trigger_level': trigger_level,
+            'values': encoded,
+        }
+        if measured_at is not None:
+            record['measured_at'] = float(measured_at)
+        self._write(record)
+
+    def append_reference(self, measured_at: float, value: float):
+        """Record one drift reference reading (see pcr_drift), so a resumed sweep keeps the whole trend"""
+        self._write({'type': 'reference', 'measured_at': float(measured_at), 'value': _encode(float(value))})
+
+    def _write(self, record):
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    @staticmethod
+    def load(path: str):
+        """
+        Read a journal back
+
+        :return: (header record, {(bias_index, tl_index): point record}). A truncated last line,
+                 as left by a crash mid-write, is ignored.
+        """
+        header = None
+        points = {}
+        with open(path, 'r') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"Ignoring unreadable journal line in {path}")
+                    continue
+                if record.get('type') == 'header':
+                    header = record
+                elif record.get('type') == 'point':
+                    values = {}
+                    for key, value in record['values'].items():
+                        values[key] = [_decode(v) for v in value] if isinstance(value, list) else _decode(value)
+                    record['values'] = values
+                    points[(record['bias_index'], record['tl_index'])] = record
+        if header is None:
+            raise ValueError(f"Journal '{path}' has no header record")
+        return header, points
+
+    @staticmethod
+    def load_references(path: str):
+        """Drift reference readings recorded in a journal, as a list of (wall-clock time, value)"""
+        readings = []
+        with open(path, 'r') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record.get('type') == 'reference' and record.get('value') is not None:
+                    readings.append((record['measured_at'], record['value']))
+        return readings
@@ -0,0 +1,145 @@
+"""
+Latch detection for bias sweeps
+A latched SNSPD sits in the normal state: its pulses stop and the count rate collapses to (nearly) zero
+until the bias is removed. After every bias point the detector rate is read in short Counter bins over whole
+periods of the source modulation and compared with the rate seen after the previous point; optionally the E36312A current readback is watched
+for a jump as well. On a latch the sweep either drops the SIM928 to 0 V, ramps back and re-measures the
+point, or ends the sweep early.
+"""
+
+import time
+
+import numpy
+
+from pcr_measurements import MeasurementPool
+
+
+class LatchDetector:
+    """
+    Flags a collapse of the detector count rate between consecutive checks.
+    Every bin of the check window has to fall below collapse_fraction of the reference rate, so a single
+    quiet bin at low rates is not mistaken for a latch. The reference is the last unlatched check.
+    With a modulated source the window spans whole modulation periods, so a window is never all source-off
+    bins being compared with a reference that includes the source-on phase.
+    """
+
+    def __init__(self, measurement_pool, detector_channel: int, bin_time: float = 0.01, window_bins: int = 10,
+                 collapse_fraction: float = 0.05, min_rate: float = 50.0, action: str = 'recover',
+                 max_retries: int = 2, reset_time: float = 1.0, ramp_steps: int = 5, ramp_step_time: float = 0.1,
+                 power_supply=None, supply_channel: int = None, current_jump: float = None):
+        """
+        :param measurement_pool: MeasurementPool to take the Counter from
+        :param detector_channel: Raw detector input
+        :param bin_time: Counter bin width in s
+        :param window_bins: Bins per check
+        :param collapse_fraction: Latched if every bin is below this fraction of the reference rate
+        :param min_rate: Reference rates below this (Hz) are too low to tell a latch from a dark detector
+        :param action: 'recover' (reset the bias and re-measure) or 'truncate' (end the sweep)
+        :param max_retries: Recoveries per bias point before the sweep is truncated anyway
+        :param reset_time: Time at 0 V before ramping back, in s
+        :param ramp_steps: Voltage steps of the ramp back to the bias point
+        :param ramp_step_time: Wait after each ramp step, in s
+        :param power_supply: Optional ClientKeysightE36312A whose current readback is watched
+        :param supply_channel: E36312A channel to read
+        :param current_jump: Latched if the readback moves more than this (A) from its first value
+        """
+        self.bin_time = bin_time
+        self.window_bins = window_bins
+        self.window_ps = int(bin_time * window_bins * 1e12)
+        self.collapse_fraction = collapse_fraction
+        self.min_rate = min_rate
+        self.action = action
+        self.max_retries = max_retries
+        self.reset_time = reset_time
+        self.ramp_steps = ramp_steps
+        self.ramp_step_time = ramp_step_time
+        self.power_supply = power_supply
+        self.supply_channel = supply_channel
+        self.current_jump = current_jump
+        self.reference_rate = None
+        self.reference_current = None
+        self.counter = measurement_pool.counter([detector_channel], binwidth=int(bin_time * 1e12), n_values=window_bins)
+
+    @classmethod
+    def from_params(cls, params, measurement_pool, detector_channel, power_supply=None, modulation_period=None):
+        """
+        Build the detector from the 'latch_detection' YAML section, or return None if disabled
+
+        :param modulation_period: Source modulation period in s; the check window is rounded up to whole periods
+        """
+        config = params.get('latch_detection', {}) or {}
+        if not config.get('enabled', False):
+            return None
+        bin_time = float(config.get('bin_time', 0.01))
+        window_bins = int(config.get('window_bins', 10))
+        if modulation_period is not None:
+            periods = max(1, int(numpy.ceil(window_bins * bin_time / modulation_period - 1e-9)))
+            window_bins = int(round(periods * modulation_period / bin_time))
+        action = str(config.get('action', 'recover')).lower()
+        if action not in ('recover', 'truncate'):
+            print(f"Unknown latch action '{action}', using 'recover'")
+            action = 'recover'
+        supply = config.get('supply_readback', {}) or {}
+        use_supply = supply.get('enabled', False) and power_supply is not None
+        return cls(measurement_pool, detector_channel,
+                   bin_time=bin_time,
+                   window_bins=window_bins,
+                   collapse_fraction=float(config.get('collapse_fraction', 0.05)),
+                   min_rate=float(config.get('min_rate', 50.0)),
+                   action=action,
+                   max_retries=int(config.get('max_retries', 2)),
+                   reset_time=float(config.get('reset_time', 1.0)),
+                   ramp_steps=int(config.get('ramp_steps', 5)),
+                   ramp_step_time=float(config.get('ramp_step_time', 0.1)),
+                   power_supply=power_supply if use_supply else None,
+                   supply_channel=int(supply.get('channel', 1)),
+                   current_jump=float(supply.get('current_jump', 0.005)))
+
+    def is_collapsed(self, bin_rates):
+        """True if every bin rate is below collapse_fraction of a usable reference rate"""
+        if self.reference_rate is None or self.reference_rate < self.min_rate:
+            return False
+        return bool(numpy.all(bin_rates < self.collapse_fraction * self.reference_rate))
+
+    def _supply_jumped(self):
+        if self.power_supply is None:
+            return False
+        try:
+            current = float(self.power_supply.getCurrent(self.supply_channel))
+        except Exception as e:
+            print(f"Error reading E36312A current for latch detection: {e}")
+            return False
+        if self.reference_current is None:
+            self.reference_current = current
+            return False
+        return abs(current - self.reference_current) > self.current_jump
+
+    def check(self):
+        """
+        Read one window of the detector rate and compare it with the reference
+
+        :return: (latched, mean rate in Hz of the window)
+        """
+        counts = numpy.asarray(MeasurementPool.acquire(self.counter, self.window_ps).getData()[0], dtype=float)
+        bin_rates = counts / self.bin_time
+        rate = float(numpy.mean(bin_rates))
+        latched = self.is_collapsed(bin_rates) or self._supply_jumped()
+        if not latched:
+            self.reference_rate = rate
+        return latched, rate
+
+    def recover(self, set_bias, voltage: float):
+        """
+        Drop the bias to 0 V to reset the latch and ramp back to the bias point
+
+        :param set_bias: Callable taking a voltage and returning True if it was applied
+        :return: (success, monotonic time the last write completed, duration in s), as _set_bias_and_timestamp
+        """
+        start = time.monotonic()
+        success = set_bias(0.0)
+        time.sleep(self.reset_time)
+        for step_voltage in numpy.linspace(0.0, voltage, self.ramp_steps + 1)[1:]:
+            success = set_bias(float(step_voltage)) and success
+            time.sleep(self.ramp_step_time)
+        done = time.monotonic()
+        return success, done, done - start
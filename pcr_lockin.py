@@ -0,0 +1,197 @@
+"""
+Software lock-in demodulation of the thermal-source-modulated counts
+Instead of counting clicks in two box gates, every click is weighted by a function of its phase within
+the modulation period (measured between consecutive ChA reference edges) and the weighted sum is scaled
+to the on-minus-off rate. The weights run over the whole period, so no click is thrown away between gates:
+
+    sincos   cos / sin of the phase, centred on the source-on half (plus the quadrature as a phase check)
+    matched  the source-on template itself (ChA high, or a measured phase profile), made zero-mean
+
+For Poisson clicks the variance of a weighted sum is the sum of squared weights, which gives the
+uncertainty of every point without repeating it. Kept free of TimeTagger imports.
+"""
+
+import numpy
+
+
+_GRID = 1000  # phase samples used for the template and weight functions
+
+
+def _edge_periods(rising, period_ps):
+    """Length in ps of the period starting at each rising edge: the measured one, or period_ps where the next edge is missing"""
+    periods = numpy.full(len(rising), float(period_ps))
+    measured = numpy.diff(rising).astype(float)
+    whole = measured < 1.5 * period_ps  # longer gaps are edges lost between recorded segments
+    periods[:-1][whole] = measured[whole]
+    return periods
+
+
+def _add_exposure(exposure, phase_start, length_periods, period_s):
+    """Add the time spent at each phase grid bin while the phase runs from phase_start for length_periods periods"""
+    wraps = int(length_periods)
+    exposure += wraps * period_s / _GRID
+    remainder = length_periods - wraps
+    edges = numpy.arange(_GRID + 1) / _GRID
+    for start, stop in ((phase_start, min(phase_start + remainder, 1.0)), (0.0, max(phase_start + remainder - 1.0, 0.0))):
+        overlap = numpy.clip(numpy.minimum(edges[1:], stop) - numpy.maximum(edges[:-1], start), 0.0, None)
+        exposure += overlap * period_s
+
+
+def fold_phases(detector, rising, falling=None, period_ps=None, window=None):
+    """
+    Phase of every detector tag within its modulation period, and how long each phase was observed
+
+    Tags before the first or after the last reference edge, and across edges lost between recorded segments,
+    are placed using the median measured period (period_ps if there is only one edge), so partial periods
+    at either end of an integration are kept rather than dropped.
+
+    :param detector: Detector tag times in ps
+    :param rising: Reference rising edge times in ps (one per period)
+    :param falling: Reference falling edge times in ps, used for the source-on fraction
+    :param period_ps: Nominal modulation period in ps, used with a single reference edge
+    :param window: (start, stop) of the integration in ps, or a list of them for an integration recorded in
+                   segments; defaults to the span of the tags and edges
+    :return: (phases in [0, 1) of the tags in the window, time in s spent at each of the phase grid bins,
+              median fraction of the period the reference is high, or None without falling edges)
+    """
+    rising = numpy.asarray(rising)
+    if len(rising) == 0:
+        raise ValueError("No reference edges; is the modulation reference connected?")
+    if len(rising) > 1:
+        period_ps = float(numpy.median(numpy.diff(rising)))
+    elif period_ps is None:
+        raise ValueError("A single reference edge and no nominal period to place the tags with")
+    if window is None:
+        window = (min(detector[0], rising[0]) if len(detector) else rising[0],
+                  max(detector[-1] + 1, rising[-1]) if len(detector) else rising[-1])
+    windows = [window] if numpy.ndim(window) == 1 else list(window)
+    kept = numpy.zeros(len(detector), dtype=bool)
+    for start, stop in windows:
+        kept |= (detector >= start) & (detector < stop)
+    detector = detector[kept]
+    periods = _edge_periods(rising, period_ps)
+
+    # Tags before the first edge are phased from it backwards, with the median period
+    edge = numpy.maximum(numpy.searchsorted(rising, detector, side='right') - 1, 0)
+    phases = ((detector - rising[edge]) / periods[edge]) % 1.0
+
+    # Exposure: the window split at every reference edge inside it, each piece at its own period's rate
+    exposure = numpy.zeros(_GRID)
+    for start, stop in windows:
+        inside = rising[(rising > start) & (rising < stop)]
+        bounds = numpy.concatenate(([start], inside, [stop]))
+        for piece_start, piece_stop in zip(bounds[:-1], bounds[1:]):
+            k = max(int(numpy.searchsorted(rising, piece_start, side='right')) - 1, 0)
+            phase_start = ((piece_start - rising[k]) / periods[k]) % 1.0
+            _add_exposure(exposure, phase_start, (piece_stop - piece_start) / periods[k], periods[k] * 1e-12)
+
+    duty = None
+    if falling is not None and len(falling) and len(rising) > 1:
+        following = numpy.searchsorted(falling, rising[:-1], side='left')
+        valid = following < len(falling)
+        high = falling[following[valid]] - rising[:-1][valid]
+        fraction = high / numpy.diff(rising)[valid]
+        fraction = fraction[fraction < 1]
+        if len(fraction):
+            duty = float(numpy.median(fraction))
+    return phases, exposure, duty
+
+
+def square_template(duty: float, lag: float = 0.0):
+    """Source-on template on the phase grid: 1 for lag <= phase < lag + duty (wrapping), else 0"""
+    phase = (numpy.arange(_GRID) + 0.5) / _GRID
+    return (((phase - lag) % 1.0) < duty).astype(float)
+
+
+def phase_profile(phases, num_bins: int = 100):
+    """Folded click histogram normalised to its maximum, e.g. from a high-signal point, for use as a matched template"""
+    profile = numpy.bincount(numpy.minimum((phases * num_bins).astype(numpy.int64), num_bins - 1), minlength=num_bins)
+    profile = profile - profile.min()
+    return profile / profile.max() if profile.max() > 0 else profile.astype(float)
+
+
+class LockInDemodulator:
+    """
+    Weighted-click estimate of the modulated signal rate.
+    The estimate is scaled so a source that adds S Hz while on reads S, like the box gates' on-minus-off rate.
+    """
+
+    def __init__(self, weighting: str = 'sincos', lag_ms: float = 0.0, period_ms: float = 1000.0, template=None):
+        """
+        :param weighting: 'sincos' or 'matched'
+        :param lag_ms: Delay of the source response after the reference rising edge, in ms
+        :param period_ms: Nominal modulation period in ms, used to convert lag_ms and to place tags when
+                          an integration holds a single reference edge
+        :param template: Optional source-on profile over one period (any length); default is the ChA-high square
+        """
+        if weighting not in ('sincos', 'matched'):
+            raise ValueError(f"Unknown lock-in weighting '{weighting}', use 'sincos' or 'matched'")
+        self.weighting = weighting
+        self.lag = (lag_ms / period_ms) % 1.0
+        self.period_ms = period_ms
+        self.template = None if template is None else numpy.asarray(template, dtype=float)
+
+    @classmethod
+    def from_params(cls, params):
+        """Build the demodulator from the 'lockin' YAML section, or return None if disabled"""
+        config = params.get('lockin', {}) or {}
+        if not config.get('enabled', False):
+            return None
+        template = None
+        if config.get('template_file'):
+            template = numpy.load(config['template_file'])
+        return cls(weighting=str(config.get('weighting', 'sincos')).lower(),
+                   lag_ms=float(config.get('lag_ms', 0.0)), template=template)
+
+    def _template(self, duty):
+        if self.template is not None:
+            grid = (numpy.arange(_GRID) + 0.5) / _GRID
+            source = (numpy.arange(len(self.template)) + 0.5) / len(self.template)
+            return numpy.interp(grid, source, self.template, period=1.0)
+        return square_template(duty if duty is not None else 0.5, self.lag)
+
+    def _weights(self, h):
+        """(in-phase, quadrature or None) zero-mean weight functions on the phase grid"""
+        if self.weighting == 'matched':
+            return h - h.mean(), None
+        # Centre the cosine on the template's first harmonic, so a square or measured profile both line up
+        phase = (numpy.arange(_GRID) + 0.5) / _GRID
+        centre = numpy.angle(numpy.sum(h * numpy.exp(2j * numpy.pi * phase))) / (2 * numpy.pi)
+        return numpy.cos(2 * numpy.pi * (phase - centre)), numpy.sin(2 * numpy.pi * (phase - centre))
+
+    def demodulate(self, detector, rising, falling=None, window=None):
+        """
+        Demodulate one acquisition
+
+        Dark and signal rate are solved from the click count and the weighted sum together, with the time
+        spent at each phase as the exposure. Over whole periods the weights are zero-mean and this is the
+        plain weighted sum; partial periods at the ends of a short integration are no longer a bias.
+
+        :param detector: Detector tag times in ps
+        :param rising: Reference rising edge times in ps
+        :param falling: Reference falling edge times in ps (for the source-on fraction)
+        :param window: (start, stop) of the integration in ps, or a list of them (see fold_phases)
+        :return: Dictionary with counts (signal rate), dark_counts, sigma, quadrature (all Hz) and t_sec
+        """
+        phases, exposure, duty = fold_phases(detector, rising, falling, self.period_ms * 1e9, window)
+        h = self._template(duty)
+        in_phase, quadrature = self._weights(h)
+        index = numpy.minimum((phases * _GRID).astype(numpy.int64), _GRID - 1)
+        w = in_phase[index]
+        clicks = len(phases)
+        weighted = numpy.sum(w)
+        # Expected clicks = T D + <e h> S, expected weighted sum = <e w> D + <e w h> S
+        t_sec = exposure.sum()
+        e_h = numpy.sum(exposure * h)
+        e_w = numpy.sum(exposure * in_phase)
+        e_wh = numpy.sum(exposure * in_phase * h)
+        det = t_sec * e_wh - e_h * e_w
+        signal = (t_sec * weighted - e_w * clicks) / det
+        dark = (e_wh * clicks - e_h * weighted) / det
+        # Poisson: var(clicks) = clicks, var(weighted) = sum w^2, cov = sum w
+        variance = (t_sec**2 * numpy.sum(w**2) + e_w**2 * clicks - 2 * t_sec * e_w * weighted) / det**2
+        values = {'counts': float(signal), 'dark_counts': float(dark), 'sigma': float(numpy.sqrt(max(variance, 0.0))),
+                  't_sec': float(t_sec), 'quadrature': numpy.nan}
+        if quadrature is not None:
+            values['quadrature'] = float((t_sec * numpy.sum(quadrature[index]) - numpy.sum(exposure * quadrature) * clicks) / det)
+        return values
@@ -0,0 +1,106 @@
+"""
+Reusable TimeTagger measurement objects for sweeps
+Constructing a Counter or Countrate registers a new measurement with the tagger engine, so sweeps
+take their measurements from a pool that creates each one once and re-arms it for every point
+"""
+
+import time
+
+import numpy
+from TimeTagger import CHANNEL_UNUSED, Correlation, Counter, Countrate, TimeTagStream
+
+
+class MeasurementPool:
+    """
+    Creates each distinct Counter/Countrate once and hands the same object back on later requests.
+    Call clear() whenever the virtual channels the measurements refer to are recreated.
+    """
+
+    def __init__(self, tagger):
+        self.tagger = tagger
+        self._measurements = {}
+
+    def counter(self, channels, binwidth: int, n_values: int):
+        """Counter over channels with the given binning, created on first use"""
+        key = ('counter', tuple(channels), int(binwidth), int(n_values))
+        if key not in self._measurements:
+            measurement = Counter(self.tagger, list(channels), binwidth=int(binwidth), n_values=int(n_values))
+            measurement.stop()  # Counters start running on construction; only run when armed
+            self._measurements[key] = measurement
+        return self._measurements[key]
+
+    def countrate(self, channels):
+        """Countrate over channels, created on first use"""
+        key = ('countrate', tuple(channels))
+        if key not in self._measurements:
+            measurement = Countrate(self.tagger, list(channels))
+            measurement.stop()
+            self._measurements[key] = measurement
+        return self._measurements[key]
+
+    def correlation(self, click_channel, start_channel=CHANNEL_UNUSED, binwidth: int = 1000, n_bins: int = 1000):
+        """Correlation histogram of click_channel against start_channel, created on first use"""
+        key = ('correlation', int(click_channel), int(start_channel), int(binwidth), int(n_bins))
+        if key not in self._measurements:
+            measurement = Correlation(self.tagger, int(click_channel), int(start_channel),
+                                      binwidth=int(binwidth), n_bins=int(n_bins))
+            measurement.stop()
+            self._measurements[key] = measurement
+        return self._measurements[key]
+
+    @staticmethod
+    def acquire(measurement, duration_ps: int):
+        """Clear, run for duration_ps and block until finished. Returns the measurement for chaining."""
+        measurement.startFor(int(duration_ps), clear=True)
+        measurement.waitUntilFinished()
+        return measurement
+
+    def clear(self):
+        """Stop and release every pooled measurement"""
+        for measurement in self._measurements.values():
+            try:
+                measurement.stop()
+            except Exception as e:
+                print(f"Error stopping pooled measurement: {e}")
+        self._measurements = {}
+
+
+def record_tag_stream(tagger, channels, duration_s: float, buffer_events: int = 10_000_000, poll_interval: float = 0.05,
+                      with_window: bool = False):
+    """
+    Record every tag on the given (physical or virtual) channels for duration_s
+
+    The stream buffer is drained while the recording runs, so the duration is not limited by buffer_events.
+
+    :param with_window: Also return the (start, stop) of the recording in ps, in the timebase of the tags
+    :return: (timestamps in ps, channel numbers) as int64 / int32 arrays in time order[, (start, stop)]
+    """
+    stream = TimeTagStream(tagger, int(buffer_events), list(channels))
+    timestamps = []
+    tag_channels = []
+    overflowed = False
+    start_ps = None
+    try:
+        stream.startFor(int(duration_s * 1e12), clear=True)
+        while True:
+            running = stream.isRunning()
+            data = stream.getData()
+            if start_ps is None:
+                start_ps = int(data.tStart)
+            if data.size:
+                timestamps.append(numpy.array(data.getTimestamps(), dtype=numpy.int64))
+                tag_channels.append(numpy.array(data.getChannels(), dtype=numpy.int32))
+                overflowed = overflowed or bool(data.hasOverflows)
+            if not running:
+                break
+            time.sleep(poll_interval)
+        window = (start_ps, start_ps + int(stream.getCaptureDuration()))
+    finally:
+        stream.stop()
+    if overflowed:
+        print("Warning: the tag stream overflowed, some tags are missing from the recording")
+    if not timestamps:
+        timestamps, tag_channels = numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int32)
+    else:
+        timestamps, tag_channels = numpy.concatenate(timestamps), numpy.concatenate(tag_channels)
+    return (timestamps, tag_channels, window) if with_window else (timestamps, tag_channels)
@@ -0,0 +1,277 @@
+"""
+Concurrent multi-detector sweeps
+Several detectors, each with its own SIM928 slot, tagger input and gate configuration, are swept together:
+every bias point sets all SIM928 slots, and every trigger level is acquired for all detectors at once
+through one Counter over all of their channels. Configured by a 'detectors' list in the params YAML:
+
+    detectors:
+      - {name: pix1, slot: 1, channel: 5}
+      - {name: pix2, slot: 3, channel: 6, on_gate_ms: [30, 270], off_gate_ms: [450, 950]}
+
+    python pcr_multi_detector.py PCR_multi_trigger_params.yml array_sweep.csv
+
+Each detector gets its own CSV and PNG (<output>_<name>.csv/.png).
+"""
+
+import argparse
+import csv
+import sys
+import time
+
+import numpy
+from matplotlib.figure import Figure
+
+from pcr_measurements import MeasurementPool
+from pcr_plotting import SweepPlotter
+from pcr_results import SweepResults
+from pcr_runner import GatingGraph, ON_GATE_MS, OFF_GATE_MS, PCRSweepRunner
+from pcr_sweep import parse_sweep_params, uniform_bias_grid
+
+
+class DetectorChannel:
+    """One detector of a multi-detector sweep: its bias source, gating graph and results"""
+
+    def __init__(self, name: str, slot: int, channel: int, gating, set_bias):
+        """
+        :param name: Label used in file names and printouts
+        :param slot: SIM900 slot of the detector's SIM928
+        :param channel: Tagger input of the detector (also the input whose trigger level is swept)
+        :param gating: GatingGraph of this detector
+        :param set_bias: Callable taking a voltage and returning True if it was applied
+        """
+        self.name = name
+        self.slot = slot
+        self.channel = channel
+        self.gating = gating
+        self.set_bias = set_bias
+        self.results = None
+
+
+def detector_definitions(params):
+    """The 'detectors' YAML list with defaults filled in"""
+    definitions = []
+    for index, entry in enumerate(params.get('detectors', []) or []):
+        definitions.append({
+            'name': str(entry.get('name', f"det{index + 1}")),
+            'slot': int(entry['slot']),
+            'channel': int(entry['channel']),
+            'on_gate_ms': tuple(entry.get('on_gate_ms', ON_GATE_MS)),
+            'off_gate_ms': tuple(entry.get('off_gate_ms', OFF_GATE_MS)),
+            'dead_time': entry.get('dead_time'),  # ns, leaves the input as configured if omitted
+        })
+    return definitions
+
+
+def counter_rows(gatings, measurement_type):
+    """
+    Counter channels for several gating graphs read by one Counter
+
+    :return: Channel list, and for each gating graph the row indices of (raw, on, off), None where not measured
+    """
+    channels = []
+    rows = []
+    for gating in gatings:
+        raw = on = off = None
+        if measurement_type in ('dcr', 'combined'):
+            raw = len(channels)
+            channels.append(gating.detector_channel)
+        if measurement_type in ('filtered_pcr', 'combined'):
+            on = len(channels)
+            channels.append(gating.filtered_on.getChannel())
+            off = len(channels)
+            channels.append(gating.filtered_off.getChannel())
+        rows.append((raw, on, off))
+    return channels, rows
+
+
+def store_counter_point(params, results, row, j, gating, clicks, rows, counted_sec, bin_duration):
+    """
+    Store one (bias, trigger level) point from the Counter rows of one gating graph
+
+    :param clicks: Counter.getData() of the shared Counter
+    :param rows: (raw, on, off) row indices of this gating graph, from counter_rows
+    :param counted_sec: Time covered by the Counter's bins (n_values x binwidth), which the gated rates are normalised by
+    :return: Printable summary of the point
+    """
+    raw, on, off = rows
+    fudge_factor = params['fudge_factor']
+    message = ""
+    if on is not None:
+        ratio_on = gating.ratio_on * fudge_factor
+        ratio_off = gating.ratio_off / fudge_factor
+        clicks_on = numpy.sum(clicks[on])
+        clicks_off = numpy.sum(clicks[off])
+        count = (clicks_on/ (ratio_on*counted_sec)) - (clicks_off/ (ratio_off*counted_sec))
+        dark_count = (clicks_off/ (ratio_off*counted_sec))
+        results.set_point(row, j, counts=count, dark_counts=dark_count)
+        message += f" Signal {count:.1f}, Dark {dark_count:.1f}"
+    if raw is not None:
+        stats = PCRSweepRunner._store_dcr_bins(params, results, row, j, clicks[raw] / bin_duration)
+        message += f" DCR {stats['dcr_mean']:.1f} Hz" + (" (bursty)" if stats['dcr_flag'] else "")
+    return message
+
+
+def write_sweep_outputs(results, base, label):
+    """Write <base>.csv (sorted by bias) and <base>.png for a SweepResults"""
+    try:
+        with open(base + '.csv', 'w', newline='') as csvfile:
+            csvwriter = csv.writer(csvfile)
+            csvwriter.writerow(results.csv_header())
+            csvwriter.writerows(SweepResults.csv_rows(results.csv_table(results.bias_order())))
+        print(f"CSV data saved as: {base}.csv")
+    except Exception as e:
+        print(f"Error writing CSV for {label}: {e}")
+    try:
+        plotter = SweepPlotter(Figure().add_subplot(111), results)
+        plotter.save_png(base + '.png', dpi=300)
+        print(f"Plot saved as: {base}.png")
+    except Exception as e:
+        print(f"Error saving plot for {label}: {e}")
+
+
+class MultiDetectorSweepRunner:
+    """
+    Runs a filtered_pcr, dcr or combined sweep on several detectors in parallel.
+    All detectors share the bias voltage grid and trigger levels; each keeps its own SweepResults.
+    """
+
+    def __init__(self, tagger, detectors, measurement_pool):
+        self.tagger = tagger
+        self.detectors = list(detectors)
+        self.measurement_pool = measurement_pool
+
+    def _set_all_biases(self, voltage):
+        """Set every detector's SIM928; returns one success flag per detector"""
+        return [detector.set_bias(voltage) for detector in self.detectors]
+
+    def run(self, params, filename):
+        measurement_type, trigger_levels = parse_sweep_params(params)
+        int_time_sec = float(params['integration_time'])
+        int_time = int(int_time_sec * 1e12)
+        settle_time = float(params.get('settle_time', 0.2))
+        trigger_settle_time = float(params.get('trigger_settle_time', 0.2))
+        voltages = uniform_bias_grid(params['voltage']['start'], params['voltage']['stop'], params['voltage']['step'])
+
+        bin_duration = 0.1
+        if measurement_type in ('dcr', 'combined'):
+            num_bins = int(int_time_sec / bin_duration)
+            binwidth = int(bin_duration * 1e12)
+        else:
+            num_bins = 1
+            binwidth = int_time
+
+        for detector in self.detectors:
+            detector.results = SweepResults(measurement_type, trigger_levels, num_bins=num_bins,
+                                            bin_duration=bin_duration, capacity=len(voltages))
+
+        # One Counter over every detector's channels, so all are counted over the same interval
+        channels, rows = counter_rows([detector.gating for detector in self.detectors], measurement_type)
+        counter = self.measurement_pool.counter(channels, binwidth=binwidth, n_values=num_bins)
+        counted_sec = num_bins * binwidth * 1e-12  # may be shorter than int_time_sec when it isn't whole DCR bins
+        print(f"Sweeping {len(self.detectors)} detectors over {len(voltages)} bias points x {len(trigger_levels)} trigger levels")
+
+        for voltage in voltages:
+            successes = self._set_all_biases(voltage)
+            bias_set_at = time.monotonic()
+            row = None
+            for detector in self.detectors:
+                row = detector.results.add_bias(voltage)
+            for detector, success in zip(self.detectors, successes):
+                if not success:
+                    print(f"  {detector.name}: bias {voltage:.3f} V not applied, point left empty")
+
+            for j, trigger_level in enumerate(trigger_levels):
+                for detector in self.detectors:
+                    self.tagger.setTriggerLevel(detector.channel, float(trigger_level))
+                deadline = time.monotonic() + trigger_settle_time
+                if j == 0:
+                    deadline = max(deadline, bias_set_at + settle_time)
+                remaining = deadline - time.monotonic()
+                if remaining > 0:
+                    time.sleep(remaining)
+
+                clicks = MeasurementPool.acquire(counter, int_time).getData()
+                for detector, success, detector_rows in zip(self.detectors, successes, rows):
+                    if not success:
+                        continue
+                    message = store_counter_point(params, detector.results, row, j, detector.gating, clicks,
+                                                  detector_rows, counted_sec, bin_duration)
+                    print(f"  {detector.name} V={voltage:.3f} TL={float(trigger_level):.3f}:" + message)
+
+        base = filename[:-4] if filename.lower().endswith('.csv') else filename
+        for detector in self.detectors:
+            write_sweep_outputs(detector.results, f"{base}_{detector.name}", detector.name)
+        print(f'Finished {measurement_type.upper()} multi-detector sweep.')
+        return {detector.name: detector.results for detector in self.detectors}
+
+
+def main(argv=None):
+    from pcr_headless import HeadlessSession, load_yaml
+
+    parser = argparse.ArgumentParser(description="Sweep several detectors, each on its own SIM928 slot, in parallel")
+    parser.add_argument("params", help="Parameters YAML with a detectors list")
+    parser.add_argument("output", help="Base CSV path; one file per detector is written")
+    parser.add_argument("--channels", default="channel_params.yaml", help="Tagger input settings as saved by the GUI")
+    args = parser.parse_args(argv)
+
+    try:
+        params = load_yaml(args.params)
+        channel_params = load_yaml(args.channels)
+    except Exception as e:
+        print(f"Error loading parameters: {e}")
+        return 1
+    definitions = detector_definitions(params)
+    if not definitions or parse_sweep_params(params) is None:
+        print("Error: the params YAML needs a non-empty 'detectors' list and valid sweep parameters.")
+        return 1
+
+    session = HeadlessSession(channel_params)
+    slots = []
+    try:
+        if not session.open():
+            return 1
+        # Every slot is addressed through the session's one serial link to the SIM900 mainframe
+        link = session.sim928
+        home_slot = link.slot
+        reference_channel = session.gating.reference_channel
+        detectors = []
+        for definition in definitions:
+            slot = definition['slot']
+            if slot != home_slot and slot not in slots:
+                try:
+                    link.select_slot(slot)
+                    link.source.turnOn()
+                except Exception as e:
+                    print(f"Error: SIM928 in slot {slot} not available, aborting sweep: {e}")
+                    link.select_slot(home_slot)
+                    return 1
+                slots.append(slot)
+            if definition['dead_time'] is not None:
+                session.tagger.setDeadtime(definition['channel'], int(definition['dead_time'] * 1000))
+                session.tagger.setDeadtime(definition['channel']*-1, int(definition['dead_time'] * 1000))
+            gating = GatingGraph(session.tagger, reference_channel, definition['channel'],
+                                 definition['on_gate_ms'], definition['off_gate_ms'])
+            detectors.append(DetectorChannel(definition['name'], slot, definition['channel'], gating,
+                                             lambda voltage, slot=slot: link.set_voltage_on_slot(slot, voltage)))
+        link.select_slot(home_slot)
+
+        MultiDetectorSweepRunner(session.tagger, detectors, session.measurement_pool).run(params, args.output)
+
+        link.select_slot(home_slot)
+        session.shutdown(params)
+        if params.get('turn_off_after_pcr', {}).get('sim928', False):
+            for slot in slots:
+                try:
+                    link.select_slot(slot)
+                    link.source.turnOff()
+                    print(f"SIM928 in slot {slot} turned off successfully")
+                except Exception as e:
+                    print(f"Error turning off SIM928 in slot {slot}: {e}")
+            link.select_slot(home_slot)
+    finally:
+        session.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,295 @@
+"""
+Generic N-dimensional sweeps
+Any ordered set of axes (SIM928 bias, tagger trigger level, 33622A amplitude/offset/frequency, dead time)
+is swept with the slowest instruments outermost, and each measured quantity lands in one N-D array
+indexed in the order the axes were given.
+
+Configured by an 'nd_sweep' section in the params YAML and run with
+
+    python pcr_nd_sweep.py PCR_multi_trigger_params.yml nd_sweep.npz
+"""
+
+import argparse
+import itertools
+import sys
+import time
+
+import numpy
+import yaml
+
+from pcr_measurements import MeasurementPool
+from pcr_statistics import gated_signal_rate
+
+
+class SweepAxis:
+    """
+    One swept setting. apply(value) sets the instrument; cost is the typical time in seconds a change
+    of this axis takes including settling, used to put expensive axes outermost.
+    """
+
+    def __init__(self, name: str, values, unit: str, apply, cost: float, settle_time: float = 0.0):
+        """
+        :param name: Axis name, used for the coordinate arrays in the output
+        :param values: Values to visit, in order
+        :param unit: Unit of the values
+        :param apply: Callable setting the instrument to a value; returns False if that failed
+        :param cost: Typical seconds per change (instrument latency + settling)
+        :param settle_time: Seconds to wait after a change before measuring
+        """
+        self.name = name
+        self.values = numpy.asarray(values, dtype=float)
+        self.unit = unit
+        self._apply = apply
+        self.cost = cost
+        self.settle_time = settle_time
+
+    def __len__(self):
+        return len(self.values)
+
+    def apply(self, value):
+        return self._apply(value) is not False
+
+
+def bias_axis(values, set_bias, settle_time=0.2):
+    """SIM928 voltage in V"""
+    return SweepAxis('bias_voltage', values, 'V', set_bias, cost=0.1 + settle_time, settle_time=settle_time)
+
+
+def trigger_level_axis(tagger, channel, values, settle_time=0.2):
+    """Tagger trigger level of one input in V"""
+    return SweepAxis('trigger_level', values, 'V', lambda v: tagger.setTriggerLevel(channel, float(v)),
+                     cost=0.01 + settle_time, settle_time=settle_time)
+
+
+def dead_time_axis(tagger, channel, values):
+    """Tagger dead time of one input in ns"""
+    def apply(value):
+        tagger.setDeadtime(channel, int(value * 1000))
+        tagger.setDeadtime(channel*-1, int(value * 1000))
+    return SweepAxis('dead_time', values, 'ns', apply, cost=0.01)
+
+
+def function_gen_axis(function_gen, setting, channel, values, settle_time=2.0, gating=None):
+    """
+    33622A output setting: 'amplitude' (Vpp), 'offset' (V) or 'frequency' (Hz)
+    The thermal source needs a few modulation periods to follow a new level, hence the long default settle time.
+    With a gating graph, a frequency change also moves its on/off gates to the same fractions of the new period.
+    """
+    setters = {'amplitude': (function_gen.set_amplitude, 'Vpp'),
+               'offset': (function_gen.set_offset, 'V'),
+               'frequency': (function_gen.set_frequency, 'Hz')}
+    if setting not in setters:
+        raise ValueError(f"Unknown 33622A axis '{setting}'. Must be one of {sorted(setters)}.")
+    setter, unit = setters[setting]
+
+    def apply(value):
+        if setter(channel, float(value)) is False:
+            return False
+        if setting == 'frequency' and gating is not None:
+            gating.set_modulation_period(1000 / float(value))
+
+    return SweepAxis(f'fgen_ch{channel}_{setting}', values, unit, apply, cost=0.3 + settle_time, settle_time=settle_time)
+
+
+class GatedRateMeasurement:
+    """Dark-subtracted signal rate from the on/off gates of a GatingGraph, per point"""
+
+    quantities = {'signal': ((), 'Hz'), 'dark': ((), 'Hz'), 'sigma': ((), 'Hz')}
+
+    def __init__(self, measurement_pool, gating, int_time_sec: float, fudge_factor: float):
+        self.int_time_sec = int_time_sec
+        self.ratio_on_fudged = gating.ratio_on * fudge_factor
+        self.ratio_off_fudged = gating.ratio_off / fudge_factor
+        self.int_time = int(int_time_sec * 1e12)
+        # On and off gates in one Counter: row 0 is on, row 1 is off
+        self.counter = measurement_pool.counter([gating.filtered_on.getChannel(), gating.filtered_off.getChannel()],
+                                                binwidth=self.int_time, n_values=1)
+
+    def __call__(self):
+        clicks = MeasurementPool.acquire(self.counter, self.int_time).getData()
+        signal, dark, sigma = gated_signal_rate(clicks[0][0], clicks[1][0], self.ratio_on_fudged,
+                                                self.ratio_off_fudged, self.int_time_sec)
+        return {'signal': signal, 'dark': dark, 'sigma': sigma}
+
+
+class DCRMeasurement:
+    """Binned count rate of the detector input, per point"""
+
+    def __init__(self, measurement_pool, detector_channel: int, int_time_sec: float, bin_duration: float = 0.1):
+        self.bin_duration = bin_duration
+        self.num_bins = int(int_time_sec / bin_duration)
+        self.int_time = int(int_time_sec * 1e12)
+        self.counter = measurement_pool.counter([detector_channel], binwidth=int(bin_duration * 1e12), n_values=self.num_bins)
+        self.quantities = {'dcr_bins': ((self.num_bins,), 'Hz')}
+
+    def __call__(self):
+        bins = MeasurementPool.acquire(self.counter, self.int_time).getData()[0]
+        return {'dcr_bins': bins / self.bin_duration}
+
+
+class NDSweep:
+    """
+    Visits every combination of the axis values.
+    Axes are executed slowest (highest cost) outermost and an axis is only re-applied when its value changes,
+    so e.g. the thermal source is stepped once per full bias x trigger level block.
+    """
+
+    def __init__(self, axes, measure, reorder: bool = True):
+        """
+        :param axes: SweepAxis list; defines the index order of the result arrays
+        :param measure: Callable returning {quantity: value} for the current settings; needs a
+                        'quantities' attribute {quantity: (trailing shape, unit)}
+        :param reorder: Execute axes by descending cost instead of the given order
+        """
+        self.axes = list(axes)
+        self.measure = measure
+        if reorder:
+            # Stable sort keeps the given order among axes of equal cost
+            self.execution_order = sorted(range(len(self.axes)), key=lambda k: -self.axes[k].cost)
+        else:
+            self.execution_order = list(range(len(self.axes)))
+        self.shape = tuple(len(axis) for axis in self.axes)
+        self.results = {name: numpy.full(self.shape + tuple(trailing), numpy.nan)
+                        for name, (trailing, unit) in measure.quantities.items()}
+
+    def points(self):
+        """Index tuples (in axis order) in the order they are measured"""
+        ranges = [range(self.shape[k]) for k in self.execution_order]
+        for executed in itertools.product(*ranges):
+            index = [0] * len(self.axes)
+            for k, i in zip(self.execution_order, executed):
+                index[k] = i
+            yield tuple(index)
+
+    def estimated_duration(self, time_per_point: float):
+        """Seconds for the whole sweep: measurement time plus the cost of every axis change"""
+        total = numpy.prod(self.shape) * time_per_point
+        changes = 1
+        for k in self.execution_order:
+            changes *= self.shape[k]
+            total += changes * self.axes[k].cost
+        return float(total)
+
+    def run(self, on_point=None):
+        """
+        Measure every point. Points whose axis settings could not be applied stay NaN.
+
+        :param on_point: Optional callable(index, values) called after each point
+        :return: The results dictionary of N-D arrays
+        """
+        current = [None] * len(self.axes)
+        failed = [False] * len(self.axes)
+        for index in self.points():
+            settle = 0.0
+            for k in self.execution_order:
+                value = self.axes[k].values[index[k]]
+                if current[k] is None or current[k] != value:
+                    failed[k] = not self.axes[k].apply(value)
+                    current[k] = value
+                    settle = max(settle, self.axes[k].settle_time)
+            if any(failed):
+                print(f"Skipping point {index}: could not apply axis settings")
+                continue
+            if settle > 0:
+                time.sleep(settle)
+
+            values = self.measure()
+            for name, value in values.items():
+                self.results[name][index] = value
+            if on_point is not None:
+                on_point(index, values)
+        return self.results
+
+    def save(self, filename: str, params=None):
+        """Write the result arrays plus axis coordinates and units to an .npz file"""
+        arrays = {f'axis_{axis.name}': axis.values for axis in self.axes}
+        arrays['axis_names'] = numpy.array([axis.name for axis in self.axes])
+        arrays['axis_units'] = numpy.array([axis.unit for axis in self.axes])
+        arrays['quantity_units'] = numpy.array([f"{name}:{unit}" for name, (_, unit) in self.measure.quantities.items()])
+        arrays.update(self.results)
+        if params is not None:
+            arrays['params_yaml'] = numpy.array(yaml.safe_dump(params))
+        numpy.savez(filename, **arrays)
+
+
+def axes_from_params(config, tagger, trigger_channel, set_bias, function_gen=None, gating=None):
+    """
+    Build the axes of the 'nd_sweep' YAML section. Each entry has a type and either values or start/stop/step.
+    An fgen_frequency axis rescales the gates of gating (if given) to the period at each point:
+
+        axes:
+          - {type: bias, start: 0.0, stop: 0.02, step: 0.002}
+          - {type: trigger_level, values: [0.007, 0.008]}
+          - {type: fgen_amplitude, channel: 2, values: [1.0, 2.0]}
+    """
+    axes = []
+    for entry in config['axes']:
+        if 'values' in entry:
+            values = [float(v) for v in entry['values']]
+        else:
+            values = numpy.arange(float(entry['start']), float(entry['stop']) + float(entry['step']) / 2, float(entry['step']))
+        kind = entry['type']
+        if kind == 'bias':
+            axes.append(bias_axis(values, set_bias, settle_time=float(entry.get('settle_time', 0.2))))
+        elif kind == 'trigger_level':
+            axes.append(trigger_level_axis(tagger, int(entry.get('channel', trigger_channel)), values,
+                                           settle_time=float(entry.get('settle_time', 0.2))))
+        elif kind == 'dead_time':
+            axes.append(dead_time_axis(tagger, int(entry.get('channel', trigger_channel)), values))
+        elif kind.startswith('fgen_'):
+            if function_gen is None:
+                raise ValueError(f"Axis '{kind}' needs the 33622A, which is not connected")
+            axes.append(function_gen_axis(function_gen, kind[len('fgen_'):], int(entry.get('channel', 2)), values,
+                                          settle_time=float(entry.get('settle_time', 2.0)), gating=gating))
+        else:
+            raise ValueError(f"Unknown sweep axis type '{kind}'")
+    return axes
+
+
+def main(argv=None):
+    from pcr_headless import HeadlessSession, load_yaml
+
+    parser = argparse.ArgumentParser(description="Run the N-dimensional sweep of a params YAML's nd_sweep section")
+    parser.add_argument("params", help="Parameters YAML with an nd_sweep section")
+    parser.add_argument("output", help="Output .npz path")
+    parser.add_argument("--channels", default="channel_params.yaml", help="Tagger input settings as saved by the GUI")
+    args = parser.parse_args(argv)
+
+    try:
+        params = load_yaml(args.params)
+        config = params['nd_sweep']
+        channel_params = load_yaml(args.channels)
+    except Exception as e:
+        print(f"Error loading parameters: {e}")
+        return 1
+
+    session = HeadlessSession(channel_params)
+    try:
+        if not session.open():
+            return 1
+        trigger_channel = int(channel_params['Channels']['ChC']['channel'])
+        gated = config.get('measurement', 'filtered_pcr') != 'dcr'
+        axes = axes_from_params(config, session.tagger, trigger_channel, session.sim928.set_voltage_robustly,
+                                session.function_gen, gating=session.gating if gated else None)
+        int_time_sec = float(config.get('integration_time', params['integration_time']))
+        if not gated:
+            measure = DCRMeasurement(session.measurement_pool, session.gating.detector_channel, int_time_sec)
+        else:
+            measure = GatedRateMeasurement(session.measurement_pool, session.gating, int_time_sec, float(params['fudge_factor']))
+
+        sweep = NDSweep(axes, measure, reorder=config.get('reorder', True))
+        print("Axes (outermost first): " + " > ".join(sweep.axes[k].name for k in sweep.execution_order))
+        print(f"Shape {sweep.shape}, estimated completion time (minutes): {round(sweep.estimated_duration(int_time_sec)/60, 2)}")
+        try:
+            sweep.run()
+        finally:
+            sweep.save(args.output, params)
+            print(f"N-D sweep saved as: {args.output}")
+        session.shutdown(params)
+    finally:
+        session.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,232 @@
+"""
+Sweep job queue for unattended back-to-back runs
+A queue file lists sweep jobs, each a params YAML plus optional overrides and an output CSV.
+Jobs run one after another on a single HeadlessSession, so the SIM928, cryo amp and thermal source
+stay on between them; the shutdown policy is applied once, after the last job.
+
+    python pcr_queue.py run overnight_queue.yml
+    python pcr_queue.py status overnight_queue.yml
+
+Example queue file:
+
+    jobs:
+      - name: pcr_low_tl
+        params: PCR_multi_trigger_params.yml
+        output: data/pcr_low_tl.csv
+        overrides:
+          filtered_PCR:
+            trigger_levels: ["0.007", "0.008"]
+      - name: dcr
+        params: PCR_multi_trigger_params.yml
+        output: data/dcr.csv
+        overrides:
+          measurement_type: dcr
+    turn_off_after_queue:   # defaults to turn_off_after_pcr of the last job
+      cryo_amp: true
+      thermal_source: true
+      sim928: true
+
+Job status is kept in <queue>.status.json, rewritten atomically on every change, so it can be read
+(with the status command or any JSON reader) while the queue runs. Re-running a queue skips jobs
+that are done and resumes an interrupted job from its sweep journal.
+"""
+
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+
+from pcr_journal import SweepJournal
+from pcr_sweep import load_yaml, parse_sweep_params
+
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def merge_params(base, overrides):
+    """Copy of base with overrides applied; nested dictionaries are merged key by key"""
+    merged = copy.deepcopy(base)
+    for key, value in (overrides or {}).items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_params(merged[key], value)
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
+
+
+class SweepQueue:
+    """
+    Jobs of a queue file together with their persisted status.
+    """
+
+    def __init__(self, queue_path: str):
+        self.queue_path = queue_path
+        self.status_path = os.path.splitext(queue_path)[0] + '.status.json'
+        definition = load_yaml(queue_path) or {}
+        self.jobs = definition.get('jobs', []) or []
+        self.turn_off_after_queue = definition.get('turn_off_after_queue')
+        for index, job in enumerate(self.jobs):
+            job.setdefault('name', f'job{index + 1}')
+        self.status = self._load_status()
+
+    def _load_status(self):
+        status = {}
+        if os.path.exists(self.status_path):
+            try:
+                with open(self.status_path, 'r') as file:
+                    status = json.load(file).get('jobs', {})
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable queue status {self.status_path}: {e}")
+        for job in self.jobs:
+            status.setdefault(job['name'], {'state': PENDING})
+        return status
+
+    def _save_status(self):
+        record = {
+            'queue': self.queue_path,
+            'updated': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'jobs': {job['name']: self.status[job['name']] for job in self.jobs},
+        }
+        # Write then rename, so a reader never sees a half-written file
+        tmp_path = self.status_path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(record, file, indent=2)
+        os.replace(tmp_path, self.status_path)
+
+    def set_state(self, job, state, **info):
+        entry = self.status[job['name']]
+        entry['state'] = state
+        entry.update(info)
+        self._save_status()
+
+    def job_params(self, job):
+        """Full sweep parameters of a job: its params file with the overrides applied"""
+        return merge_params(load_yaml(job['params']), job.get('overrides'))
+
+    def shutdown_params(self):
+        """Parameters whose turn_off_after_pcr section is applied after the last job"""
+        if self.turn_off_after_queue is not None:
+            return {'turn_off_after_pcr': self.turn_off_after_queue}
+        if not self.jobs:
+            return {}
+        return self.job_params(self.jobs[-1])
+
+    def print_status(self):
+        print(f"Queue: {self.queue_path}")
+        for job in self.jobs:
+            entry = self.status[job['name']]
+            line = f"  {job['name']:<24} {entry['state']:<8} {job.get('output', '')}"
+            if entry.get('started'):
+                line += f"  started {entry['started']}"
+            if entry.get('finished'):
+                line += f"  finished {entry['finished']}"
+            if entry.get('error'):
+                line += f"  error: {entry['error']}"
+            print(line)
+
+
+def run_queue(queue, channel_params):
+    """Run every job of the queue that is not done yet. Returns the number of failed jobs."""
+    # Imported here so that the status command works on machines without the tagger software
+    from pcr_headless import HeadlessSession
+
+    # Check every job up front, so a typo in the last job does not surface at 4 am
+    for job in queue.jobs:
+        if queue.status[job['name']]['state'] == DONE:
+            continue
+        try:
+            params = queue.job_params(job)
+        except Exception as e:
+            print(f"Error loading parameters of job '{job['name']}': {e}")
+            return len(queue.jobs)
+        if 'output' not in job or parse_sweep_params(params) is None:
+            print(f"Job '{job['name']}' is invalid (needs params and output), queue not started.")
+            return len(queue.jobs)
+
+    failures = 0
+    session = HeadlessSession(channel_params)
+    try:
+        if not session.open():
+            return len(queue.jobs)
+        for job in queue.jobs:
+            entry = queue.status[job['name']]
+            if entry['state'] == DONE:
+                print(f"Skipping finished job '{job['name']}'")
+                continue
+
+            params = queue.job_params(job)
+            filename = job['output']
+
+            # A job interrupted earlier picks up from its journal
+            resume_points = None
+            journal_path = None
+            candidate = SweepJournal.path_for(filename)
+            if entry['state'] in (RUNNING, FAILED) and os.path.exists(candidate):
+                try:
+                    header, resume_points = SweepJournal.load(candidate)
+                    params = header['params']
+                    journal_path = candidate
+                    print(f"Resuming job '{job['name']}': {len(resume_points)} points already measured")
+                except Exception as e:
+                    print(f"Error reading journal of job '{job['name']}', starting it over: {e}")
+
+            print(f"=== Job '{job['name']}' -> {filename} ===")
+            queue.set_state(job, RUNNING, started=time.strftime('%Y-%m-%dT%H:%M:%S'), finished=None, error=None)
+            try:
+                session.run_sweep(params, filename, resume_points=resume_points, journal_path=journal_path)
+                queue.set_state(job, DONE, finished=time.strftime('%Y-%m-%dT%H:%M:%S'))
+            except Exception as e:
+                # One bad job should not cost the rest of the night
+                print(f"Error in job '{job['name']}': {e}")
+                queue.set_state(job, FAILED, finished=time.strftime('%Y-%m-%dT%H:%M:%S'), error=str(e))
+                failures += 1
+
+        session.shutdown(queue.shutdown_params())
+    finally:
+        session.close()
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run or inspect a queue of PCR/DCR sweeps")
+    parser.add_argument("command", choices=['run', 'status', 'reset'],
+                        help="run the pending jobs, show job status, or mark every job pending again")
+    parser.add_argument("queue", help="Queue file listing the sweep jobs")
+    parser.add_argument("--channels", default="channel_params.yaml", help="Tagger input settings as saved by the GUI")
+    args = parser.parse_args(argv)
+
+    try:
+        queue = SweepQueue(args.queue)
+    except Exception as e:
+        print(f"Error loading queue: {e}")
+        return 1
+
+    if args.command == 'status':
+        queue.print_status()
+        return 0
+
+    if args.command == 'reset':
+        for job in queue.jobs:
+            queue.status[job['name']] = {'state': PENDING}
+        queue._save_status()
+        queue.print_status()
+        return 0
+
+    try:
+        channel_params = load_yaml(args.channels)
+    except Exception as e:
+        print(f"Error loading channel parameters: {e}")
+        return 1
+
+    failures = run_queue(queue, channel_params)
+    queue.print_status()
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
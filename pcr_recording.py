@@ -0,0 +1,299 @@
+"""
+Record-everything sweep mode and offline re-analysis
+With raw_recording enabled, every tag of the detector and modulation reference inputs is streamed to
+<output>.tags.npz while the sweep acquires, one segment per acquisition. Each segment starts with a
+marker holding the bias and trigger level it was taken at, so gate windows, fudge factor, a longer
+software dead time or the DCR binning can be changed afterwards without touching the hardware:
+
+    python pcr_recording.py sweep.tags.npz reanalysed.csv --on-gate 40 260 --off-gate 450 950 --fudge 1.1
+"""
+
+import argparse
+import csv
+import json
+import sys
+import time
+import zipfile
+
+import numpy
+
+from pcr_binary import _write_array
+from pcr_lockin import LockInDemodulator, _edge_periods
+from pcr_results import SweepResults
+from pcr_statistics import DCRBinStatistics
+from pcr_sweep import parse_sweep_params
+
+
+_SEGMENT_SEPARATOR = '__seg'
+
+
+class RawTagRecorder:
+    """
+    Streams the raw detector and reference tags of each acquisition into an incremental .npz archive.
+    Recorded are the detector's rising edges and both edges of the reference, which is all the gating
+    graph uses, so any on/off gate can be rebuilt offline.
+    """
+
+    def __init__(self, tagger, filename: str, gating, params=None, buffer_events: int = 10_000_000):
+        """
+        :param tagger: TimeTagger instance
+        :param filename: Output .npz path
+        :param gating: GatingGraph of the sweep (its channels are recorded, its gates stored as defaults)
+        :param params: Parameter dictionary, embedded as JSON text
+        :param buffer_events: Tag buffer of the stream; one acquisition must fit into it
+        """
+        from TimeTagger import TimeTagStream  # imported here so the offline analysis runs without the TimeTagger software
+
+        self.filename = filename
+        self.channels = {'detector': gating.detector_channel, 'reference': gating.reference_channel,
+                         'reference_falling': -gating.reference_channel}
+        self.stream = TimeTagStream(tagger, int(buffer_events), list(self.channels.values()))
+        self.stream.stop()
+        self._segments = 0
+        self._marker = None
+        self._attempts = {}
+
+        metadata = {
+            'channels': numpy.array(json.dumps(self.channels)),
+            'gates': numpy.array(json.dumps({'on_gate_ms': list(gating.on_gate_ms), 'off_gate_ms': list(gating.off_gate_ms)})),
+            'params_json': numpy.array(json.dumps(params or {})),
+            'created': numpy.array(time.strftime('%Y-%m-%dT%H:%M:%S')),
+        }
+        with zipfile.ZipFile(filename, 'w', compression=zipfile.ZIP_STORED) as archive:
+            for name, array in metadata.items():
+                _write_array(archive, name, array)
+
+    @classmethod
+    def from_params(cls, params, tagger, filename, gating):
+        """Build the recorder from the 'raw_recording' YAML section, or return None if disabled"""
+        config = params.get('raw_recording', {}) or {}
+        if not config.get('enabled', False):
+            return None
+        base = filename[:-4] if filename.lower().endswith('.csv') else filename
+        return cls(tagger, base + '.tags.npz', gating, params,
+                   buffer_events=int(config.get('buffer_events', 10_000_000)))
+
+    def start_point(self, bias_index: int):
+        """Mark the start of a bias point; segments of an earlier attempt at the same point (e.g. before a latch) are superseded"""
+        self._attempts[bias_index] = self._attempts.get(bias_index, -1) + 1
+
+    def begin(self, bias_index: int, voltage: float, tl_index: int, trigger_level: float):
+        """Start a segment; called right before an acquisition with the point it belongs to"""
+        self._marker = {'bias_index': int(bias_index), 'attempt': self._attempts.get(bias_index, 0),
+                        'voltage': float(voltage), 'tl_index': int(tl_index),
+                        'trigger_level': float(trigger_level), 'host_time': time.time()}
+        self.stream.startFor(int(3600e12), clear=True)  # stopped by end()
+
+    def end(self):
+        """Stop the segment and append its tags and marker to the archive"""
+        self.stream.stop()
+        data = self.stream.getData()
+        # tStart is the stream's start in the tag timebase, the origin the live Counter bins are counted from
+        marker = dict(self._marker, start_ps=int(data.tStart), duration_ps=int(self.stream.getCaptureDuration()),
+                      overflow=bool(data.hasOverflows))
+        if marker['overflow']:
+            print("Warning: raw tag buffer overflowed, increase raw_recording.buffer_events")
+        suffix = f'{_SEGMENT_SEPARATOR}{self._segments:06d}'
+        with zipfile.ZipFile(self.filename, 'a', compression=zipfile.ZIP_STORED) as archive:
+            _write_array(archive, 'marker' + suffix, numpy.array(json.dumps(marker)))
+            _write_array(archive, 'timestamps' + suffix, numpy.array(data.getTimestamps(), dtype=numpy.int64))
+            _write_array(archive, 'tag_channels' + suffix, numpy.array(data.getChannels(), dtype=numpy.int32))
+        self._segments += 1
+
+
+def load_recording(filename: str):
+    """
+    Read a raw tag archive
+
+    :return: (metadata dictionary, list of segments as (marker, timestamps, channels) in recording order)
+    """
+    segments = {}
+    metadata = {}
+    with numpy.load(filename, allow_pickle=False) as archive:
+        for key in archive.files:
+            if _SEGMENT_SEPARATOR in key:
+                name, index = key.split(_SEGMENT_SEPARATOR)
+                segments.setdefault(int(index), {})[name] = archive[key]
+            else:
+                metadata[key] = json.loads(str(archive[key])) if key != 'created' else str(archive[key])
+    ordered = []
+    for index in sorted(segments):
+        members = segments[index]
+        if len(members) < 3:  # interrupted while appending
+            continue
+        ordered.append((json.loads(str(members['marker'])), members['timestamps'], members['tag_channels']))
+    return metadata, ordered
+
+
+def apply_dead_time(timestamps, dead_time_ps: int):
+    """
+    Non-paralysable software dead time: drop every tag within dead_time_ps of the previous kept tag.
+    Only lengthens the dead time set on the tagger while recording.
+    """
+    keep = numpy.ones(len(timestamps), dtype=bool)
+    while True:
+        index = numpy.flatnonzero(keep)
+        too_close = numpy.diff(timestamps[index]) < dead_time_ps
+        # Drop a tag only if the tag before it is itself kept, which resolves bursts one tag per pass
+        previous_ok = numpy.concatenate(([True], ~too_close[:-1]))
+        drop = too_close & previous_ok
+        if not numpy.any(drop):
+            return timestamps[keep]
+        keep[index[1:][drop]] = False
+
+
+def gate_counts(detector, reference_edges, gate_ms, period_ps=None):
+    """
+    Number of detector tags whose delay after the latest reference rising edge falls in gate_ms
+
+    :param period_ps: Modulation period in ps. If given, tags before the first edge or after edges that were
+                      not recorded (gaps between segments) are placed by whole periods instead of dropped.
+    """
+    if len(reference_edges) == 0:
+        return 0
+    edge = numpy.searchsorted(reference_edges, detector, side='right') - 1
+    if period_ps is None:
+        delay = detector[edge >= 0] - reference_edges[edge[edge >= 0]]
+    else:
+        periods = _edge_periods(reference_edges, period_ps)
+        edge = numpy.maximum(edge, 0)
+        delay = (detector - reference_edges[edge]) % periods[edge]
+    start, stop = gate_ms
+    return int(numpy.count_nonzero((delay >= start * 1e9) & (delay < stop * 1e9)))
+
+
+def analyse_recording(filename: str, measurement_type: str = None, on_gate_ms=None, off_gate_ms=None,
+                      fudge_factor: float = None, dead_time_ns: float = None, bin_duration: float = 0.1,
+                      modulation_period_ms: float = 1000, lockin: str = None):
+    """
+    Recompute a sweep from a raw tag archive
+
+    Gates, fudge factor and measurement type default to those the sweep was recorded with.
+    Segments of the same (bias, trigger level) are merged, so the sub-integrations of a cycled point add up;
+    only the last attempt at each bias point is used. Clicks are gated against the reference edges of the
+    whole recording, so a segment shorter than a period, or its start before its own first edge, still counts.
+
+    :param dead_time_ns: Extra software dead time applied to the detector tags, in ns
+    :param lockin: 'sincos' or 'matched' to demodulate the gated quantities instead of counting box gates
+    :return: SweepResults
+    """
+    metadata, segments = load_recording(filename)
+    params = metadata.get('params_json', {}) or {}
+    parsed = parse_sweep_params(params) if params else None
+    if measurement_type is None:
+        measurement_type = parsed[0] if parsed else 'filtered_pcr'
+    on_gate_ms = on_gate_ms or metadata['gates']['on_gate_ms']
+    off_gate_ms = off_gate_ms or metadata['gates']['off_gate_ms']
+    if fudge_factor is None:
+        fudge_factor = float(params.get('fudge_factor', 1.0))
+    channels = metadata['channels']
+
+    # Group the segments by point; the reference edges of all segments form one continuous edge train
+    last_attempt = {}
+    for marker, _, _ in segments:
+        last_attempt[marker['bias_index']] = max(last_attempt.get(marker['bias_index'], 0), marker.get('attempt', 0))
+
+    def edge_train(channel):
+        edges = [timestamps[tag_channels == channel] for _, timestamps, tag_channels in segments]
+        return numpy.unique(numpy.concatenate(edges)) if edges else numpy.zeros(0, dtype=numpy.int64)
+    rising_edges = edge_train(channels['reference'])
+    falling_edges = edge_train(channels['reference_falling'])
+    period_ps = float(numpy.median(numpy.diff(rising_edges))) if len(rising_edges) > 1 else modulation_period_ms * 1e9
+    points = {}
+    voltages = {}
+    levels = {}
+    for marker, timestamps, tag_channels in segments:
+        if marker.get('attempt', 0) != last_attempt[marker['bias_index']]:
+            continue
+        key = (marker['bias_index'], marker['tl_index'])
+        detector = timestamps[tag_channels == channels['detector']]
+        if dead_time_ns:
+            detector = apply_dead_time(detector, int(dead_time_ns * 1000))
+        # Archives from before start_ps was recorded only have the first tag as the segment origin
+        start = marker.get('start_ps', timestamps[0] if len(timestamps) else 0)
+        points.setdefault(key, []).append((detector, start, marker['duration_ps']))
+        voltages[marker['bias_index']] = marker['voltage']
+        levels[marker['tl_index']] = marker['trigger_level']
+
+    trigger_levels = [levels[j] for j in sorted(levels)]
+    num_bins = 1
+    if measurement_type in ('dcr', 'combined'):
+        longest = max(sum(segment[2] for segment in point) for point in points.values()) * 1e-12
+        num_bins = max(1, int(round(longest / bin_duration)))
+    results = SweepResults(measurement_type, trigger_levels, num_bins=num_bins, bin_duration=bin_duration,
+                           capacity=max(len(voltages), 1), lockin=lockin is not None)
+    demodulator = LockInDemodulator(lockin, period_ms=modulation_period_ms) if lockin is not None else None
+    rows = {bias_index: results.add_bias(voltages[bias_index]) for bias_index in sorted(voltages)}
+    tl_index = {j: position for position, j in enumerate(sorted(levels))}
+
+    ratio_on = (on_gate_ms[1] - on_gate_ms[0]) / modulation_period_ms * fudge_factor
+    ratio_off = (off_gate_ms[1] - off_gate_ms[0]) / modulation_period_ms / fudge_factor
+    analysis_params = dict(params, fudge_factor=fudge_factor)
+    for (bias_index, j), point in points.items():
+        row, column = rows[bias_index], tl_index[j]
+        t_sec = sum(segment[2] for segment in point) * 1e-12
+        if measurement_type in ('filtered_pcr', 'combined') and demodulator is not None:
+            # All segments of the point demodulated together, each over its own recording window
+            try:
+                demodulated = demodulator.demodulate(numpy.concatenate([segment[0] for segment in point]),
+                                                     rising_edges, falling_edges,
+                                                     [(start, start + duration) for _, start, duration in point])
+                results.set_point(row, column, **demodulated)
+            except ValueError as e:
+                print(f"Point {bias_index}/{j} left empty: {e}")
+        elif measurement_type in ('filtered_pcr', 'combined'):
+            clicks_on = sum(gate_counts(segment[0], rising_edges, on_gate_ms, period_ps) for segment in point)
+            clicks_off = sum(gate_counts(segment[0], rising_edges, off_gate_ms, period_ps) for segment in point)
+            count = (clicks_on/ (ratio_on*t_sec)) - (clicks_off/ (ratio_off*t_sec))
+            dark_count = (clicks_off/ (ratio_off*t_sec))
+            results.set_point(row, column, counts=count, dark_counts=dark_count)
+        if measurement_type in ('dcr', 'combined'):
+            # Segments are laid end to end, as the Counter bins of a cycled point are
+            bins = numpy.zeros(num_bins)
+            offset = 0.0
+            for detector, start, duration in point:
+                index = ((detector - start) * 1e-12 + offset) // bin_duration
+                index = index[(index >= 0) & (index < num_bins)].astype(numpy.int64)
+                bins += numpy.bincount(index, minlength=num_bins)
+                offset += duration * 1e-12
+            statistics = DCRBinStatistics.from_params(analysis_params, bin_duration)
+            statistics.update(bins / bin_duration)
+            results.set_point(row, column, dcr_bins=bins / bin_duration, **statistics.summary(results.allan_factors))
+    return results
+
+
+def main(argv=None):
+    from matplotlib.figure import Figure
+    from pcr_plotting import SweepPlotter
+
+    parser = argparse.ArgumentParser(description="Recompute a PCR/DCR sweep from a raw tag recording")
+    parser.add_argument("recording", help="Raw tag archive written during the sweep (<output>.tags.npz)")
+    parser.add_argument("output", help="CSV output path for the recomputed curve")
+    parser.add_argument("--type", choices=('filtered_pcr', 'dcr', 'combined'), help="Measurement type (default: as recorded)")
+    parser.add_argument("--on-gate", nargs=2, type=float, metavar=('START', 'STOP'), help="On gate in ms after the reference edge")
+    parser.add_argument("--off-gate", nargs=2, type=float, metavar=('START', 'STOP'), help="Off gate in ms after the reference edge")
+    parser.add_argument("--fudge", type=float, help="Fudge factor (default: as recorded)")
+    parser.add_argument("--dead-time", type=float, help="Extra software dead time in ns")
+    parser.add_argument("--bin", type=float, default=0.1, help="DCR bin width in s")
+    parser.add_argument("--lockin", choices=('sincos', 'matched'), help="Lock-in demodulate instead of counting box gates")
+    args = parser.parse_args(argv)
+
+    try:
+        results = analyse_recording(args.recording, args.type, args.on_gate, args.off_gate, args.fudge,
+                                    args.dead_time, args.bin, lockin=args.lockin)
+    except Exception as e:
+        print(f"Error analysing recording: {e}")
+        return 1
+    base = args.output[:-4] if args.output.lower().endswith('.csv') else args.output
+    with open(base + '.csv', 'w', newline='') as csvfile:
+        csvwriter = csv.writer(csvfile)
+        csvwriter.writerow(results.csv_header())
+        csvwriter.writerows(SweepResults.csv_rows(results.csv_table(results.bias_order())))
+    print(f"CSV data saved as: {base}.csv")
+    SweepPlotter(Figure().add_subplot(111), results).save_png(base + '.png', dpi=300)
+    print(f"Plot saved as: {base}.png")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
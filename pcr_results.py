@@ -0,0 +1,212 @@
+"""
+Result container for PCR/DCR sweeps
+Every quantity is one preallocated float array indexed (bias, trigger level[, bin]) and NaN-filled,
+so missing or failed points need no special casing. Plotting, CSV export and statistics work on
+views of these arrays rather than on nested Python lists.
+"""
+
+import numpy
+
+from pcr_statistics import allan_taus
+
+
+# Assuming 1.02 MOhm series resistance between the SIM928 and the detector
+BIAS_RESISTANCE_OHM = 1.02e6
+
+
+def bias_current_uA(voltage):
+    """Bias current at the detector in uA for a SIM928 voltage (scalar or array)"""
+    return numpy.round(numpy.asarray(voltage, dtype=float) / BIAS_RESISTANCE_OHM * 1e6, 4)
+
+
+class SweepResults:
+    """
+    Results of a bias x trigger level sweep.
+    Rows are bias points in the order they were measured; the bias axis grows by doubling, since
+    adaptive placement does not know its final point count up front.
+    """
+
+    units = {
+        'bias_voltage': 'V',
+        'bias_current': 'uA',
+        'trigger_level': 'V',
+        'counts': 'Hz',
+        'dark_counts': 'Hz',
+        'sigma': 'Hz',
+        'int_time': 's',
+        'quadrature': 'Hz',
+        'dcr_bins': 'Hz',
+        'dcr_mean': 'Hz',
+        'dcr_variance': 'Hz^2',
+        'dcr_fano': '',
+        'dcr_rejected': 'bins',
+        'dcr_flag': '',
+        'dcr_adev': 'Hz',
+        'drift_factor': '',
+    }
+
+    # CSV column prefixes; trailing axes (bins, Allan taus) get a per-column suffix
+    _csv_prefixes = {
+        'counts': 'Counts',
+        'dark_counts': 'DCounts',
+        'sigma': 'Sigma',
+        'int_time': 'IntTime',
+        'quadrature': 'Quad',
+        'dcr_mean': 'DCRMean',
+        'dcr_variance': 'DCRVar',
+        'dcr_fano': 'DCRFano',
+        'dcr_rejected': 'DCRRejected',
+        'dcr_flag': 'DCRFlag',
+        'drift_factor': 'Drift',
+    }
+
+    def __init__(self, measurement_type: str, trigger_levels, num_bins: int = 1, bin_duration: float = 0.1,
+                 adaptive: bool = False, capacity: int = 64, drift: bool = False,
+                 lockin: bool = False):
+        """
+        :param measurement_type: 'filtered_pcr', 'dcr' or 'combined' (both in one pass)
+        :param trigger_levels: Trigger levels as given in the parameters (kept as labels)
+        :param num_bins: Time bins per point (dcr only)
+        :param bin_duration: Length of one time bin in seconds (dcr only)
+        :param adaptive: Also record per-point uncertainty and integration time (filtered_pcr only)
+        :param capacity: Initial number of bias rows
+        :param drift: Also record the drift correction factor applied to each point (see pcr_drift)
+        :param lockin: Also record the uncertainty and quadrature of lock-in demodulated points (see pcr_lockin)
+        """
+        self.measurement_type = measurement_type
+        self.trigger_level_labels = [str(tl) for tl in trigger_levels]
+        self.trigger_levels = numpy.array([float(tl) for tl in trigger_levels])
+        self.num_bins = num_bins
+        self.bin_duration = bin_duration
+        self.adaptive = adaptive
+
+        num_tl = len(self.trigger_levels)
+        self.has_gates = measurement_type in ('filtered_pcr', 'combined')
+        self.has_bins = measurement_type in ('dcr', 'combined')
+        trailing = {}
+        if self.has_gates:
+            gated = ['counts', 'dark_counts'] + (['sigma', 'int_time'] if adaptive and measurement_type == 'filtered_pcr' else [])
+            if lockin:
+                gated += [name for name in ('sigma', 'quadrature') if name not in gated]
+            trailing.update({name: () for name in gated})
+        if self.has_bins:
+            # Raw bins plus their streaming statistics (see pcr_statistics.DCRBinStatistics)
+            self.allan_factors = allan_taus(num_bins)
+            trailing.update({'dcr_bins': (num_bins,), 'dcr_mean': (), 'dcr_variance': (), 'dcr_fano': (),
+                             'dcr_rejected': (), 'dcr_flag': (), 'dcr_adev': (len(self.allan_factors),)})
+        if drift:
+            trailing['drift_factor'] = ()
+        self.axes = ('bias', 'trigger_level', 'bin') if self.has_bins else ('bias', 'trigger_level')
+        names = list(trailing)
+        self.quantities = tuple(names)
+
+        self.n = 0
+        self._voltage = numpy.full(capacity, numpy.nan)
+        self._data = {name: numpy.full((capacity, num_tl) + trailing[name], numpy.nan) for name in names}
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, name):
+        """View of a quantity over the measured bias points"""
+        return self._data[name][:self.n]
+
+    @property
+    def bias_voltage(self):
+        return self._voltage[:self.n]
+
+    @property
+    def bias_current(self):
+        return bias_current_uA(self.bias_voltage)
+
+    @property
+    def bin_times(self):
+        """Start time of each bin in s (dcr only)"""
+        return numpy.arange(self.num_bins) * self.bin_duration
+
+    @property
+    def adev_taus(self):
+        """Averaging times of the dcr_adev entries in s (dcr only)"""
+        return self.allan_factors * self.bin_duration
+
+    def add_bias(self, voltage):
+        """Append a bias row (all NaN) and return its index"""
+        if self.n == len(self._voltage):
+            capacity = 2 * self.n
+            self._voltage = numpy.concatenate([self._voltage, numpy.full(capacity - self.n, numpy.nan)])
+            for name, array in self._data.items():
+                grown = numpy.full((capacity,) + array.shape[1:], numpy.nan)
+                grown[:self.n] = array
+                self._data[name] = grown
+        self._voltage[self.n] = voltage
+        self.n += 1
+        return self.n - 1
+
+    def set_point(self, row: int, tl_index: int, **values):
+        """Store the measured quantities of one (bias, trigger level) point"""
+        for name, value in values.items():
+            if name in self._data:
+                self._data[name][row, tl_index] = value
+
+    def clear_row(self, row: int):
+        """Reset every quantity of a bias row to NaN, e.g. after the point turned out to be invalid"""
+        for array in self._data.values():
+            array[row] = numpy.nan
+
+    def point_values(self, row: int, tl_index: int):
+        """Quantities of one point as plain floats/lists, e.g. for the journal"""
+        values = {}
+        for name in self.quantities:
+            value = self._data[name][row, tl_index]
+            values[name] = value.tolist() if numpy.ndim(value) else float(value)
+        return values
+
+    def signal(self):
+        """(bias x trigger level) curve: signal counts, or the outlier-rejected mean DCR"""
+        if self.has_gates:
+            return self['counts']
+        return self['dcr_mean']
+
+    def dark(self):
+        """(bias x trigger level) dark counts, or None for dcr"""
+        return self['dark_counts'] if self.has_gates else None
+
+    def bias_order(self):
+        """Row order sorted by bias (stable for repeated biases)"""
+        return numpy.argsort(self.bias_voltage, kind='stable')
+
+    def csv_header(self):
+        """Column names of the PCR/DCR curve CSV"""
+        header = ['Bias_Current']
+        labels = list(enumerate(self.trigger_level_labels))
+        for name in self.quantities:
+            if name == 'dcr_bins':  # one column per bin
+                for j, tl in labels:
+                    header += [f'DCR_TL{j+1}({tl})_Bin{bin_idx+1}' for bin_idx in range(self.num_bins)]
+            elif name == 'dcr_adev':  # one column per averaging time
+                for j, tl in labels:
+                    header += [f'DCRADev_TL{j+1}({tl})_Tau{tau:g}s' for tau in self.adev_taus]
+            else:
+                header += [f'{self._csv_prefixes[name]}_TL{j+1}({tl})' for j, tl in labels]
+        return header
+
+    def csv_table(self, rows=None):
+        """
+        (rows x columns) float table matching csv_header
+
+        :param rows: Row indices to include (default: all, in measurement order)
+        """
+        if rows is None:
+            rows = numpy.arange(self.n)
+        rows = numpy.asarray(rows)
+        columns = [self.bias_current[rows, None]]
+        # (rows, tl[, trailing]) -> (rows, tl*trailing), trigger level major as in the header
+        columns += [self[name][rows].reshape(len(rows), -1) for name in self.quantities]
+        return numpy.hstack(columns)
+
+    @staticmethod
+    def csv_rows(table):
+        """Table rows as lists for csv.writer, NaN written as an empty cell"""
+        cells = table.astype(object)
+        cells[numpy.isnan(table)] = ''
+        return cells.tolist()
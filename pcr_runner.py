@@ -0,0 +1,898 @@
+"""
+Qt-free PCR/DCR sweep runner
+Builds the thermal-source gating graph on a TimeTagger and runs bias x trigger level sweeps.
+Used by the GUI in Gated_Histogram_PCR_multi_trigger.py and by the headless pcr_headless.py entry point
+"""
+
+import csv
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+from matplotlib.figure import Figure
+
+from TimeTagger import DelayedChannel, GatedChannel
+
+from pcr_statistics import gated_signal_rate, DCRBinStatistics, PoissonStoppingRule
+from pcr_sweep import uniform_bias_grid, parse_sweep_params, randomized_bias_order, FixedBiasSchedule, AdaptiveBiasSampler
+from pcr_sweep import MODULATION_PERIOD_MS, OFF_GATE_MS, ON_GATE_MS
+from pcr_journal import SweepJournal
+from pcr_measurements import MeasurementPool, record_tag_stream
+from pcr_plotting import SweepPlotter
+from pcr_results import SweepResults
+from pcr_binary import SweepArrayWriter
+from pcr_settling import SettlingDetector
+from pcr_latch import LatchDetector
+from pcr_recording import RawTagRecorder
+from pcr_drift import DriftReference
+from pcr_lockin import LockInDemodulator
+from pcr_timing import DEFAULT_STATS_FILE, SweepTimingModel, load_latency_stats, save_latency_stats
+
+
+class GatingGraph:
+    """
+    Virtual channels that split the detector's clicks into thermal-source-on and -off gates.
+    Holds references to every intermediate channel so the tagger keeps them alive.
+    """
+
+    def __init__(self, tagger, reference_channel: int, detector_channel: int,
+                 on_gate_ms=ON_GATE_MS, off_gate_ms=OFF_GATE_MS):
+        """
+        :param tagger: TimeTagger instance
+        :param reference_channel: Input carrying the modulation reference (ChA)
+        :param detector_channel: Input carrying the SNSPD pulses
+        :param on_gate_ms: (start, stop) of the source-on gate in ms after the reference edge
+        :param off_gate_ms: (start, stop) of the source-off gate in ms after the reference edge
+        """
+        on_start, on_stop = on_gate_ms
+        off_start, off_stop = off_gate_ms
+        self.on_gate_ms = (on_start, on_stop)
+        self.off_gate_ms = (off_start, off_stop)
+        self.reference_channel = reference_channel
+        self.detector_channel = detector_channel
+
+        self.filtered = GatedChannel(tagger, detector_channel, reference_channel, -reference_channel)
+        self.delay_1_start = DelayedChannel(tagger, reference_channel, int(on_start*1e9))
+        self.delay_1_stop = DelayedChannel(tagger, reference_channel, int(on_stop*1e9))
+        self.delay_2_start = DelayedChannel(tagger, reference_channel, int(off_start*1e9))
+        self.delay_2_stop = DelayedChannel(tagger, reference_channel, int(off_stop*1e9))
+
+        self.modulation_period_ms = MODULATION_PERIOD_MS
+        self.ratio_on = (on_stop - on_start) / MODULATION_PERIOD_MS
+        self.ratio_off = (off_stop - off_start) / MODULATION_PERIOD_MS
+
+        # thermal source on
+        self.filtered_on = GatedChannel(tagger, detector_channel, self.delay_1_start.getChannel(), self.delay_1_stop.getChannel())
+        # thermal source off
+        self.filtered_off = GatedChannel(tagger, detector_channel, self.delay_2_start.getChannel(), self.delay_2_stop.getChannel())
+
+    def set_modulation_period(self, period_ms: float):
+        """
+        Move the gate edges to the same fractions of a new modulation period, so the duty-cycle ratios still hold
+
+        :param period_ms: New source modulation period in ms
+        """
+        scale = period_ms / self.modulation_period_ms
+        self.on_gate_ms = (self.on_gate_ms[0] * scale, self.on_gate_ms[1] * scale)
+        self.off_gate_ms = (self.off_gate_ms[0] * scale, self.off_gate_ms[1] * scale)
+        self.modulation_period_ms = period_ms
+        self.delay_1_start.setDelay(int(self.on_gate_ms[0]*1e9))
+        self.delay_1_stop.setDelay(int(self.on_gate_ms[1]*1e9))
+        self.delay_2_start.setDelay(int(self.off_gate_ms[0]*1e9))
+        self.delay_2_stop.setDelay(int(self.off_gate_ms[1]*1e9))
+
+    def calibration(self, fudge_factor: float = 1.0):
+        """Gate windows and duty-cycle ratios as stored alongside sweep results"""
+        return {
+            'reference_channel': self.reference_channel,
+            'detector_channel': self.detector_channel,
+            'modulation_period_ms': self.modulation_period_ms,
+            'on_gate_ms': list(self.on_gate_ms),
+            'off_gate_ms': list(self.off_gate_ms),
+            'ratio_on': self.ratio_on,
+            'ratio_off': self.ratio_off,
+            'fudge_factor': fudge_factor,
+            'ratio_on_fudged': self.ratio_on * fudge_factor,
+            'ratio_off_fudged': self.ratio_off / fudge_factor,
+        }
+
+
+def apply_channel_params(tagger, channel_params):
+    """
+    Apply the input settings of a channel_params.yaml dictionary (as written by toFile) to the tagger
+
+    :return: Active channel numbers in ChA..ChD order, skipping channels set to 0
+    """
+    active_channels = []
+    for name in ('ChA', 'ChB', 'ChC', 'ChD'):
+        config = channel_params['Channels'][name]
+        channel = int(config['channel'])
+        if channel == 0:
+            continue
+        tagger.setInputDelay(channel, int(config['delay']))
+        tagger.setTriggerLevel(channel, float(config['trigger']))
+        tagger.setDeadtime(channel, int(config['dead_time'] * 1000))
+        tagger.setDeadtime(channel*-1, int(config['dead_time'] * 1000))
+        active_channels.append(channel)
+    return active_channels
+
+
+def shutdown_instruments(params, source, power_supply, function_gen):
+    """
+    Shutdown instruments based on YAML configuration
+    """
+    try:
+        shutdown_config = params.get('turn_off_after_pcr', {})
+        print("Shutting down instruments...")
+
+        # Turn off SIM928
+        if shutdown_config.get('sim928', False):
+            try:
+                if source is not None:
+                    source.turnOff()
+                    print("SIM928 turned off successfully")
+                else:
+                    print("SIM928 not available for shutdown")
+            except Exception as e:
+                print(f"Error turning off SIM928: {e}")
+
+        # Turn off cryo_amp (channel 3 of power supply)
+        if shutdown_config.get('cryo_amp', False):
+            try:
+                if power_supply is not None:
+                    power_supply.output_off(3)
+                    print("Cryo amp (channel 3) turned off successfully")
+                else:
+                    print("Power supply not available for cryo amp shutdown")
+            except Exception as e:
+                print(f"Error turning off cryo amp: {e}")
+
+        # Turn off thermal_source (channel 2 of function generator)
+        if shutdown_config.get('thermal_source', False):
+            try:
+                if function_gen is not None:
+                    function_gen.set_output(2, 0)
+                    print("Thermal source (channel 2) turned off successfully")
+                else:
+                    print("Function generator not available for thermal source shutdown")
+            except Exception as e:
+                print(f"Error turning off thermal source: {e}")
+
+    except Exception as e:
+        print(f"Error in instrument shutdown: {e}")
+
+
+def _sleep_until(deadline):
+    """Sleep until the given time.monotonic() deadline, if it is still in the future"""
+    remaining = deadline - time.monotonic()
+    if remaining > 0:
+        time.sleep(remaining)
+
+
+class PCRSweepRunner:
+    """
+    Runs a filtered PCR or DCR sweep and writes its CSV, PNG and journal.
+    Everything instrument- or UI-specific comes in through the constructor, so the same loop
+    runs inside the Qt window and from the command line.
+    """
+
+    def __init__(self, tagger, gating, trigger_channel: int, set_bias, measurement_pool,
+                 plot_axis=None, flush_plot=None, power_supply=None):
+        """
+        :param tagger: TimeTagger instance
+        :param gating: GatingGraph for the detector being swept
+        :param trigger_channel: Physical input whose trigger level is swept
+        :param set_bias: Callable taking a voltage and returning True if it was applied
+        :param measurement_pool: MeasurementPool the sweep takes its Counters from
+        :param plot_axis: Axes for the live curve; an off-screen figure is used if omitted
+        :param flush_plot: Callable that pushes a redraw of plot_axis to the screen
+        :param power_supply: Optional E36312A client, read back by latch detection
+        """
+        self.tagger = tagger
+        self.gating = gating
+        self.trigger_channel = trigger_channel
+        self.set_bias = set_bias
+        self.measurement_pool = measurement_pool
+        if plot_axis is None:
+            plot_axis = Figure().add_subplot(111)
+        self.plot_axis = plot_axis
+        self.flush_plot = flush_plot if flush_plot is not None else (lambda: None)
+        self.power_supply = power_supply
+        self.recorder = None  # RawTagRecorder of the running sweep, if raw_recording is enabled
+        self.journal = None  # SweepJournal of the running sweep
+        self.latch = None  # LatchDetector of the running sweep, if latch_detection is enabled
+        self.drift = None  # DriftReference of the running sweep, if drift_reference is enabled
+        self.point_times = {}  # (bias row, trigger level index) -> time each point of the running sweep was measured
+        self.results = None  # SweepResults of the last run
+        self.timing = None  # SweepTimingModel of the last (or running) sweep
+
+    # Journals written before the results arrays used their own value names
+    _LEGACY_JOURNAL_KEYS = {'count': 'counts', 'dark_count': 'dark_counts', 'bins': 'dcr_bins'}
+
+    @classmethod
+    def _replay_journal_point(cls, params, values, results, row, j):
+        """Store a point recorded in a sweep journal as if it had just been measured"""
+        values = {cls._LEGACY_JOURNAL_KEYS.get(key, key): value for key, value in values.items()}
+        results.set_point(row, j, **values)
+        if results.has_bins and 'dcr_mean' not in values:
+            # Journals from before the streaming statistics only hold the bins
+            cls._store_dcr_bins(params, results, row, j, numpy.asarray(values['dcr_bins'], dtype=float))
+
+    @staticmethod
+    def _store_dcr_bins(params, results, row, j, bin_rates):
+        """Store one point's DCR bins with their mean, variance, Allan deviation and burst flag"""
+        statistics = DCRBinStatistics.from_params(params, results.bin_duration)
+        statistics.update(bin_rates)
+        summary = statistics.summary(results.allan_factors)
+        results.set_point(row, j, dcr_bins=bin_rates, **summary)
+        return summary
+
+    def _integrate_gated_adaptively(self, cr_gated, chunk_time_ps, stopping_rule):
+        """Integrate the combined on/off gated Counter chunk by chunk until the stopping rule is met.
+        Returns (signal rate, dark rate, signal standard deviation, integration time in s)."""
+        total_on = 0
+        total_off = 0
+        elapsed = 0.0
+        while True:
+            clicks = MeasurementPool.acquire(cr_gated, chunk_time_ps).getData()
+            total_on += clicks[0][0]
+            total_off += clicks[1][0]
+            elapsed += stopping_rule.chunk_time
+
+            count, dark_count, sigma = gated_signal_rate(total_on, total_off, self.ratio_on_fudged, self.ratio_off_fudged, elapsed)
+            if stopping_rule.should_stop(count, sigma, elapsed):
+                return count, dark_count, sigma, elapsed
+
+    def _measure_trigger_cycle(self, params, results, row, trigger_levels, counter, rows, sub_ps, rounds, timing):
+        """
+        Measure all trigger levels of one bias point by cycling through them in short sub-integrations,
+        so slow drift of the source or bias averages out instead of biasing one level against another.
+        Each switch waits only for setTriggerLevel + sync() to return, which is timed as 'trigger_switch'.
+
+        :param counter: Pooled Counter covering one sub-integration
+        :param rows: (raw, on, off) row indices within the Counter, None where not measured
+        :param sub_ps: Sub-integration length in ps
+        :param rounds: Number of passes over all trigger levels
+        """
+        raw, on, off = rows
+        chunks = [[] for _ in trigger_levels]
+        switch_time = 0.0
+        for _ in range(rounds):
+            for j, trigger_level in enumerate(trigger_levels):
+                start = time.monotonic()
+                self.tagger.setTriggerLevel(self.trigger_channel, float(trigger_level))
+                self.tagger.sync()  # tags after this point were taken with the new level
+                switched = time.monotonic()
+                timing.record('trigger_switch', switched - start)
+                switch_time += switched - start
+                if self.recorder is not None:
+                    self.recorder.begin(row, results.bias_voltage[row], j, trigger_level)
+                chunks[j].append(numpy.array(MeasurementPool.acquire(counter, sub_ps).getData(), dtype=float))
+                if self.recorder is not None:
+                    self.recorder.end()
+                timing.record('acquire_overhead', time.monotonic() - switched - sub_ps * 1e-12)
+
+        t_sec = rounds * sub_ps * 1e-12
+        for j, trigger_level in enumerate(trigger_levels):
+            data = numpy.concatenate(chunks[j], axis=1)  # (rows, bins) in acquisition order
+            message = f"  Trigger Level {float(trigger_level):.3f} V ({rounds} x {sub_ps*1e-9:.0f} ms):"
+            if on is not None:
+                count, dark_count, _ = gated_signal_rate(numpy.sum(data[on]), numpy.sum(data[off]),
+                                                         self.ratio_on_fudged, self.ratio_off_fudged, t_sec)
+                results.set_point(row, j, counts=count, dark_counts=dark_count)
+                message += f" Signal Counts: {count}, Dark Counts: {dark_count}"
+            if raw is not None:
+                # Bins of one level are interleaved with the other levels' sub-integrations in time
+                stats = self._store_dcr_bins(params, results, row, j, data[raw] / results.bin_duration)
+                message += f" DCR (avg): {stats['dcr_mean']:.2f} Hz"
+            print(message)
+        print(f"    Trigger switching overhead: {switch_time:.3f} s ({switch_time / (switch_time + len(trigger_levels) * t_sec):.1%})")
+
+    def _set_bias_and_timestamp(self, voltage):
+        """Set the SIM928 voltage and return (success, monotonic time the write completed, write duration in s).
+        Runs on the sweep's bias worker thread."""
+        start = time.monotonic()
+        success = self.set_bias(voltage)
+        done = time.monotonic()
+        return success, done, done - start
+
+    def _open_journal(self, params, filename, journal_path):
+        """Journal every completed point is appended to, so the sweep can be resumed; None if it can't be opened"""
+        try:
+            if journal_path is None:
+                journal_path = SweepJournal.path_for(filename)
+                journal = SweepJournal.create(journal_path, params, filename)
+            else:
+                journal = SweepJournal.reopen(journal_path)
+            print(f"Journaling sweep to: {journal_path}")
+            return journal
+        except Exception as e:
+            print(f"Error opening sweep journal, continuing without it: {e}")
+            return None
+
+    @staticmethod
+    def _bias_schedule(params):
+        """
+        Bias points come from a schedule: a uniform grid, or adaptive placement that
+        refines where the curve changes and stops extending once it plateaus.
+        A uniform grid can also be taken in random order against drift.
+        """
+        bias_schedule = AdaptiveBiasSampler.from_params(params)
+        if bias_schedule is None:
+            voltages = uniform_bias_grid(params['voltage']['start'], params['voltage']['stop'], params['voltage']['step'])
+            randomize = params.get('randomize_bias', {}) or {}
+            if randomize.get('enabled', False):
+                latch_safe_above = randomize.get('latch_safe_above')
+                voltages = randomized_bias_order(voltages, randomize.get('seed'),
+                                                 None if latch_safe_above is None else float(latch_safe_above))
+                print(f"Randomized bias order (seed {randomize.get('seed')}, ascending above {latch_safe_above} V)")
+            bias_schedule = FixedBiasSchedule(voltages)
+        if bias_schedule.is_adaptive:
+            print(f"Adaptive bias placement: {bias_schedule.expected_points()} coarse points, refined down to {bias_schedule.min_step} V")
+        return bias_schedule
+
+    def _prepare_acquisition(self, params, measurement_type, int_time_sec, num_bins, bin_time_ps):
+        """
+        Choose how each (bias, trigger level) point is acquired: adaptive integration, lock-in, or fixed-time
+        pooled Counters over the box gates and/or DCR bins. Measurements come from the pool: created once,
+        re-armed with startFor(clear=True) per point.
+        """
+        self.int_time_sec = int_time_sec
+        self.int_time = int(float(int_time_sec)*1e12)
+
+        # Adaptive integration: integrate in short chunks until the Poisson uncertainty target is met
+        self.stopping_rule = PoissonStoppingRule.from_params(params) if measurement_type == 'filtered_pcr' else None
+        if self.stopping_rule is not None:
+            self.chunk_time_ps = int(self.stopping_rule.chunk_time * 1e12)
+            print(f"Adaptive integration: target {self.stopping_rule.target_rel_uncertainty:.1%}, "
+                  f"{self.stopping_rule.min_time}-{self.stopping_rule.max_time} s in {self.stopping_rule.chunk_time} s chunks")
+
+        # Optional lock-in demodulation of the detector timestamps instead of the two box gates (filtered_pcr)
+        self.lockin = None
+        if measurement_type == 'filtered_pcr' and self.stopping_rule is None:
+            try:
+                self.lockin = LockInDemodulator.from_params(params)
+            except Exception as e:
+                print(f"Error setting up lock-in demodulation, using the box gates: {e}")
+        if self.lockin is not None:
+            self.lockin_channels = [self.gating.detector_channel, self.gating.reference_channel, -self.gating.reference_channel]
+            print(f"Lock-in demodulation: {self.lockin.weighting} weighting")
+
+        self.cr_gated = None
+        self.cr_dcr = None
+        self.cr_combined = None
+        if measurement_type == 'combined':
+            # Raw detector, on gate and off gate from the same tag stream: rows 0, 1 and 2 of one binned Counter
+            self.cr_combined = self.measurement_pool.counter([self.gating.detector_channel, self.gating.filtered_on.getChannel(),
+                                                              self.gating.filtered_off.getChannel()],
+                                                             binwidth=bin_time_ps, n_values=num_bins)
+        elif measurement_type == 'filtered_pcr':
+            gate_binwidth = self.chunk_time_ps if self.stopping_rule is not None else self.int_time
+            # On and off gates in one Counter: row 0 is on, row 1 is off
+            self.cr_gated = self.measurement_pool.counter([self.gating.filtered_on.getChannel(), self.gating.filtered_off.getChannel()],
+                                                          binwidth=gate_binwidth, n_values=1)
+        else:  # dcr measurement
+            self.cr_dcr = self.measurement_pool.counter([self.gating.detector_channel], binwidth=bin_time_ps, n_values=num_bins)
+
+    def _prepare_cycling(self, params, measurement_type, num_bins, bin_duration, bin_time_ps, timing):
+        """
+        Optional trigger level cycling: all levels in short interleaved sub-integrations per bias point
+
+        :return: (Counter, (raw, on, off) rows, sub-integration in ps, rounds) for _measure_trigger_cycle, or None
+        """
+        cycling = params.get('trigger_cycling', {}) or {}
+        if not cycling.get('enabled', False) or self.stopping_rule is not None or self.lockin is not None:
+            return None
+        int_time_sec = self.int_time_sec
+        sub_time = float(cycling.get('sub_integration', 1.0))
+        # Bound the switching overhead using the setTriggerLevel + sync latency measured in earlier sweeps
+        max_overhead = float(cycling.get('max_overhead', 0.1))
+        switch_latency = timing.stage_mean('trigger_switch') or timing.stage_mean('trigger_level')
+        sub_time = max(sub_time, switch_latency * (1 - max_overhead) / max_overhead)
+        # Sub-integrations span whole modulation periods. Shorter ones in a fixed level order would give each
+        # level its own slice of the square wave, so the on/off gate ratios would not hold per level.
+        period = MODULATION_PERIOD_MS * 1e-3
+        periods_per_sub = max(1, int(round(sub_time / period)))
+        if measurement_type == 'filtered_pcr':
+            cycle_rounds = max(1, int(round(int_time_sec / (periods_per_sub * period))))
+            sub_ps = int(periods_per_sub * period * 1e12)
+            cycle_binwidth, cycle_bins = sub_ps, 1
+        else:
+            # Sub-integrations are whole DCR bins and must tile the point's bins exactly
+            bins_per_period = int(round(period / bin_duration))
+            bins_per_sub = num_bins
+            for periods in range(min(periods_per_sub, num_bins // bins_per_period), 0, -1):
+                if num_bins % (periods * bins_per_period) == 0:
+                    bins_per_sub = periods * bins_per_period
+                    break
+            else:
+                print("Trigger level cycling: integration_time is not a whole number of modulation periods, "
+                      "one pass per level")
+            cycle_rounds = num_bins // bins_per_sub
+            sub_ps = bins_per_sub * bin_time_ps
+            cycle_binwidth, cycle_bins = bin_time_ps, bins_per_sub
+        cycle_channels = []
+        cycle_rows = [None, None, None]
+        if measurement_type in ('dcr', 'combined'):
+            cycle_rows[0] = len(cycle_channels)
+            cycle_channels.append(self.gating.detector_channel)
+        if measurement_type in ('filtered_pcr', 'combined'):
+            cycle_rows[1] = len(cycle_channels)
+            cycle_channels.append(self.gating.filtered_on.getChannel())
+            cycle_rows[2] = len(cycle_channels)
+            cycle_channels.append(self.gating.filtered_off.getChannel())
+        cr_cycle = self.measurement_pool.counter(cycle_channels, binwidth=cycle_binwidth, n_values=cycle_bins)
+        print(f"Trigger level cycling: {cycle_rounds} rounds of {sub_ps*1e-9:.0f} ms per level, "
+              f"switch latency {switch_latency*1e3:.1f} ms")
+        return cr_cycle, cycle_rows, sub_ps, cycle_rounds
+
+    def _wait_to_settle(self, settler, changed_at, deadline, timing):
+        """Wait for the rate to settle after a change; with settling detection the deadline is only the cap"""
+        with timing.stage('settle'):
+            if settler is not None:
+                _, settled = settler.wait(changed_at, deadline)
+                if not settled:
+                    print("    Rate not stationary before the settling cap")
+            else:
+                _sleep_until(deadline)
+
+    # --- Per-point acquisition ---
+
+    def _acquire_point(self, params, results, row, j, voltage, trigger_level, timing):
+        """
+        Acquire one (bias, trigger level) point with the sweep's acquisition mode and store it in results.
+        The raw tags are recorded around the acquisition when raw_recording is enabled.
+        """
+        if self.recorder is not None:
+            self.recorder.begin(row, voltage, j, trigger_level)
+        acquire_start = time.monotonic()
+
+        if self.stopping_rule is not None:
+            self._acquire_adaptive(results, row, j, acquire_start, timing)
+        elif self.lockin is not None:
+            self._acquire_lockin(results, row, j, acquire_start, timing)
+        elif self.cr_gated is not None:
+            self._acquire_gated(results, row, j, acquire_start, timing)
+        elif self.cr_combined is not None:
+            self._acquire_combined(params, results, row, j, acquire_start, timing)
+        elif self.cr_dcr is not None:
+            self._acquire_dcr(params, results, row, j, acquire_start, timing)
+
+        if self.recorder is not None:
+            self.recorder.end()
+        self.point_times[(row, j)] = time.time()
+
+    def _acquire_adaptive(self, results, row, j, acquire_start, timing):
+        """Adaptive filtered PCR measurement"""
+        count, dark_count, sigma, t_sec = self._integrate_gated_adaptively(self.cr_gated, self.chunk_time_ps, self.stopping_rule)
+        results.set_point(row, j, counts=count, dark_counts=dark_count, sigma=sigma, int_time=t_sec)
+        timing.record('int_time', t_sec)
+        timing.record('acquire_overhead', time.monotonic() - acquire_start - t_sec)
+        print(f"    Signal Counts: {count} +/- {sigma:.3g}, Dark Counts: {dark_count}, Integrated {t_sec:.2f} s")
+
+    def _acquire_lockin(self, results, row, j, acquire_start, timing):
+        """Lock-in: every click weighted by its phase against the ChA reference"""
+        timestamps, tag_channels, window = record_tag_stream(self.tagger, self.lockin_channels, self.int_time_sec,
+                                                             with_window=True)
+        timing.record('acquire_overhead', time.monotonic() - acquire_start - self.int_time_sec)
+        try:
+            demodulated = self.lockin.demodulate(timestamps[tag_channels == self.lockin_channels[0]],
+                                                 timestamps[tag_channels == self.lockin_channels[1]],
+                                                 timestamps[tag_channels == self.lockin_channels[2]], window)
+            results.set_point(row, j, **demodulated)
+            print(f"    Signal Counts: {demodulated['counts']:.1f} +/- {demodulated['sigma']:.3g}, "
+                  f"Dark Counts: {demodulated['dark_counts']:.1f}, Quadrature: {demodulated['quadrature']:.3g}")
+        except ValueError as e:
+            print(f"    Error demodulating point, left empty: {e}")
+
+    def _acquire_gated(self, results, row, j, acquire_start, timing):
+        """Filtered PCR measurement"""
+        int_time_sec = self.int_time_sec
+        clicks = MeasurementPool.acquire(self.cr_gated, self.int_time).getData()
+        clicks_on = clicks[0][0]
+        clicks_off = clicks[1][0]
+
+        count = (clicks_on/ (self.ratio_on_fudged*int_time_sec)) - (clicks_off/ (self.ratio_off_fudged*int_time_sec)) # Calculate counts for this trigger level
+        dark_count = (clicks_off/ (self.ratio_off_fudged*int_time_sec))
+        results.set_point(row, j, counts=count, dark_counts=dark_count)
+        timing.record('acquire_overhead', time.monotonic() - acquire_start - int_time_sec)
+        print(f"    Signal Counts: {count}, Dark Counts: {dark_count}")
+
+    def _acquire_combined(self, params, results, row, j, acquire_start, timing):
+        """Combined measurement - DCR bins and gated counts in a single pass"""
+        clicks_data = MeasurementPool.acquire(self.cr_combined, self.int_time).getData()
+        clicks_on = numpy.sum(clicks_data[1])
+        clicks_off = numpy.sum(clicks_data[2])
+        # The gated clicks are summed over the Counter's bins, which need not span the whole integration time
+        binned_sec = clicks_data.shape[1] * results.bin_duration
+
+        count = (clicks_on/ (self.ratio_on_fudged*binned_sec)) - (clicks_off/ (self.ratio_off_fudged*binned_sec))
+        dark_count = (clicks_off/ (self.ratio_off_fudged*binned_sec))
+        results.set_point(row, j, counts=count, dark_counts=dark_count)
+        timing.record('acquire_overhead', time.monotonic() - acquire_start - self.int_time_sec)
+        stats = self._store_dcr_bins(params, results, row, j, clicks_data[0] / results.bin_duration)
+        print(f"    Signal Counts: {count}, Dark Counts: {dark_count}, "
+              f"Raw DCR (avg): {stats['dcr_mean']:.2f} Hz, Fano {stats['dcr_fano']:.2f}")
+        if stats['dcr_flag']:
+            print("    Warning: bursty / telegraph-like dark counts at this point")
+
+    def _acquire_dcr(self, params, results, row, j, acquire_start, timing):
+        """DCR measurement - direct count on the detector channel with multiple bins"""
+        clicks_data = MeasurementPool.acquire(self.cr_dcr, self.int_time).getData()  # This returns a 2D array: [channels][bins]
+        # Convert the first (and only) channel to counts per second for each bin
+        timing.record('acquire_overhead', time.monotonic() - acquire_start - self.int_time_sec)
+        stats = self._store_dcr_bins(params, results, row, j, clicks_data[0] / results.bin_duration)
+        print(f"    DCR Counts (avg): {stats['dcr_mean']:.2f} Hz, {results.num_bins} bins, "
+              f"Fano {stats['dcr_fano']:.2f}, {stats['dcr_rejected']} outlier bins")
+        if stats['dcr_flag']:
+            print("    Warning: bursty / telegraph-like dark counts at this point")
+
+    # --- Post-point hooks ---
+
+    def _journal_points(self, row, voltage, trigger_levels, tl_indices, timing):
+        """Append the given trigger levels of a bias row, as currently held in the results, to the journal"""
+        if self.journal is None:
+            return
+        try:
+            with timing.stage('journal'):
+                for j in tl_indices:
+                    self.journal.append_point(row, voltage, j, trigger_levels[j], self.results.point_values(row, j),
+                                              measured_at=self.point_times.get((row, j)))
+        except Exception as e:
+            print(f"Error writing sweep journal: {e}")
+
+    def _check_latch(self, row, voltage, trigger_levels, timing):
+        """
+        Check the detector for a latch after a measured bias point. A latched row is cleared; it is either
+        measured again after recovery or journaled empty and the sweep ends.
+
+        :return: 'ok', 'remeasure' (the caller submits latch.recover and repeats the row) or 'truncate'
+        """
+        with timing.stage('latch_check'):
+            latched, latch_rate = self.latch.check()
+        if not latched:
+            self._latch_retries = 0
+            return 'ok'
+        self.results.clear_row(row)
+        self._latch_retries += 1
+        if self.latch.action == 'recover' and self._latch_retries <= self.latch.max_retries:
+            print(f"  Detector latched at {voltage:.3f} V ({latch_rate:.1f} Hz), "
+                  f"resetting bias and re-measuring (attempt {self._latch_retries}/{self.latch.max_retries})")
+            return 'remeasure'
+        print(f"  Detector latched at {voltage:.3f} V ({latch_rate:.1f} Hz), ending the sweep")
+        try:
+            self.set_bias(0.0)
+        except Exception as e:
+            print(f"Error setting bias to 0 V after latch: {e}")
+        self._journal_points(row, voltage, trigger_levels, range(len(trigger_levels)), timing)
+        self._latch_retries = 0
+        return 'truncate'
+
+    def _measure_reference(self, fudge_factor, timing):
+        """Take one drift reference reading; the next curve point sets its own bias and trigger level again"""
+        with timing.stage('reference'):
+            value = self.drift.measure(self.set_bias, fudge_factor)
+        if value is not None and self.journal is not None:
+            try:
+                self.journal.append_reference(self.drift.times[-1], value)
+            except Exception as e:
+                print(f"Error writing sweep journal: {e}")
+
+    # --- Outputs ---
+
+    def _open_outputs(self, params, filename, results, fudge_factor):
+        """Open the CSV, which gets one row appended per bias point, and the optional columnar binary copy"""
+        self._csvfile = None
+        self._csvwriter = None
+        if params.get('csv_output', True):
+            try:
+                self._csvfile = open(filename, 'w', newline='')
+                self._csvwriter = csv.writer(self._csvfile)
+                self._csvwriter.writerow(results.csv_header())
+                self._csvfile.flush()
+            except Exception as e:
+                print(f"Error opening CSV file: {e}")
+                self._csvfile = None
+                self._csvwriter = None
+
+        # Optional columnar copy of the results (per-bin DCR data as native arrays), also appended per bias point
+        self._array_writer = None
+        if params.get('binary_output', False):
+            npz_filename = (filename[:-4] if filename.lower().endswith('.csv') else filename) + '.npz'
+            try:
+                self._array_writer = SweepArrayWriter(npz_filename, results, params=params,
+                                                      gate_calibration=self.gating.calibration(fudge_factor))
+                print(f"Writing binary results to: {npz_filename}")
+            except Exception as e:
+                print(f"Error opening binary output file: {e}")
+
+    def _append_outputs(self, row):
+        """Append one bias row to the CSV and binary outputs"""
+        if self._csvwriter is not None:
+            try:
+                self._csvwriter.writerows(SweepResults.csv_rows(self.results.csv_table([row])))
+                self._csvfile.flush()
+            except Exception as e:
+                print(f"Error writing CSV row: {e}")
+        if self._array_writer is not None:
+            try:
+                self._array_writer.append_row(row)
+            except Exception as e:
+                print(f"Error writing binary results, disabling binary output: {e}")
+                self._array_writer = None
+
+    def _finish_outputs(self, filename, results, plotter, timing, latency_stats_file):
+        """Apply the drift correction, rewrite the CSV in bias order, consolidate the binary file and save the plot"""
+        if self.drift is not None:
+            times = numpy.full((len(results), len(results.trigger_levels)), numpy.nan)
+            for (row, j), measured_at in self.point_times.items():
+                times[row, j] = measured_at
+            self.drift.apply(results, times)
+
+        # Rows were appended in measurement order; rewrite them sorted by bias if that differs
+        # (or if drift correction changed them after they were written)
+        csv_order = results.bias_order()
+        if self._csvfile is not None and (self.drift is not None or not numpy.array_equal(csv_order, numpy.arange(len(results)))):
+            try:
+                with open(filename, 'w', newline='') as csvfile:
+                    csvwriter = csv.writer(csvfile)
+                    csvwriter.writerow(results.csv_header())
+                    csvwriter.writerows(SweepResults.csv_rows(results.csv_table(csv_order)))
+            except Exception as e:
+                print(f"Error rewriting sorted CSV file: {e}")
+        if self._csvfile is not None:
+            print(f"CSV data saved as: {filename}")
+        if self._array_writer is not None:
+            try:
+                self._array_writer.finish()
+                print(f"Binary data saved as: {self._array_writer.filename}")
+            except Exception as e:
+                print(f"Error consolidating binary output, row-wise file kept: {e}")
+
+        plotter.render(self.flush_plot, force=True)
+        self.plot_axis.legend(loc='best')
+        self.flush_plot()
+
+        # Save the final plot as PNG
+        png_filename = (filename[:-4] if filename.lower().endswith('.csv') else filename) + '.png'
+        try:
+            plotter.save_png(png_filename, dpi=300)
+            print(f"Plot saved as: {png_filename}")
+        except Exception as e:
+            print(f"Error saving plot: {e}")
+
+        print(timing.summary())
+        try:
+            save_latency_stats(timing, latency_stats_file)
+        except Exception as e:
+            print(f"Error saving latency statistics: {e}")
+
+    def run(self, params, filename, resume_points=None, journal_path=None):
+        """
+        Run a filtered PCR or DCR sweep and write its CSV, PNG and journal.
+        Points found in resume_points (from SweepJournal.load) are replayed instead of measured.
+        """
+        measurement_type, trigger_levels = parse_sweep_params(params)
+        num_trigger_levels = len(trigger_levels)
+        resume_points = resume_points or {}
+
+        fudge_factor = params['fudge_factor']
+
+        self.ratio_on_fudged = self.gating.ratio_on * fudge_factor
+        self.ratio_off_fudged = self.gating.ratio_off / fudge_factor
+
+        int_time_sec = params['integration_time']
+
+        self.journal = self._open_journal(params, filename, journal_path)
+        bias_schedule = self._bias_schedule(params)
+
+        print("Integration time (ps): ", int(float(int_time_sec)*1e12))
+        
+        # For DCR measurements, calculate number of bins (0.1 second each)
+        bin_duration = 0.1  # 0.1 second per bin (used for all measurements)
+        if measurement_type in ('dcr', 'combined'):
+            num_bins = int(int_time_sec / bin_duration)  # Total number of bins
+            bin_time_ps = int(bin_duration * 1e12)  # 0.1 second in picoseconds
+            print(f"DCR measurement: {num_bins} bins of {bin_duration} seconds each")
+        else:
+            num_bins = 1
+            bin_time_ps = int(float(int_time_sec)*1e12)
+
+        self._prepare_acquisition(params, measurement_type, int_time_sec, num_bins, bin_time_ps)
+
+        # Optional reference point every few bias points; the curve is corrected by its trend at the end
+        self.drift = DriftReference.from_params(params, self.tagger, self.measurement_pool, self.gating,
+                                                self.trigger_channel, measurement_type, trigger_levels)
+        if self.drift is not None and resume_points and journal_path is not None:
+            # Readings from before the interruption keep the trend continuous over the replayed points
+            try:
+                self.drift.restore(SweepJournal.load_references(journal_path))
+            except Exception as e:
+                print(f"Error reading drift references from the journal: {e}")
+        self.point_times = {}  # (bias row, trigger level index) -> wall-clock time the point was measured
+        curve_points = 0
+
+        # (bias x trigger level [x bin]) arrays, NaN until measured
+        results = SweepResults(measurement_type, trigger_levels, num_bins=num_bins, bin_duration=bin_duration,
+                               adaptive=self.stopping_rule is not None, capacity=max(bias_schedule.expected_points(), 1),
+                               drift=self.drift is not None, lockin=self.lockin is not None)
+        self.results = results
+
+        # Physical settling time after a bias step. The serial write for the next bias
+        # point runs in a worker thread while plotting and CSV output of the current
+        # point happen here, so only the part of this not already covered is waited for.
+        settle_time = float(params.get('settle_time', 0.2))
+        trigger_settle_time = float(params.get('trigger_settle_time', 0.2))
+
+        # Optional data-driven settling: whole-period Counter windows on the raw detector input decide when to start
+        settler = SettlingDetector.from_params(params, self.measurement_pool, [self.gating.detector_channel],
+                                               modulation_period=MODULATION_PERIOD_MS * 1e-3)
+        if settler is not None:
+            print(f"Settling detection: {settler.window_bins} x {settler.bin_time*1e3:.0f} ms windows, "
+                  f"capped at {trigger_settle_time} s (trigger) / {settle_time} s (bias)")
+            if 2 * settler.window_bins * settler.bin_time > max(settle_time, trigger_settle_time):
+                print("  Two windows do not fit in the caps, so every point waits the full cap")
+        
+        # Live curve, redrawn at most once per frame interval
+        self.plot_axis.clear()
+        plotter = SweepPlotter(self.plot_axis, results, frame_interval=float(params.get('plot_frame_interval', 0.5)))
+
+        # Every stage is timed; the ETA starts from stored latency statistics and follows the measured point time
+        latency_stats_file = params.get('latency_stats_file', DEFAULT_STATS_FILE)
+        timing = SweepTimingModel(params, trigger_levels, bias_schedule.expected_points(),
+                                  stats=load_latency_stats(latency_stats_file))
+        self.timing = timing
+        print(f"Estimated completion time (minutes): {round(timing.remaining_seconds()/60, 2)}")
+
+        self._open_outputs(params, filename, results, fudge_factor)
+        cycle = self._prepare_cycling(params, measurement_type, num_bins, bin_duration, bin_time_ps, timing)
+
+        # Latch check after every measured point; a latched point is reset and measured again in the same row
+        self.latch = LatchDetector.from_params(params, self.measurement_pool, self.gating.detector_channel, self.power_supply,
+                                               modulation_period=MODULATION_PERIOD_MS * 1e-3)
+        self._latch_retries = 0
+        remeasure_row = None
+
+        # Optional raw tag recording of every acquisition, for offline re-analysis with pcr_recording.py
+        self.recorder = None
+        try:
+            self.recorder = RawTagRecorder.from_params(params, self.tagger, filename, self.gating)
+        except Exception as e:
+            print(f"Error starting raw tag recording, continuing without it: {e}")
+        if self.recorder is not None:
+            print(f"Recording raw tags to: {self.recorder.filename}")
+        truncated = False
+
+        # Single worker: bias writes stay strictly ordered on the serial port
+        bias_executor = ThreadPoolExecutor(max_workers=1)
+
+        def is_replayed(bias_index, voltage, tl_index):
+            record = resume_points.get((bias_index, tl_index))
+            return record is not None and numpy.isclose(record['voltage'], voltage)
+
+        def submit_bias(bias_index, voltage):
+            # Bias points that are fully in the journal are not set at all
+            if all(is_replayed(bias_index, voltage, j) for j in range(num_trigger_levels)):
+                return None
+            return bias_executor.submit(self._set_bias_and_timestamp, voltage)
+
+        next_voltage = bias_schedule.next_voltage()
+        if self.drift is not None:
+            self._measure_reference(fudge_factor, timing)
+        pending_bias = submit_bias(0, next_voltage)
+    
+        try:
+            while next_voltage is not None: # Iterate through bias currents/voltages
+                point_start = time.monotonic()
+                point_measured = False
+                i = results.add_bias(next_voltage) if remeasure_row is None else remeasure_row
+                remeasure_row = None
+
+                # --- Collect the bias write started during the previous point ---
+                if pending_bias is not None:
+                    with timing.stage('bias_wait'):
+                        set_voltage_success, bias_set_at, bias_write_time = pending_bias.result()
+                    timing.record('bias_write', bias_write_time)
+                else:
+                    set_voltage_success, bias_set_at = True, 0.0  # Replayed from the journal
+
+                # If setting voltage failed after retries, the row stays NaN
+                if not set_voltage_success:
+                    print(f"Skipping measurements for bias voltage index {i} (Voltage: {next_voltage:.3f} V) due to connection issues.")
+
+                    bias_schedule.record(next_voltage, results.signal()[i])
+                    next_voltage = bias_schedule.next_voltage()
+                    if next_voltage is not None:
+                        pending_bias = submit_bias(i + 1, next_voltage)
+                    self._append_outputs(i)
+                    timing.point_done(None, bias_schedule.expected_points())
+                    continue # Skip to the next value of i in the outer loop
+
+                if self.recorder is not None:
+                    self.recorder.start_point(i)
+                # With latch detection a row is only journaled once it passed the check, so a crash or stop
+                # while a latched row is being recovered cannot leave its readings to be replayed on resume
+                journal_now = self.latch is None
+                measured_levels = []
+                if cycle is not None and not all(is_replayed(i, next_voltage, j) for j in range(num_trigger_levels)):
+                    # All levels of the point in interleaved sub-integrations
+                    point_measured = True
+                    self._wait_to_settle(settler, bias_set_at, bias_set_at + settle_time, timing)
+                    self._measure_trigger_cycle(params, results, i, trigger_levels, *cycle, timing)
+                    self.point_times.update({(i, j): time.time() for j in range(num_trigger_levels)})
+                    measured_levels = list(range(num_trigger_levels))
+                    if journal_now:
+                        self._journal_points(i, next_voltage, trigger_levels, measured_levels, timing)
+                else:
+                    bias_settle_pending = True
+                    for j, trigger_level in enumerate(trigger_levels): # Iterate through trigger levels
+                        if is_replayed(i, next_voltage, j):
+                            self._replay_journal_point(params, resume_points[(i, j)]['values'], results, i, j)
+                            if resume_points[(i, j)].get('measured_at') is not None:
+                                self.point_times[(i, j)] = resume_points[(i, j)]['measured_at']
+                            continue
+
+                        point_measured = True
+                        trigger_level_float = float(trigger_level) # Ensure it's float
+                        with timing.stage('trigger_level'):
+                            self.tagger.setTriggerLevel(self.trigger_channel, trigger_level_float)
+                        print(f"  Measuring Trigger Level: {trigger_level_float:.3f} V")
+
+                        # Trigger settling, and on the first measured level whatever is left of the bias settling.
+                        # With settling detection these fixed waits are only the cap.
+                        changed_at = time.monotonic()
+                        deadline = changed_at + trigger_settle_time
+                        if bias_settle_pending:
+                            deadline = max(deadline, bias_set_at + settle_time)
+                            bias_settle_pending = False
+                        self._wait_to_settle(settler, changed_at, deadline, timing)
+
+                        self._acquire_point(params, results, i, j, next_voltage, trigger_level_float, timing)
+                        measured_levels.append(j)
+                        if journal_now:
+                            self._journal_points(i, next_voltage, trigger_levels, [j], timing)
+
+                if self.latch is not None and point_measured:
+                    outcome = self._check_latch(i, next_voltage, trigger_levels, timing)
+                    if outcome == 'remeasure':
+                        pending_bias = bias_executor.submit(self.latch.recover, self.set_bias, next_voltage)
+                        remeasure_row = i
+                        continue
+                    truncated = outcome == 'truncate'
+                    if not truncated:  # the truncate path journals the cleared row itself
+                        self._journal_points(i, next_voltage, trigger_levels, measured_levels, timing)
+
+                # --- Pick the next bias, start writing it, then do this point's I/O while it runs ---
+                bias_schedule.record(next_voltage, results.signal()[i])
+                next_voltage = None if truncated else bias_schedule.next_voltage()
+                curve_points += int(point_measured)
+                reference_due = (self.drift is not None and point_measured and next_voltage is not None
+                                 and self.drift.due(curve_points))
+                if next_voltage is not None and not reference_due:
+                    pending_bias = submit_bias(i + 1, next_voltage)
+
+                with timing.stage('output'):
+                    self._append_outputs(i)
+                    plotter.render(self.flush_plot)
+
+                if reference_due:
+                    # The reference needs the bias, so the next point's write waits until it is done
+                    self._measure_reference(fudge_factor, timing)
+                    pending_bias = submit_bias(i + 1, next_voltage)
+
+                timing.point_done(time.monotonic() - point_start if point_measured else None, bias_schedule.expected_points())
+                print(timing.progress_line())
+
+            if self.drift is not None and curve_points:
+                self._measure_reference(fudge_factor, timing)
+        finally:
+            bias_executor.shutdown(wait=True)
+            if self._csvfile is not None:
+                self._csvfile.close()
+            if self.journal is not None:
+                self.journal.close()
+
+        self._finish_outputs(filename, results, plotter, timing, latency_stats_file)
+
+        print(f'Finished {measurement_type.upper()} Curve Measurement.')
+        return results
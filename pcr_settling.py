@@ -0,0 +1,106 @@
+"""
+Data-driven settling detection
+Instead of a fixed sleep after a bias or trigger level change, the detector's count rate is watched in
+short Counter bins and the point is declared settled once consecutive windows agree within counting
+noise. The fixed wait that used to be there stays as the safety cap, and is what the point gets when the
+windows hold too few counts to tell anything or are too long to fit twice before it.
+"""
+
+import math
+import time
+
+import numpy
+
+from pcr_measurements import MeasurementPool
+
+
+class SettlingDetector:
+    """
+    Waits until the count rate on a set of channels is stationary.
+    Each step acquires window_bins bins of bin_time and compares their total rate with the previous
+    window's: settled once the difference is within tolerance_sigma Poisson standard deviations or
+    within rel_tolerance of the rate, whichever is looser, and both windows hold at least min_counts clicks.
+    """
+
+    def __init__(self, measurement_pool, channels, bin_time: float = 0.01, window_bins: int = 3,
+                 tolerance_sigma: float = 3.0, rel_tolerance: float = 0.05, min_time: float = 0.02,
+                 min_counts: float = 100):
+        """
+        :param measurement_pool: MeasurementPool to take the Counter from
+        :param channels: Channels whose summed rate is watched (usually the raw detector input)
+        :param bin_time: Counter bin width in s
+        :param window_bins: Bins per comparison window
+        :param tolerance_sigma: Allowed change between windows in Poisson standard deviations
+        :param rel_tolerance: Allowed relative change between windows (dominates at high rates)
+        :param min_time: Never declare settled earlier than this after the change, in s
+        :param min_counts: Clicks each window needs before it counts as evidence; below that the cap is waited out
+        """
+        self.bin_time = bin_time
+        self.window_bins = window_bins
+        self.tolerance_sigma = tolerance_sigma
+        self.rel_tolerance = rel_tolerance
+        self.min_time = min_time
+        self.min_counts = min_counts
+        self.window_ps = int(bin_time * window_bins * 1e12)
+        self.counter = measurement_pool.counter(channels, binwidth=int(bin_time * 1e12), n_values=window_bins)
+
+    @classmethod
+    def from_params(cls, params, measurement_pool, channels, modulation_period=None):
+        """
+        Build the detector from the 'settling' YAML section, or return None if disabled
+
+        :param modulation_period: Source modulation period in s; windows are rounded up to whole periods so
+            the on/off phase of the source does not read as a changing rate
+        """
+        config = params.get('settling', {}) or {}
+        if not config.get('enabled', False):
+            return None
+        bin_time = float(config.get('bin_time', 0.01))
+        window_bins = int(config.get('window_bins', 3))
+        if modulation_period is not None:
+            periods = max(1, int(numpy.ceil(window_bins * bin_time / modulation_period - 1e-9)))
+            window_bins = int(round(periods * modulation_period / bin_time))
+        return cls(measurement_pool, channels,
+                   bin_time=bin_time,
+                   window_bins=window_bins,
+                   tolerance_sigma=float(config.get('tolerance_sigma', 3.0)),
+                   rel_tolerance=float(config.get('rel_tolerance', 0.05)),
+                   min_time=float(config.get('min_time', 0.02)),
+                   min_counts=float(config.get('min_counts', 100)))
+
+    def is_stationary(self, previous_counts, counts):
+        """
+        True if two windows' total counts agree within counting noise or the relative tolerance.
+        Windows with fewer than min_counts clicks are never stationary: at a handful of counts the
+        Poisson tolerance swallows any change.
+        """
+        if min(counts, previous_counts) < self.min_counts:
+            return False
+        difference = abs(counts - previous_counts)
+        sigma = math.sqrt(counts + previous_counts)
+        return difference <= max(self.tolerance_sigma * sigma, self.rel_tolerance * max(counts, previous_counts))
+
+    def wait(self, changed_at: float, deadline: float):
+        """
+        Block until the rate is stationary, but no longer than the deadline
+
+        :param changed_at: time.monotonic() of the bias or trigger level change
+        :param deadline: time.monotonic() safety cap (the fixed wait this replaces)
+        :return: Seconds waited since changed_at, and whether settling was detected before the cap
+        """
+        earliest = changed_at + self.min_time
+        remaining = earliest - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+
+        previous = None
+        while time.monotonic() + self.bin_time * self.window_bins <= deadline:
+            counts = float(numpy.sum(MeasurementPool.acquire(self.counter, self.window_ps).getData()))
+            if previous is not None and self.is_stationary(previous, counts):
+                return time.monotonic() - changed_at, True
+            previous = counts
+
+        remaining = deadline - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+        return time.monotonic() - changed_at, False
@@ -0,0 +1,162 @@
+"""
+Parallel trigger levels on a split detector signal
+When the SNSPD pulse is passively split onto several tagger inputs, each input can hold a different
+trigger level. The trigger_levels list is dealt out across the inputs in groups, every input gets its
+own GatedChannel pair, and one Counter reads all of them, so N levels are measured in one integration.
+Configured by a 'split_inputs' section in the params YAML:
+
+    split_inputs:
+      channels: [5, 6, 7]
+
+    python pcr_split_inputs.py PCR_multi_trigger_params.yml split_sweep.csv
+
+The splitter attenuates each copy, and the inputs' delays and dead times should match, so compare
+levels across inputs only after checking one level on all of them.
+"""
+
+import argparse
+import sys
+import time
+
+from pcr_measurements import MeasurementPool
+from pcr_multi_detector import counter_rows, store_counter_point, write_sweep_outputs
+from pcr_results import SweepResults
+from pcr_runner import GatingGraph, ON_GATE_MS, OFF_GATE_MS
+from pcr_sweep import parse_sweep_params, uniform_bias_grid
+
+
+def trigger_level_groups(trigger_levels, num_inputs: int):
+    """
+    Deal the trigger levels out across the inputs
+
+    :return: List of groups, each a list of (trigger level index, input index); the last group may be partial
+    """
+    indices = list(range(len(trigger_levels)))
+    return [[(j, k) for k, j in enumerate(indices[start:start + num_inputs])]
+            for start in range(0, len(indices), num_inputs)]
+
+
+class SplitInputSweepRunner:
+    """
+    Runs a filtered_pcr, dcr or combined sweep with the trigger levels spread over several inputs
+    carrying copies of the same detector signal. Results go into one SweepResults as for a single input.
+    """
+
+    def __init__(self, tagger, gatings, set_bias, measurement_pool):
+        """
+        :param tagger: TimeTagger instance
+        :param gatings: One GatingGraph per split input (its detector_channel is the input whose level is set)
+        :param set_bias: Callable taking a voltage and returning True if it was applied
+        :param measurement_pool: MeasurementPool to take the Counter from
+        """
+        self.tagger = tagger
+        self.gatings = list(gatings)
+        self.set_bias = set_bias
+        self.measurement_pool = measurement_pool
+        self.results = None
+
+    def run(self, params, filename):
+        measurement_type, trigger_levels = parse_sweep_params(params)
+        int_time_sec = float(params['integration_time'])
+        int_time = int(int_time_sec * 1e12)
+        settle_time = float(params.get('settle_time', 0.2))
+        trigger_settle_time = float(params.get('trigger_settle_time', 0.2))
+        voltages = uniform_bias_grid(params['voltage']['start'], params['voltage']['stop'], params['voltage']['step'])
+
+        bin_duration = 0.1
+        if measurement_type in ('dcr', 'combined'):
+            num_bins = int(int_time_sec / bin_duration)
+            binwidth = int(bin_duration * 1e12)
+        else:
+            num_bins = 1
+            binwidth = int_time
+
+        results = SweepResults(measurement_type, trigger_levels, num_bins=num_bins,
+                               bin_duration=bin_duration, capacity=len(voltages))
+        self.results = results
+
+        channels, rows = counter_rows(self.gatings, measurement_type)
+        counter = self.measurement_pool.counter(channels, binwidth=binwidth, n_values=num_bins)
+        counted_sec = num_bins * binwidth * 1e-12  # may be shorter than int_time_sec when it isn't whole DCR bins
+        groups = trigger_level_groups(trigger_levels, len(self.gatings))
+        print(f"Sweeping {len(trigger_levels)} trigger levels on {len(self.gatings)} inputs: "
+              f"{len(groups)} integrations per bias point instead of {len(trigger_levels)}")
+        for group in groups:
+            print("  " + ", ".join(f"TL {float(trigger_levels[j]):.3f} V on input {self.gatings[k].detector_channel}"
+                                   for j, k in group))
+
+        for voltage in voltages:
+            success = self.set_bias(voltage)
+            bias_set_at = time.monotonic()
+            row = results.add_bias(voltage)
+            if not success:
+                print(f"Skipping bias voltage {voltage:.3f} V due to connection issues.")
+                continue
+
+            for g, group in enumerate(groups):
+                for j, k in group:
+                    self.tagger.setTriggerLevel(self.gatings[k].detector_channel, float(trigger_levels[j]))
+                deadline = time.monotonic() + trigger_settle_time
+                if g == 0:
+                    deadline = max(deadline, bias_set_at + settle_time)
+                remaining = deadline - time.monotonic()
+                if remaining > 0:
+                    time.sleep(remaining)
+
+                clicks = MeasurementPool.acquire(counter, int_time).getData()
+                for j, k in group:
+                    message = store_counter_point(params, results, row, j, self.gatings[k], clicks, rows[k],
+                                                  counted_sec, bin_duration)
+                    print(f"  V={voltage:.3f} TL={float(trigger_levels[j]):.3f} (input {self.gatings[k].detector_channel}):" + message)
+
+        base = filename[:-4] if filename.lower().endswith('.csv') else filename
+        write_sweep_outputs(results, base, 'split-input sweep')
+        print(f'Finished {measurement_type.upper()} split-input sweep.')
+        return results
+
+
+def main(argv=None):
+    from pcr_headless import HeadlessSession, load_yaml
+
+    parser = argparse.ArgumentParser(description="Sweep trigger levels in parallel on a detector signal split to several inputs")
+    parser.add_argument("params", help="Parameters YAML with a split_inputs section")
+    parser.add_argument("output", help="CSV output path")
+    parser.add_argument("--channels", default="channel_params.yaml", help="Tagger input settings as saved by the GUI")
+    args = parser.parse_args(argv)
+
+    try:
+        params = load_yaml(args.params)
+        channel_params = load_yaml(args.channels)
+    except Exception as e:
+        print(f"Error loading parameters: {e}")
+        return 1
+    config = params.get('split_inputs', {}) or {}
+    inputs = [int(channel) for channel in config.get('channels', []) or []]
+    if len(inputs) < 2 or parse_sweep_params(params) is None:
+        print("Error: the params YAML needs a split_inputs section with at least two channels and valid sweep parameters.")
+        return 1
+
+    session = HeadlessSession(channel_params)
+    try:
+        if not session.open():
+            return 1
+        dead_time = config.get('dead_time')
+        gatings = []
+        for channel in inputs:
+            if dead_time is not None:
+                session.tagger.setDeadtime(channel, int(dead_time * 1000))
+                session.tagger.setDeadtime(channel*-1, int(dead_time * 1000))
+            gatings.append(GatingGraph(session.tagger, session.gating.reference_channel, channel,
+                                       tuple(config.get('on_gate_ms', ON_GATE_MS)),
+                                       tuple(config.get('off_gate_ms', OFF_GATE_MS))))
+
+        SplitInputSweepRunner(session.tagger, gatings, session.sim928.set_voltage_robustly,
+                              session.measurement_pool).run(params, args.output)
+        session.shutdown(params)
+    finally:
+        session.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
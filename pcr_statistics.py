@@ -0,0 +1,166 @@
+"""
+Counting statistics for the gated PCR and DCR sweeps
+Kept free of Qt and TimeTagger imports so it can be used from analysis scripts as well
+"""
+
+import math
+
+import numpy
+
+
+def gated_signal_rate(clicks_on, clicks_off, ratio_on, ratio_off, t_sec):
+    """
+    Dark-subtracted count rate from the on/off gated channels and its Poisson uncertainty
+
+    :param clicks_on: Counts collected in the thermal-source-on gate
+    :param clicks_off: Counts collected in the thermal-source-off gate
+    :param ratio_on: Fraction of each modulation period covered by the on gate (fudged)
+    :param ratio_off: Fraction of each modulation period covered by the off gate (fudged)
+    :param t_sec: Integration time in seconds
+    :return: (signal rate, dark rate, standard deviation of the signal rate), all in Hz
+    """
+    on_scale = ratio_on * t_sec
+    off_scale = ratio_off * t_sec
+    dark_rate = clicks_off / off_scale
+    signal_rate = clicks_on / on_scale - dark_rate
+    sigma = math.sqrt(clicks_on / on_scale**2 + clicks_off / off_scale**2)
+    return signal_rate, dark_rate, sigma
+
+
+class PoissonStoppingRule:
+    """
+    Decides when a chunked integration has collected enough counts.
+    A point stops once the relative uncertainty of the dark-subtracted rate is below
+    the target, but never before min_time and never after max_time.
+    """
+
+    def __init__(self, target_rel_uncertainty: float, min_time: float, max_time: float, chunk_time: float):
+        """
+        :param target_rel_uncertainty: Stop once sigma / signal drops below this value
+        :param min_time: Minimum integration time per point in seconds
+        :param max_time: Maximum integration time per point in seconds
+        :param chunk_time: Length of each Counter chunk in seconds
+        """
+        self.target_rel_uncertainty = target_rel_uncertainty
+        self.min_time = min_time
+        self.max_time = max_time
+        self.chunk_time = chunk_time
+
+    @classmethod
+    def from_params(cls, params):
+        """Build the rule from the 'adaptive_integration' YAML section, or return None if disabled"""
+        config = params.get('adaptive_integration', {}) or {}
+        if not config.get('enabled', False):
+            return None
+        max_time = float(config.get('max_time', params['integration_time']))
+        return cls(
+            target_rel_uncertainty=float(config.get('target_rel_uncertainty', 0.02)),
+            min_time=float(config.get('min_time', 1.0)),
+            max_time=max_time,
+            chunk_time=min(float(config.get('chunk_time', 0.5)), max_time),
+        )
+
+    def should_stop(self, signal_rate, sigma, elapsed):
+        """True once the point has reached the target uncertainty or the time cap"""
+        if elapsed + 1e-9 >= self.max_time:
+            return True
+        if elapsed + 1e-9 < self.min_time:
+            return False
+        # A signal consistent with zero never meets a relative target; it runs to max_time
+        return signal_rate > 0 and sigma / signal_rate <= self.target_rel_uncertainty
+
+
+def allan_taus(num_bins: int):
+    """Averaging factors m = 1, 2, 4, ... usable for an overlapping Allan deviation of num_bins bins"""
+    taus = []
+    m = 1
+    while 2 * m <= num_bins:
+        taus.append(m)
+        m *= 2
+    return numpy.array(taus, dtype=int)
+
+
+def overlapping_allan_deviation(rates, factors):
+    """
+    Overlapping Allan deviation of an evenly binned rate series
+
+    :param rates: Rate per bin in Hz
+    :param factors: Averaging factors m (tau = m * bin duration)
+    :return: One deviation per factor, in Hz (NaN where the series is too short)
+    """
+    rates = numpy.asarray(rates, dtype=float)
+    n = len(rates)
+    cumulative = numpy.concatenate([[0.0], numpy.cumsum(rates)])
+    deviations = numpy.full(len(factors), numpy.nan)
+    for k, m in enumerate(factors):
+        if 2 * m > n:
+            continue
+        averages = (cumulative[m:] - cumulative[:-m]) / m  # mean of every window of m bins
+        differences = averages[m:] - averages[:-m]
+        deviations[k] = math.sqrt(0.5 * numpy.mean(differences**2))
+    return deviations
+
+
+class DCRBinStatistics:
+    """
+    Streaming summary of one (bias, trigger level) point's DCR bins.
+    Bins can be fed in chunks as they arrive; outliers are rejected against the median with a
+    robust (MAD, Poisson-floored) spread, and the point is flagged as bursty / telegraph-like when
+    outliers were found or the kept bins scatter much more than Poisson counting allows.
+    """
+
+    def __init__(self, bin_duration: float, outlier_sigma: float = 5.0, fano_threshold: float = 1.5):
+        """
+        :param bin_duration: Bin length in s
+        :param outlier_sigma: Bins further than this many robust sigma from the median are rejected
+        :param fano_threshold: Flag the point when the count variance exceeds this multiple of the mean
+        """
+        self.bin_duration = bin_duration
+        self.outlier_sigma = outlier_sigma
+        self.fano_threshold = fano_threshold
+        self._rates = []
+
+    @classmethod
+    def from_params(cls, params, bin_duration):
+        config = params.get('dcr_statistics', {}) or {}
+        return cls(bin_duration,
+                   outlier_sigma=float(config.get('outlier_sigma', 5.0)),
+                   fano_threshold=float(config.get('fano_threshold', 1.5)))
+
+    def update(self, rates):
+        """Add newly arrived bins (rates in Hz)"""
+        self._rates.extend(numpy.atleast_1d(numpy.asarray(rates, dtype=float)).tolist())
+
+    def summary(self, factors):
+        """
+        :param factors: Allan averaging factors, as from allan_taus()
+        :return: Dictionary with dcr_mean, dcr_variance, dcr_fano, dcr_rejected, dcr_flag (0/1) and dcr_adev
+        """
+        rates = numpy.array(self._rates)
+        rates = rates[~numpy.isnan(rates)]
+        if len(rates) == 0:
+            return {'dcr_mean': numpy.nan, 'dcr_variance': numpy.nan, 'dcr_fano': numpy.nan, 'dcr_rejected': numpy.nan,
+                    'dcr_flag': numpy.nan, 'dcr_adev': numpy.full(len(factors), numpy.nan)}
+
+        counts = rates * self.bin_duration
+        median = numpy.median(counts)
+        mad_sigma = 1.4826 * numpy.median(numpy.abs(counts - median))
+        spread = max(mad_sigma, math.sqrt(max(median, 1.0)))  # never tighter than Poisson noise
+        keep = numpy.abs(counts - median) <= self.outlier_sigma * spread
+        kept = counts[keep]
+
+        mean_counts = float(numpy.mean(kept))
+        variance_counts = float(numpy.var(kept, ddof=1)) if len(kept) > 1 else numpy.nan
+        fano = variance_counts / mean_counts if mean_counts > 0 else numpy.nan
+        rejected = int(len(counts) - len(kept))
+
+        # Rejected bins are replaced by the kept mean so the series stays evenly spaced
+        cleaned = numpy.where(keep, counts, mean_counts) / self.bin_duration
+        return {
+            'dcr_mean': mean_counts / self.bin_duration,
+            'dcr_variance': variance_counts / self.bin_duration**2,
+            'dcr_fano': fano,
+            'dcr_rejected': rejected,
+            'dcr_flag': float(rejected > 0 or (not numpy.isnan(fano) and fano > self.fano_threshold)),
+            'dcr_adev': overlapping_allan_deviation(cleaned, factors),
+        }
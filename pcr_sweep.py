@@ -0,0 +1,248 @@
+"""
+Sweep planning for the PCR/DCR measurements in Gated_Histogram_PCR_multi_trigger.py
+Kept free of Qt and TimeTagger imports so sweeps can be planned and replayed offline
+"""
+
+import numpy
+import yaml
+
+
+# Gate windows within the 1000 ms thermal source modulation period, in ms after the ChA reference edge
+ON_GATE_MS = (30, 270)
+OFF_GATE_MS = (450, 950)
+MODULATION_PERIOD_MS = 1000
+
+
+def load_yaml(path):
+    with open(path, "r", encoding="utf8") as stream:
+        return yaml.safe_load(stream)
+
+
+def uniform_bias_grid(start, stop, step):
+    """Uniform SIM928 voltage grid from start to stop (inclusive) in steps of step"""
+    offset = numpy.arange(start, stop + step, step)
+    # Ensure Stop is included if the step doesn't divide the range perfectly
+    if not numpy.isclose(offset[-1], stop):
+        offset = numpy.append(offset, stop)
+    return offset
+
+
+def parse_sweep_params(params):
+    """Validate the sweep parameters. Returns (measurement_type, trigger_levels), or None on error."""
+    try:
+        # Check the common parameters are present
+        for key in ('start', 'stop', 'step'):
+            float(params['voltage'][key])
+        float(params['integration_time'])
+        float(params['fudge_factor'])
+        measurement_type = params.get('measurement_type', 'filtered_pcr').lower()
+
+        print(f"Measurement type: {measurement_type}")
+
+        # Extract measurement-specific parameters
+        if measurement_type == 'filtered_pcr':
+            trigger_levels = params['filtered_PCR']['trigger_levels']
+            if not isinstance(trigger_levels, list) or not trigger_levels:
+                print("Error: 'trigger_levels' in filtered_PCR YAML must be a non-empty list.")
+                return None
+            print(f"Using {len(trigger_levels)} trigger levels: {trigger_levels}")
+        elif measurement_type == 'dcr':
+            # Support both old single trigger_level and new trigger_levels list
+            if 'trigger_levels' in params['DCR']:
+                trigger_levels = params['DCR']['trigger_levels']
+                if not isinstance(trigger_levels, list) or not trigger_levels:
+                    print("Error: 'trigger_levels' in DCR YAML must be a non-empty list.")
+                    return None
+            elif 'trigger_level' in params['DCR']:
+                # Backward compatibility with single trigger level
+                trigger_level = params['DCR']['trigger_level']
+                trigger_levels = [str(trigger_level)]
+                print("Using single DCR trigger level (backward compatibility mode)")
+            else:
+                print("Error: DCR section must contain either 'trigger_levels' (list) or 'trigger_level' (single value).")
+                return None
+
+            print(f"Using {len(trigger_levels)} DCR trigger levels: {trigger_levels}")
+        elif measurement_type == 'combined':
+            # Gated counts and raw DCR bins at the same trigger levels, in one pass
+            section = params.get('combined') or params['filtered_PCR']
+            trigger_levels = section['trigger_levels']
+            if not isinstance(trigger_levels, list) or not trigger_levels:
+                print("Error: 'trigger_levels' for the combined mode must be a non-empty list.")
+                return None
+            print(f"Using {len(trigger_levels)} trigger levels for gated PCR + DCR: {trigger_levels}")
+        else:
+            print(f"Error: Unknown measurement type '{measurement_type}'. Must be 'filtered_pcr', 'dcr' or 'combined'.")
+            return None
+
+    except (KeyError, TypeError, ValueError) as e:
+        print(f"Error parsing sweep parameters: {e}")
+        return None
+
+    return measurement_type, trigger_levels
+
+
+def randomized_bias_order(voltages, seed=None, latch_safe_above=None):
+    """
+    Bias voltages in random order, so slow drift does not line up with the bias axis
+
+    :param seed: Seed of the shuffle; set it so a resumed sweep replays the same order
+    :param latch_safe_above: Voltages above this are kept out of the shuffle and measured last in
+                             ascending order, so a latch at high bias cannot spoil later low-bias points
+    """
+    voltages = numpy.asarray(voltages, dtype=float)
+    rng = numpy.random.default_rng(seed)
+    if latch_safe_above is None:
+        return list(rng.permutation(voltages))
+    low = voltages[voltages <= latch_safe_above]
+    high = numpy.sort(voltages[voltages > latch_safe_above])
+    return list(rng.permutation(low)) + list(high)
+
+
+class FixedBiasSchedule:
+    """
+    Hands out a precomputed list of bias voltages in order.
+    Shares its interface with AdaptiveBiasSampler so the sweep loop does not care which one it has.
+    """
+
+    is_adaptive = False
+
+    def __init__(self, voltages):
+        self._voltages = list(voltages)
+        self._index = 0
+
+    def expected_points(self):
+        return len(self._voltages)
+
+    def next_voltage(self):
+        """Next bias voltage to measure, or None once the schedule is exhausted"""
+        if self._index >= len(self._voltages):
+            return None
+        voltage = self._voltages[self._index]
+        self._index += 1
+        return voltage
+
+    def record(self, voltage, response):
+        """Fixed schedules ignore measured results"""
+        pass
+
+
+class AdaptiveBiasSampler:
+    """
+    Places bias points where the PCR curve is changing.
+    A coarse ascending pass is taken first and cut short once the curve has reached a plateau.
+    Intervals whose normalised change or curvature exceeds refine_tolerance are then bisected,
+    pass after pass, until every interval is flat enough, narrower than min_step, or max_points is spent.
+    """
+
+    is_adaptive = True
+
+    def __init__(self, start, stop, coarse_step, min_step, refine_tolerance=0.1,
+                 plateau_tolerance=0.02, plateau_points=3, max_points=200):
+        """
+        :param start: First bias voltage in V
+        :param stop: Last bias voltage in V
+        :param coarse_step: Step of the initial coarse pass in V
+        :param min_step: Intervals narrower than this are never bisected
+        :param refine_tolerance: Normalised change/curvature above which an interval is bisected
+        :param plateau_tolerance: Relative spread below which the last plateau_points points count as a plateau
+        :param plateau_points: Number of consecutive coarse points used for the plateau test
+        :param max_points: Hard cap on the number of measured bias points
+        """
+        self.min_step = min_step
+        self.refine_tolerance = refine_tolerance
+        self.plateau_tolerance = plateau_tolerance
+        self.plateau_points = plateau_points
+        self.max_points = max_points
+
+        self._pending = list(uniform_bias_grid(start, stop, coarse_step))
+        self._coarse_count = len(self._pending)
+        self._coarse_phase = True
+        self._voltages = []
+        self._responses = []
+
+    @classmethod
+    def from_params(cls, params):
+        """Build the sampler from the 'adaptive_bias' YAML section, or return None if disabled"""
+        config = params.get('adaptive_bias', {}) or {}
+        if not config.get('enabled', False):
+            return None
+        step = float(params['voltage']['step'])
+        return cls(
+            start=float(params['voltage']['start']),
+            stop=float(params['voltage']['stop']),
+            coarse_step=float(config.get('coarse_step', 4 * step)),
+            min_step=float(config.get('min_step', step)),
+            refine_tolerance=float(config.get('refine_tolerance', 0.1)),
+            plateau_tolerance=float(config.get('plateau_tolerance', 0.02)),
+            plateau_points=int(config.get('plateau_points', 3)),
+            max_points=int(config.get('max_points', 200)),
+        )
+
+    def expected_points(self):
+        """Points in the coarse pass; refinement adds to this as the curve comes in"""
+        return self._coarse_count
+
+    def next_voltage(self):
+        """Next bias voltage to measure, or None once the curve is resolved"""
+        if len(self._voltages) >= self.max_points:
+            return None
+        if not self._pending:
+            self._coarse_phase = False
+            self._pending = self._refinement_pass()
+        if not self._pending:
+            return None
+        return self._pending.pop(0)
+
+    def record(self, voltage, response):
+        """
+        Record the measured response at a bias point
+
+        :param voltage: Bias voltage that was measured
+        :param response: Array with one value per trigger level (NaN for failed points)
+        """
+        self._voltages.append(float(voltage))
+        self._responses.append(numpy.atleast_1d(numpy.asarray(response, dtype=float)))
+        if self._coarse_phase and self._reached_plateau():
+            print(f"Plateau reached at {voltage:.3f} V, skipping {len(self._pending)} remaining coarse points")
+            self._pending = []
+
+    def _reached_plateau(self):
+        if len(self._responses) < self.plateau_points:
+            return False
+        tail = numpy.array(self._responses[-self.plateau_points:])
+        if numpy.isnan(tail).any():
+            return False
+        scale = numpy.max(numpy.abs(tail), axis=0)
+        if not numpy.all(scale > 0):
+            return False
+        spread = (numpy.max(tail, axis=0) - numpy.min(tail, axis=0)) / scale
+        return bool(numpy.all(spread <= self.plateau_tolerance))
+
+    def _refinement_pass(self):
+        """Midpoints of every interval that still needs resolving, highest score first"""
+        order = numpy.argsort(self._voltages)
+        x = numpy.array(self._voltages)[order]
+        y = numpy.array(self._responses)[order]
+        if len(x) < 2:
+            return []
+
+        # Normalise each trigger level to its own range so all levels weigh equally
+        y_range = numpy.nanmax(y, axis=0) - numpy.nanmin(y, axis=0)
+        y_range[~(y_range > 0)] = 1.0
+        y_norm = y / y_range
+
+        # Change across each interval
+        scores = numpy.nanmax(numpy.abs(numpy.diff(y_norm, axis=0)), axis=1)
+        # Curvature at interior points, shared with both neighbouring intervals
+        if len(x) >= 3:
+            curvature = numpy.nanmax(numpy.abs(y_norm[2:] - 2 * y_norm[1:-1] + y_norm[:-2]), axis=1)
+            scores[:-1] = numpy.fmax(scores[:-1], curvature)
+            scores[1:] = numpy.fmax(scores[1:], curvature)
+
+        widths = numpy.diff(x)
+        candidates = [k for k in numpy.argsort(-numpy.nan_to_num(scores))
+                      if scores[k] > self.refine_tolerance and widths[k] / 2 >= self.min_step * (1 - 1e-6)]
+        budget = self.max_points - len(self._voltages)
+        midpoints = [float((x[k] + x[k + 1]) / 2) for k in candidates[:budget]]
+        return sorted(midpoints)
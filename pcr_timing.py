@@ -0,0 +1,322 @@
+"""
+Measured-latency timing model for PCR/DCR sweeps
+Each stage of a sweep (bias write, settling, trigger level write, acquisition, output, and where enabled the
+latch check, drift reference readings and trigger-cycling switches) is timed as it runs.
+The running averages give a continuously updated ETA and throughput, and are merged into a latency
+statistics file so a later sweep's duration can be predicted before any lab time is spent:
+
+    python pcr_timing.py PCR_multi_trigger_params.yml
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+
+import yaml
+
+from pcr_sweep import MODULATION_PERIOD_MS, AdaptiveBiasSampler, parse_sweep_params, uniform_bias_grid
+
+
+DEFAULT_STATS_FILE = 'latency_stats.json'
+
+# Per-stage means in seconds used until a stage has been measured at least once
+DEFAULT_STAGE_SECONDS = {
+    'bias_wait': 0.05,  # part of the SIM928 write not hidden behind the previous point's output
+    'output': 0.05,  # CSV, binary, journal and plot per bias point
+    'trigger_level': 0.01,  # setTriggerLevel
+    'settle': 0.2,  # sleeps before each acquisition (trigger_settle_time when the params are known)
+    'acquire_overhead': 0.05,  # acquisition wall time beyond the nominal integration time
+    'journal': 0.005,  # journal append (flush + fsync) per trigger level
+    'int_time': None,  # actual integration time per point (adaptive integration); no default
+    'trigger_switch': 0.01,  # setTriggerLevel + sync per trigger-cycling sub-integration
+    'latch_check': None,  # probe window per bias point; from the latch_detection section
+    'reference': None,  # one drift reference reading; from the drift_reference section
+}
+
+
+class StageStats:
+    """Count, mean and variance of one stage's durations (Welford's algorithm), mergeable"""
+
+    def __init__(self, count: int = 0, mean: float = 0.0, m2: float = 0.0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    def add(self, seconds: float):
+        self.count += 1
+        delta = seconds - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (seconds - self.mean)
+
+    def merge(self, other):
+        """Combine with another StageStats (parallel variance formula)"""
+        if other.count == 0:
+            return
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.m2 += other.m2 + delta**2 * self.count * other.count / total
+        self.mean += delta * other.count / total
+        self.count = total
+
+    @property
+    def std(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def to_dict(self):
+        return {'count': self.count, 'mean': self.mean, 'm2': self.m2}
+
+    @classmethod
+    def from_dict(cls, record):
+        return cls(int(record['count']), float(record['mean']), float(record['m2']))
+
+
+class SweepTimingModel:
+    """
+    Stage timings of a sweep and the ETA derived from them.
+    The ETA uses the measured wall time per bias point once points have completed, and the
+    stage model (stored or default latencies) before that.
+    """
+
+    def __init__(self, params, trigger_levels, expected_points: int, stats=None):
+        """
+        :param params: Sweep parameters
+        :param trigger_levels: Trigger levels of the sweep
+        :param expected_points: Expected number of bias points
+        :param stats: {stage: StageStats} from earlier sweeps, used for the initial estimate
+        """
+        self.params = params
+        self.num_trigger_levels = len(trigger_levels)
+        self.expected_points = expected_points
+        self.prior = stats or {}
+        self.stages = {}
+        self.points_done = 0
+        self.started = time.monotonic()
+        self._point_wall = StageStats()
+
+    def record(self, stage: str, seconds: float):
+        self.stages.setdefault(stage, StageStats()).add(seconds)
+
+    def stage(self, stage: str):
+        """Context manager timing a block as the given stage"""
+        return _StageTimer(self, stage)
+
+    def point_done(self, seconds, expected_points: int = None):
+        """Record one finished bias point and its wall time (None for points replayed from a journal)"""
+        self.points_done += 1
+        if seconds is not None:
+            self._point_wall.add(seconds)
+        if expected_points is not None:
+            self.expected_points = max(expected_points, self.points_done)
+
+    def stage_mean(self, stage: str):
+        """Mean of a stage from this sweep, else from stored statistics, else the default from the params"""
+        for source in (self.stages, self.prior):
+            if stage in source and source[stage].count:
+                return source[stage].mean
+        default = _param_default(self.params, stage)
+        return default if default is not None else DEFAULT_STAGE_SECONDS.get(stage)
+
+    def predicted_point_seconds(self):
+        """Modelled wall time of one bias point, including the latch probe and a share of the drift references"""
+        int_time = _integration_time(self.params, self.stage_mean('int_time'))
+        cycling = _cycling_rounds(self.params, self.stage_mean('trigger_switch'))
+        if cycling is not None:
+            # One settle per point, then every level once per round
+            switches = cycling * self.num_trigger_levels
+            seconds = (self.stage_mean('settle') + self.num_trigger_levels * (int_time + self.stage_mean('journal'))
+                       + switches * (self.stage_mean('trigger_switch') + self.stage_mean('acquire_overhead')))
+        else:
+            per_level = (self.stage_mean('trigger_level') + self.stage_mean('settle') + self.stage_mean('journal')
+                         + int_time + self.stage_mean('acquire_overhead'))
+            seconds = self.num_trigger_levels * per_level
+        seconds += self.stage_mean('bias_wait') + self.stage_mean('output')
+        if _latch_window(self.params) is not None:
+            seconds += self.stage_mean('latch_check')
+        every = _reference_every(self.params)
+        if every is not None:
+            seconds += self.stage_mean('reference') / every
+        return seconds
+
+    def remaining_seconds(self):
+        """ETA in seconds for the points still expected, plus the drift readings before and after the curve"""
+        remaining = max(self.expected_points - self.points_done, 0)
+        per_point = self._point_wall.mean if self._point_wall.count else self.predicted_point_seconds()
+        seconds = remaining * per_point + float(self.params.get('shutdown_delay', 0.5))
+        if _reference_every(self.params) is not None:
+            seconds += (2 if self.points_done == 0 else 1) * self.stage_mean('reference')
+        return seconds
+
+    def throughput(self):
+        """Bias points per minute so far"""
+        elapsed = time.monotonic() - self.started
+        return 60.0 * self.points_done / elapsed if elapsed > 0 else 0.0
+
+    def progress_line(self):
+        return (f"Point {self.points_done}/{self.expected_points}: {self.throughput():.2f} points/min, "
+                f"ETA {self.remaining_seconds()/60:.1f} min")
+
+    def summary(self):
+        lines = [f"Sweep timing: {self.points_done} points in {(time.monotonic() - self.started)/60:.2f} min"]
+        for stage, stats in sorted(self.stages.items()):
+            lines.append(f"  {stage:<17} mean {stats.mean*1e3:8.1f} ms  std {stats.std*1e3:8.1f} ms  n={stats.count}")
+        return '\n'.join(lines)
+
+
+class _StageTimer:
+    def __init__(self, model, stage):
+        self.model = model
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.model.record(self.stage, time.monotonic() - self.start)
+        return False
+
+
+def _integration_time(params, measured_int_time=None):
+    """Integration time per point in s; adaptive integration uses the measured mean if known"""
+    config = params.get('adaptive_integration', {}) or {}
+    if params.get('measurement_type', 'filtered_pcr').lower() == 'filtered_pcr' and config.get('enabled', False):
+        if measured_int_time is not None:
+            return measured_int_time
+        return (float(config.get('min_time', 1)) + float(config.get('max_time', 20))) / 2
+    return float(params['integration_time'])
+
+
+def _latch_window(params):
+    """Latch probe window in s, rounded up to whole modulation periods as LatchDetector does, or None if disabled"""
+    config = params.get('latch_detection', {}) or {}
+    if not config.get('enabled', False):
+        return None
+    period = MODULATION_PERIOD_MS * 1e-3
+    window = float(config.get('bin_time', 0.01)) * int(config.get('window_bins', 10))
+    return max(1, math.ceil(window / period - 1e-9)) * period
+
+
+def _reference_every(params):
+    """Curve points per drift reference reading, or None if no readings are taken"""
+    config = params.get('drift_reference', {}) or {}
+    if not config.get('enabled', False) or params.get('measurement_type', 'filtered_pcr').lower() == 'dcr':
+        return None
+    return max(1, int(config.get('every', 5)))
+
+
+def _cycling_rounds(params, switch_latency):
+    """
+    Passes over the trigger levels per bias point with trigger cycling, or None if the levels are measured
+    one after the other. Sub-integrations are whole modulation periods, lengthened so the switch latency
+    stays below max_overhead, as in PCRSweepRunner._prepare_cycling.
+    """
+    config = params.get('trigger_cycling', {}) or {}
+    if not config.get('enabled', False):
+        return None
+    if params.get('measurement_type', 'filtered_pcr').lower() == 'filtered_pcr':
+        if ((params.get('adaptive_integration', {}) or {}).get('enabled', False)
+                or (params.get('lockin', {}) or {}).get('enabled', False)):
+            return None
+    max_overhead = float(config.get('max_overhead', 0.1))
+    sub_time = max(float(config.get('sub_integration', 1.0)), switch_latency * (1 - max_overhead) / max_overhead)
+    period = MODULATION_PERIOD_MS * 1e-3
+    sub_time = max(1, round(sub_time / period)) * period
+    return max(1, int(round(float(params['integration_time']) / sub_time)))
+
+
+def _param_default(params, stage):
+    """Unmeasured stage duration implied by the params, or None to use DEFAULT_STAGE_SECONDS"""
+    if stage == 'settle':
+        # Settling detection can only shorten these; the fixed waits are its cap
+        return float(params.get('trigger_settle_time', DEFAULT_STAGE_SECONDS['settle']))
+    if stage == 'latch_check':
+        return _latch_window(params)
+    if stage == 'reference':
+        config = params.get('drift_reference', {}) or {}
+        return (DEFAULT_STAGE_SECONDS['bias_wait'] + float(config.get('settle_time', params.get('settle_time', 0.2)))
+                + float(config.get('integration_time', 1.0)) + DEFAULT_STAGE_SECONDS['acquire_overhead'])
+    return None
+
+
+def load_latency_stats(path: str = DEFAULT_STATS_FILE):
+    """{stage: StageStats} from a latency statistics file, empty if there is none"""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r') as file:
+            return {stage: StageStats.from_dict(record) for stage, record in json.load(file).items()}
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Ignoring unreadable latency statistics {path}: {e}")
+        return {}
+
+
+def save_latency_stats(model, path: str = DEFAULT_STATS_FILE):
+    """Merge a finished sweep's stage timings into the latency statistics file"""
+    stats = load_latency_stats(path)
+    for stage, stage_stats in model.stages.items():
+        stats.setdefault(stage, StageStats()).merge(stage_stats)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump({stage: s.to_dict() for stage, s in stats.items()}, file, indent=2)
+    os.replace(tmp_path, path)
+
+
+def predict_sweep(params, stats_path: str = DEFAULT_STATS_FILE):
+    """
+    Dry run: predicted duration of a sweep from stored latency statistics
+
+    :return: (seconds, SweepTimingModel used for the prediction)
+    """
+    parsed = parse_sweep_params(params)
+    if parsed is None:
+        raise ValueError("Invalid sweep parameters")
+    _, trigger_levels = parsed
+    sampler = AdaptiveBiasSampler.from_params(params)
+    if sampler is not None:
+        expected_points = sampler.expected_points()
+    else:
+        voltage = params['voltage']
+        expected_points = len(uniform_bias_grid(float(voltage['start']), float(voltage['stop']), float(voltage['step'])))
+    model = SweepTimingModel(params, trigger_levels, expected_points, stats=load_latency_stats(stats_path))
+    return model.remaining_seconds(), model
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Predict a sweep's duration from stored latency statistics")
+    parser.add_argument("params", help="Sweep parameters, e.g. PCR_multi_trigger_params.yml")
+    parser.add_argument("--stats", default=DEFAULT_STATS_FILE, help="Latency statistics file written by earlier sweeps")
+    args = parser.parse_args(argv)
+
+    with open(args.params, "r", encoding="utf8") as stream:
+        params = yaml.safe_load(stream)
+    try:
+        seconds, model = predict_sweep(params, args.stats)
+    except (ValueError, KeyError) as e:
+        print(f"Error: {e}")
+        return 1
+
+    print(f"{model.expected_points} bias points x {model.num_trigger_levels} trigger levels")
+    stages = ['bias_wait', 'output', 'trigger_level', 'settle', 'acquire_overhead', 'journal']
+    cycling = _cycling_rounds(params, model.stage_mean('trigger_switch'))
+    if cycling is not None:
+        stages[2] = 'trigger_switch'
+        print(f"Trigger level cycling: {cycling} rounds per bias point")
+    if _latch_window(params) is not None:
+        stages.append('latch_check')
+    if _reference_every(params) is not None:
+        stages.append('reference')
+        print(f"Drift reference: one reading every {_reference_every(params)} bias points, plus one before and after")
+    for stage in stages:
+        source = 'measured' if stage in model.prior else 'default'
+        print(f"  {stage:<17} {model.stage_mean(stage)*1e3:8.1f} ms ({source})")
+    print(f"Predicted duration: {seconds/60:.2f} min ({model.predicted_point_seconds():.2f} s per bias point)")
+    if (params.get('adaptive_bias', {}) or {}).get('enabled', False):
+        print("Adaptive bias placement: refinement points come on top of the coarse pass counted here")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""
+SIM928 voltage source connection that survives USB-serial port renumbering
+Shared by the Qt window and the headless sweep runner
+"""
+
+import serial # Import serial for exception handling
+import termios # Import termios for catching specific OS error
+
+from snspd_measure.inst.sim900 import sim928
+
+
+class SIM928Connection:
+    """
+    Holds the sim928 instrument and the serial port it is on.
+    On serial errors the next port in possible_ports is tried and the source reconnected.
+    """
+
+    def __init__(self, port: str = '/dev/ttyUSB0', possible_ports=('/dev/ttyUSB0', '/dev/ttyUSB1', '/dev/ttyUSB2'),
+                 gpib_addr: int = 2, slot: int = 1):
+        """
+        :param port: Initial serial port
+        :param possible_ports: Ports to cycle through on failure
+        :param gpib_addr: GPIB address of the SIM900 mainframe
+        :param slot: SIM900 slot of the SIM928
+        """
+        self.port = port
+        self.possible_ports = list(possible_ports)
+        self.gpib_addr = gpib_addr
+        self.slot = slot
+        self.source = None
+
+    def _next_port(self):
+        current_index = self.possible_ports.index(self.port)
+        next_index = (current_index + 1) % len(self.possible_ports)
+        self.port = self.possible_ports[next_index]
+
+    def _open(self):
+        self.source = sim928(self.port, self.gpib_addr, self.slot)
+        self.source.connect()
+        self.source.turnOn()
+
+    def select_slot(self, slot: int):
+        """
+        Address another SIM928 in the same SIM900 mainframe over the already open serial link.
+        A reconnect after a serial error reopens on the selected slot.
+        :param slot: SIM900 slot to address from now on
+        """
+        self.slot = slot
+        if self.source is not None:
+            self.source.slot = slot
+
+    def set_voltage_on_slot(self, slot: int, voltage):
+        """Select slot, then set its voltage with set_voltage_robustly"""
+        self.select_slot(slot)
+        return self.set_voltage_robustly(voltage)
+
+    def connect(self):
+        """Connect and turn on the source, trying the alternative port once. Returns True on success."""
+        try:
+            self._open()
+            return True
+        except serial.SerialException as e:
+            print(f"Initial connection to SIM928 failed on {self.port}: {e}")
+            # Optionally try the other port immediately
+            self._next_port()
+            print(f"Trying alternative port: {self.port}")
+            try:
+                self._open()
+                print(f"Successfully connected to {self.port}")
+                return True
+            except serial.SerialException as e2:
+                 print(f"Connection failed on alternative port {self.port}: {e2}")
+                 self.source = None # Indicate source is not available
+                 return False
+
+    def set_voltage_robustly(self, voltage):
+        """Attempts to set the voltage on the SIM928 source, handling disconnections."""
+        max_retries = 1 # Try original port, then the other port once
+        retries = 0
+        set_voltage_success = False
+        while retries <= max_retries and not set_voltage_success:
+            try:
+                if not self.source: # Check if source was initialized
+                     print("Error: SIM928 source not available.")
+                     return False # Cannot set voltage if source is not available
+
+                print(f"Attempting to set voltage {voltage:.3f} V on {self.port}...")
+                self.source.setVoltage(voltage)
+                set_voltage_success = True
+                print(f"Successfully set Voltage: {voltage:.3f} V")
+                return True # Voltage set successfully
+
+            except (serial.SerialException, termios.error) as e: # Catch both SerialException and termios.error
+                print(f"Serial/OS error setting voltage on {self.port}: {e}")
+                retries += 1
+                if retries > max_retries:
+                    print("Max retries reached for setting voltage.")
+                    break # Exit the while loop
+
+                print("Attempting to reconnect to alternative port...")
+                try:
+                    self.source.disconnect()
+                except Exception as disconnect_e:
+                    print(f"Note: Error during disconnect (may already be closed): {disconnect_e}")
+
+                # Cycle port
+                self._next_port()
+                print(f"Trying port: {self.port}")
+
+                try:
+                    # Recreate and connect
+                    self._open()
+                    print(f"Successfully reconnected to {self.port}.")
+                    # Retry setting voltage in the next loop iteration
+                except (serial.SerialException, termios.error) as e2: # Also catch termios error on reconnect
+                    print(f"Reconnect failed on {self.port}: {e2}")
+                    # If reconnect fails, break the retry loop for this bias point
+                    break
+                except Exception as general_e:
+                    print(f"Unexpected error during reconnect: {general_e}")
+                    break
+
+            except Exception as general_e:
+                 print(f"Unexpected error setting voltage: {general_e}")
+                 # Decide how to handle unexpected errors, e.g., skip point
+                 break # Exit retry loop
+
+        # If loop finishes without success
+        return False